@@ -15,7 +15,8 @@ from AR.models.utils import (
     make_pad_mask,
     make_pad_mask_left,
     make_reject_y,
-    sample,
+    T2SDegenerationDetector,
+    T2SSampler,
     topk_sampling,
 )
 from AR.modules.embedding import SinePositionalEmbedding, TokenEmbedding
@@ -132,6 +133,12 @@ class T2SBlock:
         else:
             return x * padding_mask
 
+    def qkv_proj(self, x: torch.Tensor):
+        return F.linear(x, self.qkv_w, self.qkv_b)
+
+    def out_proj(self, x: torch.Tensor):
+        return F.linear(x, self.out_w, self.out_b)
+
     def process_prompt(
         self,
         x: torch.Tensor,
@@ -139,7 +146,7 @@ class T2SBlock:
         padding_mask: Optional[torch.Tensor] = None,
         torch_sdpa: bool = True,
     ):
-        q, k, v = F.linear(self.to_mask(x, padding_mask), self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+        q, k, v = self.qkv_proj(self.to_mask(x, padding_mask)).chunk(3, dim=-1)
 
         batch_size = q.shape[0]
         q_len = q.shape[1]
@@ -159,7 +166,7 @@ class T2SBlock:
             attn = scaled_dot_product_attention(q, k, v, attn_mask)
 
         attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
-        attn = F.linear(self.to_mask(attn, padding_mask), self.out_w, self.out_b)
+        attn = self.out_proj(self.to_mask(attn, padding_mask))
 
         x = x + attn
         x = F.layer_norm(x, [self.hidden_dim], self.norm_w1, self.norm_b1, self.norm_eps1)
@@ -181,7 +188,7 @@ class T2SBlock:
         attn_mask: torch.Tensor = None,
         torch_sdpa: bool = True,
     ):
-        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
 
         k_cache = torch.cat([k_cache, k], dim=1)
         v_cache = torch.cat([v_cache, v], dim=1)
@@ -200,7 +207,7 @@ class T2SBlock:
             attn = scaled_dot_product_attention(q, k, v, attn_mask)
 
         attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
-        attn = F.linear(attn, self.out_w, self.out_b)
+        attn = self.out_proj(attn)
 
         x = x + attn
         x = F.layer_norm(
@@ -220,6 +227,104 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        kv_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
+
+        # 原地写入预分配的缓冲区, 只读取前 kv_len + 1 个位置
+        k_cache[:, kv_len : kv_len + 1] = k
+        v_cache[:, kv_len : kv_len + 1] = v
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = kv_len + 1
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = self.out_proj(attn)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
+    def decode_next_token_fixed(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        kv_pos: torch.Tensor,
+        attn_mask: torch.Tensor,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
+
+        # 形状固定: 按位置张量写入整段缓冲区, 注意力覆盖整段缓冲区, 无效位置由 attn_mask(True 为可见)屏蔽
+        k_cache.index_copy_(1, kv_pos, k)
+        v_cache.index_copy_(1, kv_pos, v)
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = k_cache.shape[1]
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache.view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache.view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, attn_mask)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, ~attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = self.out_proj(attn)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -256,6 +361,264 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        kv_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], kv_len, attn_mask, torch_sdpa)
+        return x
+
+    def decode_next_token_fixed(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        kv_pos: torch.Tensor,
+        attn_mask: torch.Tensor,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_fixed(x, k_cache[i], v_cache[i], kv_pos, attn_mask, torch_sdpa)
+        return x
+
+
+def quantize_weight_int8(weight: torch.Tensor) -> torch.Tensor:
+    """按输出通道对称量化为 qint8"""
+    weight = weight.detach().float().cpu()
+    scales = (weight.abs().amax(dim=1) / 127.0).clamp(min=1e-8)
+    zero_points = torch.zeros(weight.shape[0], dtype=torch.long)
+    return torch.quantize_per_channel(weight, scales.double(), zero_points, 0, torch.qint8)
+
+
+def make_dynamic_int8_linear(qweight: torch.Tensor, bias: Optional[torch.Tensor]) -> nn.Module:
+    linear = torch.ao.nn.quantized.dynamic.Linear(qweight.shape[1], qweight.shape[0], bias_=bias is not None)
+    linear.set_weight_bias(qweight, bias.detach().float().cpu() if bias is not None else None)
+    return linear
+
+
+class T2SQuantizedMLP(T2SMLP):
+    """int8 动态量化的 T2SMLP, 仅用于 CPU 上的 eager 推理"""
+
+    def __init__(self, fc1: nn.Module, fc2: nn.Module):
+        self.fc1 = fc1
+        self.fc2 = fc2
+
+    def forward(self, x):
+        return self.fc2(F.relu(self.fc1(x)))
+
+
+class T2SQuantizedBlock(T2SBlock):
+    """qkv/out 投影使用 int8 动态量化 Linear 的 T2SBlock, 仅用于 CPU 上的 eager 推理"""
+
+    def __init__(self, block: T2SBlock, mlp: T2SQuantizedMLP, qkv: nn.Module, out: nn.Module):
+        super().__init__(
+            block.num_heads,
+            block.hidden_dim,
+            mlp,
+            None,
+            None,
+            None,
+            None,
+            block.norm_w1,
+            block.norm_b1,
+            block.norm_eps1,
+            block.norm_w2,
+            block.norm_b2,
+            block.norm_eps2,
+        )
+        self.qkv = qkv
+        self.out = out
+
+    def qkv_proj(self, x: torch.Tensor):
+        return self.qkv(x)
+
+    def out_proj(self, x: torch.Tensor):
+        return self.out(x)
+
+
+class T2SStaticKVCache:
+    """
+    预分配的 kv cache。
+
+    每层一次性分配 [B, max_len, H*D] 的缓冲区, 解码时在当前长度处原地写入, 注意力只读取有效长度,
+    避免 decode_next_token 每步 torch.cat 带来的拷贝和显存分配。批量推理时的 padding mask 同样预分配,
+    新位置默认为 False, 不再需要每步 F.pad。
+    缓冲区写满时扩容: grow_step 为 None 时容量翻倍, 否则每次增加 grow_step(编译路径用来限制形状种类)。
+    """
+
+    def __init__(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], max_len: int, grow_step: int = None):
+        batch_size, kv_len, dim = k_cache[0].shape
+        self.batch_size = batch_size
+        self.kv_len = kv_len
+        self.max_len = max(max_len, kv_len + 1)
+        self.grow_step = grow_step
+        self.k_cache: List[torch.Tensor] = []
+        self.v_cache: List[torch.Tensor] = []
+        for k, v in zip(k_cache, v_cache):
+            k_buffer = k.new_zeros(batch_size, self.max_len, dim)
+            v_buffer = v.new_zeros(batch_size, self.max_len, dim)
+            k_buffer[:, :kv_len] = k
+            v_buffer[:, :kv_len] = v
+            self.k_cache.append(k_buffer)
+            self.v_cache.append(v_buffer)
+        self.padding_mask: Optional[torch.Tensor] = None
+
+    def set_padding_mask(self, padding_mask: torch.Tensor):
+        """padding_mask: [B, 1, 1, kv_len], True 为padding"""
+        self.padding_mask = torch.zeros(
+            (self.batch_size, 1, 1, self.max_len), dtype=torch.bool, device=padding_mask.device
+        )
+        self.padding_mask[..., : self.kv_len] = padding_mask
+
+    def _grow(self):
+        extra = self.max_len if self.grow_step is None else self.grow_step
+        self.k_cache = [F.pad(k, (0, 0, 0, extra)) for k in self.k_cache]
+        self.v_cache = [F.pad(v, (0, 0, 0, extra)) for v in self.v_cache]
+        if self.padding_mask is not None:
+            self.padding_mask = F.pad(self.padding_mask, (0, extra), value=False)
+        self.max_len += extra
+
+    def decode_next_token(self, transformer: T2STransformer, x: torch.Tensor):
+        if self.kv_len >= self.max_len:
+            self._grow()
+        batch_size = self.batch_size
+        attn_mask = None
+        if self.padding_mask is not None:
+            attn_mask = self.padding_mask[:batch_size, :, :, : self.kv_len + 1]
+        x = transformer.decode_next_token_static(
+            x,
+            [k[:batch_size] for k in self.k_cache],
+            [v[:batch_size] for v in self.v_cache],
+            self.kv_len,
+            attn_mask,
+        )
+        self.kv_len += 1
+        return x
+
+    def decode_next_token_fast(self, fast_decoder: "T2SFastDecoder", x: torch.Tensor) -> torch.Tensor:
+        """与 decode_next_token 相同, 但通过编译后的单步函数计算, 直接返回 logits"""
+        if self.kv_len >= self.max_len:
+            self._grow()
+        if self.padding_mask is None:
+            self.padding_mask = torch.zeros((self.batch_size, 1, 1, self.max_len), dtype=torch.bool, device=x.device)
+        batch_size = self.batch_size
+        kv_pos = torch.tensor([self.kv_len], dtype=torch.long, device=x.device)
+        logits = fast_decoder(
+            x,
+            [k[:batch_size] for k in self.k_cache],
+            [v[:batch_size] for v in self.v_cache],
+            kv_pos,
+            self.padding_mask[:batch_size],
+        )
+        self.kv_len += 1
+        return logits
+
+    def index_select(self, index: torch.LongTensor):
+        """只保留 index 对应的行, 结果写回缓冲区的前 len(index) 行"""
+        batch_size = index.shape[0]
+        for buffers in (self.k_cache, self.v_cache):
+            for buffer in buffers:
+                selected = torch.index_select(buffer[: self.batch_size, : self.kv_len], dim=0, index=index)
+                buffer[:batch_size, : self.kv_len] = selected
+        if self.padding_mask is not None:
+            selected = torch.index_select(self.padding_mask[: self.batch_size, ..., : self.kv_len], dim=0, index=index)
+            self.padding_mask[:batch_size, ..., : self.kv_len] = selected
+        self.batch_size = batch_size
+
+
+class T2SDecodeStep(nn.Module):
+    """单步解码(各层 + ar_predict_layer), 所有输入形状固定, 供 torch.compile / torch.jit.trace 使用"""
+
+    def __init__(self, transformer: T2STransformer, ar_predict_layer: nn.Module):
+        super().__init__()
+        self.transformer = transformer
+        self.ar_predict_layer = ar_predict_layer
+
+    def forward(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        kv_pos: torch.Tensor,
+        padding_mask: torch.Tensor,
+    ):
+        positions = torch.arange(padding_mask.shape[-1], device=x.device)
+        attn_mask = (positions <= kv_pos).view(1, 1, 1, -1).logical_and(~padding_mask)
+        x = self.transformer.decode_next_token_fixed(x, k_cache, v_cache, kv_pos, attn_mask)
+        return self.ar_predict_layer(x[:, -1])
+
+
+class T2SFastDecoder:
+    """
+    单步解码的编译快速路径, backend 为 "compile"(torch.compile) 或 "jit"(torch.jit.trace)。
+
+    kv cache 长度按当前长度向上取整到 cache_bucket 的倍数, 写满后再增加一个 cache_bucket,
+    每步只在当前的缓冲区上计算(至多多出 cache_bucket 个被 mask 的位置)。
+    编译结果只与 batch size 和缓冲区长度有关, 可以跨步、跨请求复用。
+    """
+
+    def __init__(
+        self,
+        transformer: T2STransformer,
+        ar_predict_layer: nn.Module,
+        backend: str = "compile",
+        cache_bucket: int = 256,
+        cache_size_limit: int = 64,
+    ):
+        if backend not in ["compile", "jit"]:
+            raise ValueError(f"unknown decode backend: {backend}")
+        self.step = T2SDecodeStep(transformer, ar_predict_layer).eval()
+        self.backend = backend
+        self.cache_bucket = cache_bucket
+        # batch size 与缓冲区长度的每种组合都会编译一次, 只在调用编译函数时放宽重新编译次数上限,
+        # 不修改进程全局的 dynamo 配置
+        self.cache_size_limit = cache_size_limit
+        self.traced = {}
+        self.compiled = None
+        if backend == "compile":
+            self.compiled = torch.compile(self.step, dynamic=False)
+
+    def cache_len(self, src_len: int) -> int:
+        return math.ceil((src_len + 1) / self.cache_bucket) * self.cache_bucket
+
+    def make_kv_cache(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor]) -> T2SStaticKVCache:
+        return T2SStaticKVCache(k_cache, v_cache, self.cache_len(k_cache[0].shape[1]), grow_step=self.cache_bucket)
+
+    def __call__(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        kv_pos: torch.Tensor,
+        padding_mask: torch.Tensor,
+    ) -> torch.Tensor:
+        if self.compiled is not None:
+            with torch._dynamo.config.patch(cache_size_limit=self.cache_size_limit):
+                return self.compiled(x, k_cache, v_cache, kv_pos, padding_mask)
+        key = (x.shape[0], padding_mask.shape[-1], x.dtype, str(x.device))
+        fn = self.traced.get(key)
+        if fn is None:
+            fn = torch.jit.trace(self.step, (x, k_cache, v_cache, kv_pos, padding_mask), check_trace=False)
+            self.traced[key] = fn
+        return fn(x, k_cache, v_cache, kv_pos, padding_mask)
+
+    @torch.no_grad()
+    def warmup(self, batch_sizes: List[int], src_len: int, dim: int, num_layers: int, device, dtype):
+        max_len = self.cache_len(src_len)
+        for batch_size in batch_sizes:
+            x = torch.zeros((batch_size, 1, dim), dtype=dtype, device=device)
+            k_cache = [torch.zeros((batch_size, max_len, dim), dtype=dtype, device=device) for _ in range(num_layers)]
+            v_cache = [torch.zeros((batch_size, max_len, dim), dtype=dtype, device=device) for _ in range(num_layers)]
+            kv_pos = torch.tensor([0], dtype=torch.long, device=device)
+            padding_mask = torch.zeros((batch_size, 1, 1, max_len), dtype=torch.bool, device=device)
+            self(x, k_cache, v_cache, kv_pos, padding_mask)
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -351,6 +714,75 @@ class Text2SemanticDecoder(nn.Module):
             blocks.append(block)
 
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        self.fast_decoder: T2SFastDecoder = None
+
+    def enable_fast_decode(
+        self, backend: str = None, warmup_batch_sizes: Optional[List[int]] = None, warmup_src_len: int = 256
+    ):
+        """
+        启用/关闭编译后的单步解码快速路径(backend 为 None 或 "eager" 时关闭), 并对常用 batch size 预热。
+        编译或预热失败时回退到 eager 解码。
+        """
+        self.fast_decoder = None
+        if backend in [None, "eager"]:
+            return
+        param = self.ar_audio_embedding.word_embeddings.weight
+        quantized = isinstance(self.ar_predict_layer, torch.ao.nn.quantized.dynamic.Linear)
+        if backend == "jit" and quantized:
+            # int8 动态量化 Linear 的 LinearPackedParamsBase 不是 trace 的一部分, 无法 trace
+            print(
+                "Warning: jit decode backend cannot trace int8 quantized layers "
+                "(LinearPackedParamsBase is not part of the active trace), fall back to eager"
+            )
+            return
+        try:
+            fast_decoder = T2SFastDecoder(self.t2s_transformer, self.ar_predict_layer, backend)
+            fast_decoder.warmup(
+                warmup_batch_sizes if warmup_batch_sizes is not None else [1],
+                warmup_src_len, self.model_dim, self.num_layers, param.device, param.dtype
+            )
+        except Exception as e:
+            note = " (int8 quantized layers may not be supported by this backend)" if quantized else ""
+            print(f"Warning: failed to build {backend} decode step{note}, fall back to eager: {e}")
+            return
+        self.fast_decoder = fast_decoder
+
+    def quantize_int8(self, qweights: Optional[dict] = None) -> dict:
+        """
+        把 t2s_transformer 各层的 qkv/out/MLP 投影以及 ar_predict_layer 替换为 int8 动态量化 Linear(CPU 推理)。
+        传入之前返回的量化权重时直接复用, 不再重新量化。
+        量化后会释放训练与旧推理路径使用的 self.h 浮点权重。
+        """
+        qweights = {} if qweights is None else qweights
+        new_qweights = {}
+
+        def make_linear(name: str, weight: torch.Tensor, bias: Optional[torch.Tensor]):
+            qweight = qweights.get(name)
+            if qweight is None:
+                qweight = quantize_weight_int8(weight)
+            new_qweights[name] = qweight
+            return make_dynamic_int8_linear(qweight, bias)
+
+        blocks = []
+        for i, block in enumerate(self.t2s_transformer.blocks):
+            mlp = T2SQuantizedMLP(
+                make_linear(f"blocks.{i}.mlp.fc1", block.mlp.w1, block.mlp.b1),
+                make_linear(f"blocks.{i}.mlp.fc2", block.mlp.w2, block.mlp.b2),
+            )
+            blocks.append(
+                T2SQuantizedBlock(
+                    block,
+                    mlp,
+                    make_linear(f"blocks.{i}.qkv", block.qkv_w, block.qkv_b),
+                    make_linear(f"blocks.{i}.out", block.out_w, block.out_b),
+                )
+            )
+        self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        self.ar_predict_layer = make_linear("ar_predict_layer", self.ar_predict_layer.weight, None)
+        self.h = None
+        # 快速路径引用的是旧的投影层, 需要重新启用
+        self.fast_decoder = None
+        return new_qweights
 
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
@@ -593,6 +1025,12 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs,
     ):
+        static_kv_cache = kwargs.get("static_kv_cache", False)
+        # 退化检测: 命中的序列提前结束, 原因写入调用方传入的 degenerate_flags 列表(None 表示正常结束)
+        degeneration_detection = kwargs.get("degeneration_detection", False)
+        degenerate_flags: list = kwargs.get("degenerate_flags", None)
+        # x_lens 包含参考文本的音素, token 上限只按目标文本的音素数估计
+        target_phones_len: torch.LongTensor = kwargs.get("target_phones_len", None)
         if prompts is None:
             print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
             return self.infer_panel_naive_batched(
@@ -698,39 +1136,84 @@ class Text2SemanticDecoder(nn.Module):
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
+        kv_cache: T2SStaticKVCache = None
+        fast_decoder = self.fast_decoder
         for idx in tqdm(range(1500)):
-            if idx == 0:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+            if idx > 0 and fast_decoder is not None:
+                logits = kv_cache.decode_next_token_fast(fast_decoder, xy_pos)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
-            logits = self.ar_predict_layer(xy_dec[:, -1])
+                if idx == 0:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                    if fast_decoder is not None:
+                        kv_cache = fast_decoder.make_kv_cache(k_cache, v_cache)
+                    elif static_kv_cache:
+                        kv_cache = T2SStaticKVCache(k_cache, v_cache, src_len + 1500)
+                elif kv_cache is not None:
+                    xy_dec = kv_cache.decode_next_token(self.t2s_transformer, xy_pos)
+                else:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(
+                        xy_pos, k_cache, v_cache, attn_mask
+                    )
+                logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
+                sampler = T2SSampler(
+                    y.shape[0],
+                    logits.shape[-1],
+                    logits.device,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                    dtype=logits.dtype,
+                )
+                sampler.set_history(y)
+                detector = None
+                if degeneration_detection:
+                    detector = T2SDegenerationDetector(
+                        target_phones_len if target_phones_len is not None else x_lens,
+                        y.device, mute_emb_sim_matrix=kwargs.get("mute_emb_sim_matrix", None)
+                    )
+                if kv_cache is not None:
+                    kv_cache.set_padding_mask(attn_mask[:, :1, -1:])
+                else:
+                    attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
                 logits = logits[:, :-1]
-            else:
+            elif kv_cache is None:
                 attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sampler.sample(logits)
+            sampler.update(samples)
 
             y = torch.concat([y, samples], dim=1)
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
             reserved_idx_of_batch_for_y = None
-            if (self.EOS in samples[:, 0]) or (self.EOS in tokens):  ###如果生成到EOS，则停止
-                l1 = samples[:, 0] == self.EOS
-                l2 = tokens == self.EOS
-                l = l1.logical_or(l2)
+            l1 = samples[:, 0] == self.EOS
+            l2 = tokens == self.EOS
+            l = l1.logical_or(l2)
+            if detector is not None:
+                reasons, cuts = detector.update(y)
+                # 已经生成 EOS 的行按正常结束处理
+                reasons.masked_fill_(l, T2SDegenerationDetector.NONE)
+                l = l.logical_or(reasons != T2SDegenerationDetector.NONE)
+            if l.any():  ###如果生成到EOS，则停止
                 removed_idx_of_batch_for_y = torch.where(l == True)[0].tolist()
                 reserved_idx_of_batch_for_y = torch.where(l == False)[0]
                 # batch_indexs = torch.tensor(batch_idx_map, device=y.device)[removed_idx_of_batch_for_y]
                 for i in removed_idx_of_batch_for_y:
                     batch_index = batch_idx_map[i]
-                    idx_list[batch_index] = idx
-                    y_list[batch_index] = y[i, :-1]
+                    cut = 0
+                    if detector is not None and reasons[i] != T2SDegenerationDetector.NONE:
+                        # 丢弃末尾的循环/长静音, 至少保留一个 token
+                        cut = min(int(cuts[i]), idx - 1) if idx > 0 else 0
+                        reason = T2SDegenerationDetector.REASONS[int(reasons[i])]
+                        print(f"T2S degenerate sequence detected ({reason}) in batch item {batch_index}")
+                        if degenerate_flags is not None:
+                            degenerate_flags[batch_index] = reason
+                    idx_list[batch_index] = idx - cut
+                    y_list[batch_index] = y[i, : y.shape[1] - 1 - cut]
 
                 batch_idx_map = [batch_idx_map[i] for i in reserved_idx_of_batch_for_y.tolist()]
 
@@ -738,8 +1221,14 @@ class Text2SemanticDecoder(nn.Module):
             if reserved_idx_of_batch_for_y is not None:
                 # index = torch.LongTensor(batch_idx_map).to(y.device)
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
-                attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
-                if k_cache is not None:
+                sampler.index_select(reserved_idx_of_batch_for_y)
+                if detector is not None:
+                    detector.index_select(reserved_idx_of_batch_for_y)
+                if kv_cache is not None:
+                    kv_cache.index_select(reserved_idx_of_batch_for_y)
+                else:
+                    attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
+                if kv_cache is None and k_cache is not None:
                     for i in range(len(k_cache)):
                         k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
                         v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
@@ -828,6 +1317,9 @@ class Text2SemanticDecoder(nn.Module):
     ):
         mute_emb_sim_matrix = kwargs.get("mute_emb_sim_matrix", None)
         chunk_split_thershold = kwargs.get("chunk_split_thershold", 0.3)
+        # 自适应分块策略(见 TTS_infer_pack/StreamingPolicy.py), 每步读取当前块长
+        chunk_policy = kwargs.get("chunk_policy", None)
+        static_kv_cache = kwargs.get("static_kv_cache", False)
         check_token_num = 2
 
 
@@ -884,23 +1376,44 @@ class Text2SemanticDecoder(nn.Module):
 
         token_counter = 0
         curr_ptr = prefix_len
+        kv_cache: T2SStaticKVCache = None
+        fast_decoder = self.fast_decoder
         for idx in tqdm(range(1500)):
             token_counter+=1
-            if xy_attn_mask is not None:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+            if xy_attn_mask is None and fast_decoder is not None:
+                logits = kv_cache.decode_next_token_fast(fast_decoder, xy_pos)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
-
-            logits = self.ar_predict_layer(xy_dec[:, -1])
+                if xy_attn_mask is not None:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                    if fast_decoder is not None:
+                        kv_cache = fast_decoder.make_kv_cache(k_cache, v_cache)
+                    elif static_kv_cache:
+                        kv_cache = T2SStaticKVCache(k_cache, v_cache, src_len + 1500)
+                elif kv_cache is not None:
+                    xy_dec = kv_cache.decode_next_token(self.t2s_transformer, xy_pos)
+                else:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+
+                logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
                 xy_attn_mask = None
+                sampler = T2SSampler(
+                    y.shape[0],
+                    logits.shape[-1],
+                    logits.device,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                    dtype=logits.dtype,
+                )
+                sampler.set_history(y)
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sampler.sample(logits)
+            sampler.update(samples)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -925,6 +1438,8 @@ class Text2SemanticDecoder(nn.Module):
                     yield y[:, curr_ptr:] if curr_ptr<y.shape[1] else None, True
                 break
 
+            if chunk_policy is not None:
+                chunk_length = chunk_policy.chunk_length
 
             if streaming_mode and (mute_emb_sim_matrix is not None) and (token_counter >= chunk_length+check_token_num):
                 score = mute_emb_sim_matrix[y[0, curr_ptr:]] - chunk_split_thershold
@@ -961,6 +1476,70 @@ class Text2SemanticDecoder(nn.Module):
 
 
 
+    def prefill_single(
+        self,
+        x: torch.LongTensor,  #####单条文本token [1, x_len]
+        prompts: Optional[torch.LongTensor],  ####参考音频token [1, y_len]
+        bert_feature: torch.LongTensor,
+    ):
+        """
+        单条序列的首步推理(与 infer_panel_naive 的 idx == 0 相同),
+        返回 logits、各层 kv cache 以及 prompt 长度, 供连续批处理调度器把该序列合并进运行中的批次。
+        """
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+
+        x_len = x.shape[1]
+        if prompts is not None:
+            y_emb = self.ar_audio_embedding(prompts)
+            y_len = y_emb.shape[1]
+            y_pos = self.ar_audio_position(y_emb)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+        else:
+            y_len = 0
+            xy_pos = x
+
+        src_len = x_len + y_len
+        x_attn_mask_pad = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool),
+            (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
+            value=True,
+        )
+        y_attn_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = (
+            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+            .view(1, 1, src_len, src_len)
+            .expand(-1, self.num_head, -1, -1)
+            .to(device=x.device, dtype=torch.bool)
+        )
+
+        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        logits = self.ar_predict_layer(xy_dec[:, -1])
+        return logits, k_cache, v_cache, y_len
+
+    def decode_next_token_batched(
+        self,
+        last_tokens: torch.LongTensor,  ### [B, 1] 每行上一步的token
+        positions: torch.LongTensor,  ### [B] 每行的位置编码下标
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        attn_mask: torch.Tensor,  ### [B, 1, 1, kv_len + 1], True 为padding
+    ):
+        """
+        对一个由不同请求拼成的批次解码一步, 每行的位置编码各自独立。
+        """
+        y_emb = self.ar_audio_embedding(last_tokens)
+        pe = self.ar_audio_position.pe[0, positions].unsqueeze(1).to(dtype=y_emb.dtype, device=y_emb.device)
+        xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * pe
+        xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+        logits = self.ar_predict_layer(xy_dec[:, -1])
+        return logits, k_cache, v_cache
+
     def infer_panel(
         self,
         x: torch.LongTensor,  #####全部文本token
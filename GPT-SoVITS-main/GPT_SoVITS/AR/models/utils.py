@@ -199,6 +199,108 @@ def sample(
     return idx_next, probs
 
 
+class T2SSampler:
+    """
+    逐步解码用的采样器, 与 sample() 的分布一致, 但:
+    - top_p >= 1、repetition_penalty == 1、top_k 覆盖整个词表时跳过对应计算;
+    - 重复惩罚通过每行的 token 计数表完成, 每步只更新新 token, 不再对整段历史做 gather/scatter;
+    - 启用 top_k 时只在 top_k 个候选上做 softmax 与采样;
+    - 中间结果写入预分配的缓冲区。
+    与 sample() 相同, 重复惩罚会原地作用在传入的 logits 上。
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        vocab_size: int,
+        device: torch.device,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.0,
+        dtype: torch.dtype = torch.float32,
+    ):
+        self.batch_size = batch_size
+        self.vocab_size = vocab_size
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = max(temperature, 1e-5)
+        self.repetition_penalty = repetition_penalty
+
+        self.counts = torch.zeros((batch_size, vocab_size), dtype=torch.int32, device=device)
+        self.ones = torch.ones((batch_size, 1), dtype=torch.int32, device=device)
+        self.work = torch.empty((batch_size, vocab_size), dtype=dtype, device=device)
+        self.factor = torch.empty((batch_size, vocab_size), dtype=dtype, device=device)
+        self.negative = torch.empty((batch_size, vocab_size), dtype=torch.bool, device=device)
+        self.absent = torch.empty((batch_size, vocab_size), dtype=torch.bool, device=device)
+        k = top_k if top_k is not None and 0 < top_k < vocab_size else vocab_size
+        self.noise = torch.empty((batch_size, k), dtype=dtype, device=device)
+
+    def set_history(self, tokens: torch.Tensor):
+        """tokens: [B, T] 已有的历史(prompt)"""
+        batch_size = tokens.shape[0]
+        self.counts[:batch_size].zero_()
+        if tokens.shape[1] > 0:
+            self.counts[:batch_size].scatter_add_(
+                1, tokens.long(), self.ones[:batch_size].expand(-1, tokens.shape[1])
+            )
+
+    def update(self, tokens: torch.Tensor):
+        """tokens: [B, 1] 本步采样结果"""
+        batch_size = tokens.shape[0]
+        self.counts[:batch_size].scatter_add_(1, tokens.long(), self.ones[:batch_size])
+
+    def index_select(self, index: torch.LongTensor):
+        """只保留 index 对应的行, 写回计数表的前 len(index) 行"""
+        batch_size = index.shape[0]
+        self.counts[:batch_size] = torch.index_select(self.counts[: self.batch_size], dim=0, index=index)
+        self.batch_size = batch_size
+
+    def sample(self, logits: torch.Tensor) -> torch.Tensor:
+        """logits: [B, V'] (V' <= vocab_size, 前若干步会去掉 EOS 列); 返回 [B, 1] int"""
+        batch_size, vocab_size = logits.shape
+
+        if self.repetition_penalty != 1.0:
+            negative = self.negative[:batch_size, :vocab_size]
+            absent = self.absent[:batch_size, :vocab_size]
+            factor = self.factor[:batch_size, :vocab_size]
+            torch.lt(logits, 0, out=negative)
+            torch.eq(self.counts[:batch_size, :vocab_size], 0, out=absent)
+            factor.fill_(1.0 / self.repetition_penalty)
+            factor.masked_fill_(negative, self.repetition_penalty)
+            factor.masked_fill_(absent, 1.0)
+            logits.mul_(factor)
+
+        work = self.work[:batch_size, :vocab_size]
+        work.copy_(logits)
+
+        if self.top_p is not None and self.top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(work, descending=True)
+            cum_probs = torch.cumsum(torch.nn.functional.softmax(sorted_logits, dim=-1), dim=-1)
+            sorted_indices_to_remove = cum_probs > self.top_p
+            sorted_indices_to_remove[:, 0] = False  # keep at least one option
+            indices_to_remove = sorted_indices_to_remove.scatter(
+                dim=1,
+                index=sorted_indices,
+                src=sorted_indices_to_remove,
+            )
+            work.masked_fill_(indices_to_remove, -float("Inf"))
+
+        if self.temperature != 1.0:
+            work.div_(self.temperature)
+
+        if self.top_k is not None and 0 < self.top_k < vocab_size:
+            values, indices = torch.topk(work, self.top_k)
+            probs = torch.nn.functional.softmax(values, dim=-1)
+            q = self.noise[:batch_size, : self.top_k].exponential_(1)
+            choice = torch.argmax(probs / q, dim=-1, keepdim=True)
+            return torch.gather(indices, 1, choice).to(dtype=torch.int)
+
+        probs = torch.nn.functional.softmax(work, dim=-1)
+        q = torch.empty_like(probs).exponential_(1)
+        return torch.argmax(probs / q, dim=-1, keepdim=True).to(dtype=torch.int)
+
+
 def dpo_loss(
     policy_chosen_logps: torch.FloatTensor,
     policy_rejected_logps: torch.FloatTensor,
@@ -280,3 +382,81 @@ def make_reject_y(y_o, y_lens):
     reject_y_lens = torch.tensor(reject_y_lens, device=y_lens.device)
 
     return reject_y, reject_y_lens
+
+
+class T2SDegenerationDetector:
+    """
+    批量解码时逐行检测退化的序列, 命中的行应像生成 EOS 一样提前结束, 并标记为需要重采样:
+    - budget: 生成的 token 数超过按目标文本音素数(不含参考文本)估计的上限(语速下限 min_phones_per_sec);
+    - loop: 末尾 loop_min_tokens 个 token 以 1~loop_max_period 为周期重复;
+    - silence: 连续静音 token(与静音 token 的相似度 >= silence_threshold)超过 silence_max_tokens 个。
+    update() 返回每行的退化原因与需要从末尾丢弃的 token 数(只保留一个循环周期/一小段静音)。
+    """
+
+    REASONS = [None, "budget", "loop", "silence"]
+    NONE, BUDGET, LOOP, SILENCE = 0, 1, 2, 3
+
+    def __init__(
+        self,
+        phones_lens: torch.LongTensor,
+        device: torch.device,
+        mute_emb_sim_matrix: Optional[torch.Tensor] = None,
+        token_rate: int = 25,
+        min_phones_per_sec: float = 3.0,
+        budget_slack_tokens: int = 25,
+        loop_min_tokens: int = 50,
+        loop_max_period: int = 25,
+        silence_threshold: float = 0.8,
+        silence_max_tokens: int = 100,
+        check_interval: int = 5,
+    ):
+        self.token_rate = token_rate
+        self.budget = (
+            torch.ceil(phones_lens.to(device=device, dtype=torch.float32) / min_phones_per_sec * token_rate).long()
+            + budget_slack_tokens
+        )
+        self.mute_sim = mute_emb_sim_matrix.to(device) if mute_emb_sim_matrix is not None else None
+        self.loop_min_tokens = loop_min_tokens
+        self.loop_max_period = loop_max_period
+        self.silence_threshold = silence_threshold
+        self.silence_max_tokens = silence_max_tokens
+        self.check_interval = check_interval
+        self.silence_run = torch.zeros_like(self.budget)
+        self.generated = 0
+
+    def index_select(self, index: torch.LongTensor):
+        self.budget = torch.index_select(self.budget, dim=0, index=index)
+        self.silence_run = torch.index_select(self.silence_run, dim=0, index=index)
+
+    def update(self, y: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """y: [B, T] 含本步新 token 的序列; 返回 (reasons [B], cuts [B])"""
+        self.generated += 1
+        reasons = torch.zeros_like(self.budget)
+        cuts = torch.zeros_like(self.budget)
+
+        reasons.masked_fill_(self.generated > self.budget, self.BUDGET)
+
+        last = y[:, -1].long()
+        is_mute = torch.zeros_like(last, dtype=torch.bool)
+        if self.mute_sim is not None:
+            is_mute = self.mute_sim[last] >= self.silence_threshold
+            self.silence_run = (self.silence_run + 1) * is_mute
+            silence = self.silence_run > self.silence_max_tokens
+            reasons.masked_fill_(silence, self.SILENCE)
+            cuts = torch.where(silence, self.silence_run - self.token_rate, cuts)
+
+        # 周期检测开销较大, 每 check_interval 步检测一次即可
+        length = self.loop_min_tokens
+        if self.generated % self.check_interval == 0 and self.generated >= length + 1:
+            tail = y[:, -length:]
+            loop = torch.zeros_like(is_mute)
+            for period in range(1, min(self.loop_max_period, self.generated - length) + 1):
+                repeated = (tail == y[:, -length - period : -period]).all(dim=-1)
+                if period == 1:
+                    # 同一个静音 token 的长串属于停顿, 交给静音检测
+                    repeated = repeated & ~is_mute
+                loop |= repeated
+            reasons.masked_fill_(loop, self.LOOP)
+            cuts.masked_fill_(loop, length)
+
+        return reasons, cuts
@@ -0,0 +1,85 @@
+from typing import List, Tuple
+
+
+class BucketPlanner:
+    """
+    按预测的解码长度把句子分桶, 用于替代 to_batch 中 batch_size/batch_threshold 的贪心切分。
+
+    每句的长度估计为 参考(音素+语义token) + 本句音素数 * (1 + tokens_per_phone),
+    即解码结束时该行 kv cache 的长度。同一批内所有行都按最长的一行计算注意力与显存,
+    因此一批的代价记为 其补零的token数 + batch_overhead_rows * 最长长度(每多一批就多一轮串行解码)。
+    在 行数 <= max_batch_size、行数 * 最长长度 <= max_batch_tokens 的约束下,
+    对按长度排序后的句子做动态规划, 求总代价最小的连续切分。
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 16,
+        max_batch_tokens: int = 32768,
+        tokens_per_phone: float = 2.0,
+        batch_overhead_rows: float = 4.0,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max_batch_tokens
+        self.tokens_per_phone = tokens_per_phone
+        self.batch_overhead_rows = batch_overhead_rows
+
+    def predict_length(self, phones_len: int, prefix_len: int = 0) -> int:
+        return prefix_len + int(round(phones_len * (1 + self.tokens_per_phone)))
+
+    def plan(self, phones_lens: List[int], prefix_len: int = 0) -> Tuple[List[List[int]], dict]:
+        """
+        Args:
+            phones_lens: 每句的音素数
+            prefix_len: 参考文本音素数 + 参考音频语义token数, 所有句子相同
+
+        Returns:
+            batch_index_list: 每批句子在输入中的下标
+            stats: 实际token数、补零后的token数与补零效率
+        """
+        n = len(phones_lens)
+        lengths = [self.predict_length(length, prefix_len) for length in phones_lens]
+        order = sorted(range(n), key=lambda i: lengths[i])
+        sorted_lengths = [lengths[i] for i in order]
+        prefix_sum = [0]
+        for length in sorted_lengths:
+            prefix_sum.append(prefix_sum[-1] + length)
+
+        # best[j]: 前 j 句(排序后)的最小代价; cut[j]: 最后一批的起点
+        inf = float("inf")
+        best = [0.0] + [inf] * n
+        cut = [0] * (n + 1)
+        for j in range(1, n + 1):
+            longest = sorted_lengths[j - 1]
+            for size in range(1, min(self.max_batch_size, j) + 1):
+                # 单句超出显存预算时也只能单独成批
+                if size > 1 and self.max_batch_tokens > 0 and size * longest > self.max_batch_tokens:
+                    break
+                i = j - size
+                padding = size * longest - (prefix_sum[j] - prefix_sum[i])
+                cost = best[i] + padding + self.batch_overhead_rows * longest
+                if cost < best[j]:
+                    best[j] = cost
+                    cut[j] = i
+
+        batch_index_list = []
+        j = n
+        while j > 0:
+            i = cut[j]
+            batch_index_list.append(order[i:j])
+            j = i
+        batch_index_list.reverse()
+
+        return batch_index_list, self.padding_stats(lengths, batch_index_list)
+
+    @staticmethod
+    def padding_stats(lengths: List[int], batch_index_list: List[List[int]]) -> dict:
+        """按给定的切分统计补零效率, 用于与原有切分方式对比"""
+        real_tokens = sum(lengths[i] for batch in batch_index_list for i in batch)
+        padded_tokens = sum(len(batch) * max(lengths[i] for i in batch) for batch in batch_index_list if batch)
+        return {
+            "real_tokens": real_tokens,
+            "padded_tokens": padded_tokens,
+            "padding_efficiency": real_tokens / padded_tokens if padded_tokens > 0 else 1.0,
+            "num_batches": len(batch_index_list),
+        }
@@ -0,0 +1,257 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import onnxruntime as ort
+import torch
+
+from AR.models.utils import sample
+
+
+def make_session_options(intra_op_num_threads: int = 0, inter_op_num_threads: int = 1) -> ort.SessionOptions:
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # 逐步解码的图很小, 顺序执行 + 少量 inter-op 线程可以避免线程调度开销
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if intra_op_num_threads > 0:
+        options.intra_op_num_threads = intra_op_num_threads
+    if inter_op_num_threads > 0:
+        options.inter_op_num_threads = inter_op_num_threads
+    return options
+
+
+def find_onnx_models(model_dir: str) -> Tuple[str, str, Optional[str]]:
+    """
+    Find the graphs exported by onnx_export.py in model_dir.
+    Returns the paths of <name>_t2s_fsdec.onnx, <name>_t2s_sdec.onnx and <name>_vits.onnx (None if missing).
+    """
+    for file_name in sorted(os.listdir(model_dir)):
+        if not file_name.endswith("_t2s_fsdec.onnx"):
+            continue
+        project_name = file_name[: -len("_t2s_fsdec.onnx")]
+        sdec_path = os.path.join(model_dir, f"{project_name}_t2s_sdec.onnx")
+        if not os.path.exists(sdec_path):
+            continue
+        vits_path = os.path.join(model_dir, f"{project_name}_vits.onnx")
+        return (
+            os.path.join(model_dir, file_name),
+            sdec_path,
+            vits_path if os.path.exists(vits_path) else None,
+        )
+    raise FileNotFoundError(f"no *_t2s_fsdec.onnx / *_t2s_sdec.onnx found in {model_dir}")
+
+
+def run_with_binding(session: ort.InferenceSession, output_names: List[str], inputs: dict) -> List[ort.OrtValue]:
+    """通过 IO binding 运行, 输出保留为 OrtValue, kv cache 在步与步之间不经过 numpy 拷贝"""
+    binding = session.io_binding()
+    for name, value in inputs.items():
+        if isinstance(value, np.ndarray):
+            value = ort.OrtValue.ortvalue_from_numpy(value)
+        binding.bind_ortvalue_input(name, value)
+    for name in output_names:
+        binding.bind_output(name, "cpu")
+    session.run_with_iobinding(binding)
+    return binding.get_outputs()
+
+
+class OnnxT2SBackend:
+    """
+    用 onnx_export.py 导出的 T2SFirstStageDecoder / T2SStageDecoder 在 ONNX Runtime(CPU) 上做 T2S 自回归解码。
+
+    接口与 Text2SemanticDecoder 的 infer_panel_naive / infer_panel_naive_batched / infer_panel_batch_infer 一致。
+    文本编码(embedding + bert_proj + 位置编码)只做一次, 仍使用已加载的 PyTorch 模型;
+    采样在图外进行, 以支持请求的 top_k/top_p/temperature/repetition_penalty。
+    导出的首步图不输出 logits, 因此第一个 token 使用图内(导出时配置)的采样结果。
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        t2s_model,
+        intra_op_num_threads: int = 0,
+        inter_op_num_threads: int = 1,
+    ):
+        fsdec_path, sdec_path, _ = find_onnx_models(model_dir)
+        options = make_session_options(intra_op_num_threads, inter_op_num_threads)
+        providers = ["CPUExecutionProvider"]
+        self.fsdec = ort.InferenceSession(fsdec_path, sess_options=options, providers=providers)
+        self.sdec = ort.InferenceSession(sdec_path, sess_options=options, providers=providers)
+        self.fsdec_outputs = [output.name for output in self.fsdec.get_outputs()]
+        self.sdec_outputs = [output.name for output in self.sdec.get_outputs()]
+        self.model = None
+        self.EOS = None
+        self.set_model(t2s_model)
+
+    def set_model(self, t2s_model):
+        self.model = t2s_model
+        self.EOS = t2s_model.EOS
+
+    def encode_text(self, x: torch.LongTensor, bert_feature: torch.Tensor) -> np.ndarray:
+        with torch.no_grad():
+            x = self.model.ar_text_embedding(x)
+            x = x + self.model.bert_proj(bert_feature.transpose(1, 2))
+            x = self.model.ar_text_position(x)
+        return x.detach().float().cpu().numpy()
+
+    def infer_panel_naive(
+        self,
+        x: torch.LongTensor,  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        streaming_mode: bool = False,
+        chunk_length: int = 24,
+        **kwargs,
+    ):
+        if prompts is None:
+            raise ValueError("the ONNX T2S backend requires prompt semantic tokens")
+        mute_emb_sim_matrix = kwargs.get("mute_emb_sim_matrix", None)
+        chunk_split_thershold = kwargs.get("chunk_split_thershold", 0.3)
+        # 自适应分块策略(见 TTS_infer_pack/StreamingPolicy.py), 每步读取当前块长
+        chunk_policy = kwargs.get("chunk_policy", None)
+        check_token_num = 2
+
+        x = self.encode_text(x, bert_feature)
+        prompts = prompts.detach().cpu().to(torch.int64)
+        prefix_len = prompts.shape[1]
+
+        y: torch.Tensor = None
+        y_value = k = v = y_emb = x_example = None
+        stop = False
+        token_counter = 0
+        curr_ptr = prefix_len
+        for idx in range(1500):
+            token_counter += 1
+            if idx == 0:
+                y_value, k, v, y_emb, x_example = run_with_binding(
+                    self.fsdec, self.fsdec_outputs, {"x": x, "prompts": prompts.numpy()}
+                )
+                y = torch.from_numpy(y_value.numpy()).to(torch.int64)
+                samples = y[:, -1:]
+                logits = None
+            else:
+                _, k, v, y_emb, logits, _ = run_with_binding(
+                    self.sdec,
+                    self.sdec_outputs,
+                    {"iy": y_value, "ik": k, "iv": v, "iy_emb": y_emb, "ix_example": x_example},
+                )
+                logits = torch.from_numpy(logits.numpy()).float()
+                if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
+                    logits = logits[:, :-1]
+                samples = sample(
+                    logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
+                )[0].to(torch.int64)
+                y = torch.concat([y, samples], dim=1)
+
+            if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
+                print("use early stop num:", early_stop_num)
+                stop = True
+
+            if logits is not None and (torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS):
+                stop = True
+                y = y[:, :-1]
+                token_counter -= 1
+
+            if idx == 1499:
+                stop = True
+
+            if stop:
+                if streaming_mode:
+                    yield y[:, curr_ptr:] if curr_ptr < y.shape[1] else None, True
+                break
+
+            if chunk_policy is not None:
+                chunk_length = chunk_policy.chunk_length
+
+            if streaming_mode and (mute_emb_sim_matrix is not None) and (token_counter >= chunk_length + check_token_num):
+                score = mute_emb_sim_matrix[y[0, curr_ptr:]] - chunk_split_thershold
+                score[score < 0] = -1
+                score[:-1] = score[:-1] + score[1:]  ##考虑连续两个token
+                argmax_idx = score.argmax()
+
+                if score[argmax_idx] >= 0 and argmax_idx + 1 >= chunk_length:
+                    yield y[:, curr_ptr:], False
+                    token_counter -= argmax_idx + 1
+                    curr_ptr += argmax_idx + 1
+
+            elif streaming_mode and (mute_emb_sim_matrix is None) and (token_counter >= chunk_length):
+                yield y[:, -token_counter:], False
+                curr_ptr += token_counter
+                token_counter = 0
+
+            # 下一步的输入只需要把新 token 写回 y, kv cache 保持为 OrtValue
+            y_value = ort.OrtValue.ortvalue_from_numpy(np.ascontiguousarray(y.numpy()))
+
+        if not streaming_mode:
+            yield y, idx
+
+    def infer_panel_naive_batched(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        # 导出的图只支持 batch size 1, 逐句解码
+        y_list = []
+        idx_list = []
+        for i in range(len(x)):
+            y, idx = next(
+                self.infer_panel_naive(
+                    x[i].unsqueeze(0),
+                    x_lens[i],
+                    prompts[i].unsqueeze(0) if prompts is not None else None,
+                    bert_feature[i].unsqueeze(0),
+                    top_k,
+                    top_p,
+                    early_stop_num,
+                    temperature,
+                    repetition_penalty,
+                    **kwargs,
+                )
+            )
+            y_list.append(y[0])
+            idx_list.append(idx)
+
+        return y_list, idx_list
+
+    infer_panel_batch_infer = infer_panel_naive_batched
+
+
+class OnnxVitsBackend:
+    """
+    onnx_export.py 导出的 VITS 图(v1/v2, 单条参考音频, 语速为1)。
+    参考音频以目标采样率的波形输入, 频谱在图内计算。
+    """
+
+    def __init__(self, model_dir: str, intra_op_num_threads: int = 0, inter_op_num_threads: int = 1):
+        _, _, vits_path = find_onnx_models(model_dir)
+        if vits_path is None:
+            raise FileNotFoundError(f"no *_vits.onnx found in {model_dir}")
+        options = make_session_options(intra_op_num_threads, inter_op_num_threads)
+        self.session = ort.InferenceSession(vits_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def decode(self, pred_semantic: torch.LongTensor, text_seq: torch.LongTensor, ref_audio: torch.Tensor):
+        """pred_semantic: [1, 1, T], text_seq: [1, N], ref_audio: [1, L]; returns audio [samples]"""
+        (audio,) = run_with_binding(
+            self.session,
+            self.output_names,
+            {
+                "text_seq": text_seq.detach().cpu().to(torch.int64).numpy(),
+                "pred_semantic": pred_semantic.detach().cpu().to(torch.int64).numpy(),
+                "ref_audio": ref_audio.detach().cpu().float().numpy(),
+            },
+        )
+        return torch.from_numpy(audio.numpy()).reshape(-1)
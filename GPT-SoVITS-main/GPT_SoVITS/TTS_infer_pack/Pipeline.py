@@ -0,0 +1,97 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator
+
+import torch
+
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class TwoStagePipeline:
+    """
+    两级流水线: first_stage(T2S) 与 second_stage(VITS/vocoder) 各自在一个工作线程中运行,
+    中间通过有界队列连接, 使前一批的声码与后一批的语义 token 预测重叠执行。
+    结果按输入顺序产出; 任一阶段出错时在调用方线程重新抛出。
+    调用方提前停止迭代(或关闭生成器)时, 两个工作线程会在处理完当前这一项后退出。
+    """
+
+    def __init__(
+        self,
+        first_stage: Callable[[Any], Any],
+        second_stage: Callable[[Any], Any],
+        max_queue_size: int = 2,
+    ):
+        self.first_stage = first_stage
+        self.second_stage = second_stage
+        self.max_queue_size = max(1, max_queue_size)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        middle = queue.Queue(maxsize=self.max_queue_size)
+        output = queue.Queue(maxsize=self.max_queue_size)
+        stop = threading.Event()
+
+        def put(q: queue.Queue, value) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q: queue.Queue):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def produce():
+            # torch.no_grad 是线程局部的, 工作线程需要单独开启
+            try:
+                with torch.no_grad():
+                    for item in items:
+                        if stop.is_set() or not put(middle, self.first_stage(item)):
+                            return
+            except BaseException as e:
+                put(middle, _StageError(e))
+                return
+            put(middle, _END)
+
+        def consume():
+            try:
+                with torch.no_grad():
+                    while True:
+                        value = get(middle)
+                        if value is _END or isinstance(value, _StageError):
+                            put(output, value)
+                            return
+                        if not put(output, self.second_stage(value)):
+                            return
+            except BaseException as e:
+                put(output, _StageError(e))
+
+        threads = [
+            threading.Thread(target=produce, name="tts-pipeline-t2s", daemon=True),
+            threading.Thread(target=consume, name="tts-pipeline-vits", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                value = output.get()
+                if value is _END:
+                    break
+                if isinstance(value, _StageError):
+                    raise value.error
+                yield value
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+from typing import Callable, Optional
+
+import torch
+from torch import nn
+
+# 缓存内容格式变化时递增, 使旧缓存失效
+CACHE_FORMAT_VERSION = 2
+
+
+def source_fingerprint(path: str) -> str:
+    """权重文件/目录的路径与修改时间, 用于判断磁盘上的量化缓存是否过期"""
+    mtimes = []
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                mtimes.append(os.path.getmtime(os.path.join(root, file_name)))
+    elif os.path.exists(path):
+        mtimes.append(os.path.getmtime(path))
+    return f"{os.path.abspath(path)}|{max(mtimes) if mtimes else 0}|{torch.__version__}"
+
+
+def quantized_cache_path(cache_dir: Optional[str], name: str, source_path: str) -> Optional[str]:
+    if cache_dir is None:
+        return None
+    key = hashlib.sha1(
+        f"{name}|{CACHE_FORMAT_VERSION}|{source_fingerprint(source_path)}".encode("utf-8")
+    ).hexdigest()
+    return os.path.join(cache_dir, f"{name}_int8_{key[:16]}.pt")
+
+
+def save_quantized(state: dict, path: Optional[str]):
+    """只保存张量字典(量化权重/state_dict), 不序列化模块对象"""
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    try:
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: failed to write quantization cache {path}: {e}")
+
+
+def load_quantized(path: Optional[str]) -> Optional[dict]:
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        # weights_only: 缓存目录中的文件只会被当作张量数据读取, 不会执行任意代码
+        return torch.load(path, map_location="cpu", weights_only=True)
+    except Exception as e:
+        print(f"Warning: failed to read quantization cache {path}: {e}")
+        return None
+
+
+def quantize_module_int8(module: nn.Module) -> nn.Module:
+    """把模块中所有 nn.Linear 替换为 int8 动态量化 Linear(仅 CPU)"""
+    return torch.ao.quantization.quantize_dynamic(module.float().cpu(), {nn.Linear}, dtype=torch.qint8)
+
+
+def load_or_quantize_module(
+    build_module: Callable[[], nn.Module],
+    build_skeleton: Callable[[], nn.Module],
+    name: str,
+    source_path: str,
+    cache_dir: Optional[str] = None,
+) -> nn.Module:
+    """
+    优先从磁盘加载量化后的 state_dict: 按配置构建不加载权重的模块骨架, 同样做动态量化后 load_state_dict,
+    命中时既不加载浮点权重也不重新量化。未命中(或缓存与当前模型结构不匹配)时构建浮点模块、量化并写入缓存。
+    """
+    path = quantized_cache_path(cache_dir, name, source_path)
+    state = load_quantized(path)
+    if state is not None:
+        try:
+            module = quantize_module_int8(build_skeleton().eval())
+            module.load_state_dict(state)
+            print(f"Loaded int8 {name} from {path}")
+            return module.eval()
+        except Exception as e:
+            print(f"Warning: quantization cache {path} does not match {name}, re-quantizing: {e}")
+    module = quantize_module_int8(build_module().eval())
+    save_quantized(module.state_dict(), path)
+    return module
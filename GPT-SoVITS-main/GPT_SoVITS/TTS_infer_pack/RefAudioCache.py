@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import numpy as np
+import torch
+
+
+class RefAudioCache:
+    """
+    参考音频特征的多条目 LRU 缓存。
+
+    以音频内容哈希 + 模型标识为键, 缓存 prompt_semantic、refer_spec、16k 音频、原始音频、
+    sv embedding 以及 ge。设置 cache_dir 后会同时以 .npz 形式写入磁盘, 进程重启后仍可命中。
+    """
+
+    tensor_fields = ("prompt_semantic", "spec", "audio_16k", "raw_audio", "sv_emb", "ge")
+
+    def __init__(self, max_entries: int = 64, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def make_key(self, path: str, model_tag: str) -> str:
+        return hashlib.sha1(f"{self.hash_file(path)}|{model_tag}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str, device: Union[str, torch.device] = "cpu") -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry)
+
+        entry = self._load(key, device)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, entry)
+            return dict(entry)
+
+    def put(self, key: str, entry: dict):
+        entry = dict(entry)
+        with self.lock:
+            self._insert(key, entry)
+        self._save(key, entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def _insert(self, key: str, entry: dict):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _save(self, key: str, entry: dict):
+        if self.cache_dir is None:
+            return
+        arrays = {}
+        for field in self.tensor_fields:
+            value = entry.get(field)
+            if value is not None:
+                arrays[field] = value.detach().cpu().numpy()
+        if entry.get("raw_sr") is not None:
+            arrays["raw_sr"] = np.asarray(entry["raw_sr"])
+        tmp_path = self._disk_path(key) + ".tmp.npz"
+        try:
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            print(f"Warning: failed to write reference cache {key}: {e}")
+
+    def _load(self, key: str, device: Union[str, torch.device]) -> Optional[dict]:
+        if self.cache_dir is None or not os.path.exists(self._disk_path(key)):
+            return None
+        try:
+            with np.load(self._disk_path(key)) as data:
+                entry = {field: None for field in self.tensor_fields}
+                for field in self.tensor_fields:
+                    if field in data.files:
+                        entry[field] = torch.from_numpy(data[field]).to(device)
+                entry["raw_sr"] = int(data["raw_sr"]) if "raw_sr" in data.files else None
+        except Exception as e:
+            print(f"Warning: failed to read reference cache {key}: {e}")
+            return None
+        return entry
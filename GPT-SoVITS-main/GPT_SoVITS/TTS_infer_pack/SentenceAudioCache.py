@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+
+class SentenceAudioCache:
+    """
+    逐句合成结果的 LRU 缓存, 按占用字节数限制大小。
+
+    只在固定 seed 时使用: 键由句子文本与本次请求的上下文(参考音频、模型权重、采样参数等)组成,
+    值为该句在后处理(归一化、插入间隔)之前的音频片段, 存放在 CPU 上。
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(context: tuple, norm_text: str) -> tuple:
+        return (context, norm_text)
+
+    def get(self, key: tuple, device: torch.device, dtype: torch.dtype) -> Optional[torch.Tensor]:
+        with self.lock:
+            fragment = self.entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        # 下游只读取片段(audio_postprocess 写入新分配的输出), 设备与类型相同时可直接返回缓存的张量
+        return fragment.to(device=device, dtype=dtype)
+
+    def put(self, key: tuple, fragment: torch.Tensor):
+        stored = fragment.detach().to("cpu", copy=True)
+        size = stored.numel() * stored.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = stored
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        fragment = self.entries.pop(key)
+        self.total_bytes -= fragment.numel() * fragment.element_size()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
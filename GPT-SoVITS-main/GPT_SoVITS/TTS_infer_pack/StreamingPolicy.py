@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class AdaptiveChunkPolicy:
+    """
+    流式模式的自适应分块: 首块只取很少的语义 token 以降低首包延迟, 之后逐块增大块长。
+
+    维护一个播放时钟: 客户端剩余缓冲 = 已发送音频时长 - 首包之后经过的时间。
+    生成下一块的耗时约为 块长 * token_seconds * 实测实时率(计算耗时/音频时长),
+    块长被限制在 safety * 剩余缓冲 能覆盖的范围内, 保证下一块在缓冲播完之前送达。
+    T2S 解码在每一步读取 chunk_length, 因此更新会在下一块立即生效。
+    """
+
+    def __init__(
+        self,
+        first_chunk_length: int = 4,
+        max_chunk_length: int = 64,
+        growth: float = 2.0,
+        token_seconds: float = 0.04,
+        safety: float = 0.8,
+    ):
+        self.first_chunk_length = max(1, first_chunk_length)
+        self.max_chunk_length = max(self.first_chunk_length, max_chunk_length)
+        self.growth = growth
+        self.token_seconds = token_seconds
+        self.safety = safety
+        self.chunk_length = self.first_chunk_length
+        self.first_packet_time: Optional[float] = None
+        self.audio_seconds = 0.0
+        self.compute_seconds = 0.0
+
+    @property
+    def rtf(self) -> float:
+        return self.compute_seconds / self.audio_seconds if self.audio_seconds > 0 else 0.0
+
+    def buffered_seconds(self, now: float = None) -> float:
+        if self.first_packet_time is None:
+            return 0.0
+        now = time.perf_counter() if now is None else now
+        return self.audio_seconds - (now - self.first_packet_time)
+
+    def add_audio(self, audio_seconds: float):
+        """句间插入的静音等不需要计算的音频, 只计入播放时钟"""
+        if self.first_packet_time is not None:
+            self.audio_seconds += audio_seconds
+
+    def on_chunk(self, audio_seconds: float, compute_seconds: float, now: float = None):
+        """
+        每发送一块音频调用一次。
+        audio_seconds: 本块音频时长; compute_seconds: 生成本块的计算耗时(T2S + 声码)
+        """
+        now = time.perf_counter() if now is None else now
+        if self.first_packet_time is None:
+            self.first_packet_time = now
+        self.audio_seconds += audio_seconds
+        self.compute_seconds += compute_seconds
+
+        target = min(int(self.chunk_length * self.growth), self.max_chunk_length)
+        if self.rtf > 0:
+            safe = int(self.safety * max(self.buffered_seconds(now), 0.0) / (self.token_seconds * self.rtf))
+            target = min(target, safe)
+        self.chunk_length = max(self.first_chunk_length, target)
+
+
+class LatencyMetrics:
+    """滑动窗口内的延迟统计(秒), 线程安全"""
+
+    def __init__(self, window: int = 1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, value: float):
+        with self.lock:
+            self.values.append(value)
+            self.count += 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            values = np.array(self.values, dtype=np.float64)
+            count = self.count
+        if values.size == 0:
+            return {"count": count}
+        return {
+            "count": count,
+            "last": float(values[-1]),
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+        }
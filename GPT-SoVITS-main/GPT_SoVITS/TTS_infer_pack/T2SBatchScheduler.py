@@ -0,0 +1,309 @@
+import threading
+import traceback
+from collections import deque
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from AR.models.utils import sample
+
+
+class T2SRequest:
+    """一条待解码的序列(一句文本), 由调用线程提交, 调度线程解码完成后回填结果"""
+
+    def __init__(
+        self,
+        x: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        prompt: Optional[torch.LongTensor],
+        top_k: int,
+        top_p: float,
+        temperature: float,
+        repetition_penalty: float,
+        early_stop_num: int,
+    ):
+        self.x = x
+        self.bert_feature = bert_feature
+        self.prompt = prompt
+        self.sampling_key = (top_k, top_p, temperature, repetition_penalty)
+        self.early_stop_num = early_stop_num
+
+        self.y: torch.LongTensor = None  # [1, prefix_len + 已生成token数]
+        self.prefix_len: int = 0
+        self.y_len: int = 0
+        self.idx: int = 0
+        self.error: Exception = None
+        self.done = threading.Event()
+
+    def finish(self, error: Exception = None):
+        self.error = error
+        self.done.set()
+
+
+class T2SBatchScheduler:
+    """
+    跨请求的连续批处理(continuous batching)调度器。
+
+    多个请求的句子在同一个解码循环中按步推进: 新序列在步与步之间完成 prefill 后加入批次,
+    生成完毕的序列立即移出并唤醒对应的调用线程。各行的 kv cache 左侧补齐到相同长度,
+    用 padding mask 屏蔽补齐部分, 每行使用各自的位置编码下标。
+    """
+
+    def __init__(self, model, max_batch_size: int = 16, max_steps: int = 1500):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_steps = max_steps
+
+        self.cond = threading.Condition()
+        self.pending: deque = deque()
+        self.thread: threading.Thread = None
+        self.running = False
+
+        # 运行中的批次
+        self.rows: List[T2SRequest] = []
+        self.k_cache: List[torch.Tensor] = None
+        self.v_cache: List[torch.Tensor] = None
+        self.padding_mask: torch.Tensor = None  # [B, kv_len], True 为padding
+        self.last_tokens: torch.Tensor = None  # [B, 1]
+
+    def set_model(self, model):
+        """
+        等待批次中与排队中的序列全部解码完成后再切换模型,
+        避免用新权重在旧模型生成的 kv cache 上继续解码
+        """
+        with self.cond:
+            while self.running and (self.rows or self.pending):
+                self.cond.wait()
+            self.model = model
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._loop, name="t2s_batch_scheduler", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def infer_panel(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.Tensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """与 Text2SemanticDecoder.infer_panel_batch_infer 接口一致, 阻塞直到本批所有句子解码完成"""
+        requests = [
+            T2SRequest(
+                x[i].unsqueeze(0),
+                bert_feature[i].unsqueeze(0),
+                prompts[i].unsqueeze(0) if prompts is not None else None,
+                top_k,
+                top_p,
+                temperature,
+                repetition_penalty,
+                early_stop_num,
+            )
+            for i in range(len(x))
+        ]
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("T2SBatchScheduler is not running")
+            self.pending.extend(requests)
+            self.cond.notify_all()
+
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+
+        return [request.y[0] for request in requests], [request.idx for request in requests]
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending and not self.rows:
+                    # 唤醒等待批次清空的 set_model
+                    self.cond.notify_all()
+                    self.cond.wait()
+                if not self.running:
+                    break
+                admitted = []
+                while self.pending and len(self.rows) + len(admitted) < self.max_batch_size:
+                    admitted.append(self.pending.popleft())
+                model = self.model
+
+            try:
+                with torch.no_grad():
+                    for request in admitted:
+                        self._admit(model, request)
+                    if self.rows:
+                        self._step(model)
+            except Exception as e:
+                traceback.print_exc()
+                for request in self.rows + admitted:
+                    if not request.done.is_set():
+                        request.finish(e)
+                self._reset()
+
+        with self.cond:
+            for request in self.rows + list(self.pending):
+                request.finish(RuntimeError("T2SBatchScheduler has been shut down"))
+            self.pending.clear()
+        self._reset()
+
+    def _reset(self):
+        self.rows = []
+        self.k_cache = None
+        self.v_cache = None
+        self.padding_mask = None
+        self.last_tokens = None
+
+    def _admit(self, model, request: T2SRequest):
+        logits, k_cache, v_cache, y_len = model.prefill_single(request.x, request.prompt, request.bert_feature)
+        request.y_len = y_len
+        if request.prompt is not None:
+            request.y = request.prompt
+        else:
+            request.y = torch.zeros(1, 0, dtype=torch.int, device=logits.device)
+        request.prefix_len = request.y.shape[1]
+        request.idx = 0
+
+        if self._sample_and_check([request], logits)[0]:
+            return
+
+        kv_len = k_cache[0].shape[1]
+        padding_mask = torch.zeros(1, kv_len, dtype=torch.bool, device=logits.device)
+        if not self.rows:
+            self.k_cache, self.v_cache = k_cache, v_cache
+            self.padding_mask = padding_mask
+            self.last_tokens = request.y[:, -1:]
+            self.rows = [request]
+            return
+
+        # 左侧补齐到相同的 kv 长度后拼接到批次末尾
+        batch_len = self.padding_mask.shape[1]
+        if kv_len < batch_len:
+            pad = batch_len - kv_len
+            k_cache = [F.pad(k, (0, 0, pad, 0)) for k in k_cache]
+            v_cache = [F.pad(v, (0, 0, pad, 0)) for v in v_cache]
+            padding_mask = F.pad(padding_mask, (pad, 0), value=True)
+        elif kv_len > batch_len:
+            pad = kv_len - batch_len
+            self.k_cache = [F.pad(k, (0, 0, pad, 0)) for k in self.k_cache]
+            self.v_cache = [F.pad(v, (0, 0, pad, 0)) for v in self.v_cache]
+            self.padding_mask = F.pad(self.padding_mask, (pad, 0), value=True)
+
+        self.k_cache = [torch.cat([k0, k1], dim=0) for k0, k1 in zip(self.k_cache, k_cache)]
+        self.v_cache = [torch.cat([v0, v1], dim=0) for v0, v1 in zip(self.v_cache, v_cache)]
+        self.padding_mask = torch.cat([self.padding_mask, padding_mask], dim=0)
+        self.last_tokens = torch.cat([self.last_tokens, request.y[:, -1:]], dim=0)
+        self.rows.append(request)
+
+    def _step(self, model):
+        positions = torch.LongTensor([request.y_len + request.idx for request in self.rows]).to(
+            self.padding_mask.device
+        )
+        self.padding_mask = F.pad(self.padding_mask, (0, 1), value=False)
+        attn_mask = self.padding_mask[:, None, None, :]
+        logits, self.k_cache, self.v_cache = model.decode_next_token_batched(
+            self.last_tokens, positions, self.k_cache, self.v_cache, attn_mask
+        )
+        for request in self.rows:
+            request.idx += 1
+
+        finished = self._sample_and_check(self.rows, logits)
+        if not any(finished):
+            self.last_tokens = torch.cat([request.y[:, -1:] for request in self.rows], dim=0)
+            return
+
+        reserved = [i for i, f in enumerate(finished) if not f]
+        self.rows = [self.rows[i] for i in reserved]
+        if not self.rows:
+            self._reset()
+            return
+
+        index = torch.LongTensor(reserved).to(self.padding_mask.device)
+        self.k_cache = [torch.index_select(k, dim=0, index=index) for k in self.k_cache]
+        self.v_cache = [torch.index_select(v, dim=0, index=index) for v in self.v_cache]
+        self.padding_mask = torch.index_select(self.padding_mask, dim=0, index=index)
+        self.last_tokens = torch.cat([request.y[:, -1:] for request in self.rows], dim=0)
+
+        # 去掉所有剩余行都是padding的左侧列
+        lead = int((~self.padding_mask).any(dim=0).int().argmax())
+        if lead > 0:
+            self.k_cache = [k[:, lead:] for k in self.k_cache]
+            self.v_cache = [v[:, lead:] for v in self.v_cache]
+            self.padding_mask = self.padding_mask[:, lead:]
+
+    def _sample_and_check(self, rows: List[T2SRequest], logits: torch.Tensor) -> List[bool]:
+        """按采样参数分组采样, 把新token追加到各行并判断是否结束, 返回每行是否已完成"""
+        EOS = self.model.EOS
+        logits = logits.clone()
+        for i, request in enumerate(rows):
+            if request.idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
+                logits[i, EOS] = -float("inf")
+        greedy_tokens = torch.argmax(logits, dim=-1).tolist()
+
+        groups = {}
+        for i, request in enumerate(rows):
+            groups.setdefault((request.sampling_key, request.y.shape[1] == 0), []).append(i)
+
+        samples = [None] * len(rows)
+        for ((top_k, top_p, temperature, repetition_penalty), _), indices in groups.items():
+            max_len = max(rows[i].y.shape[1] for i in indices)
+            # 用该行自己的首个token左侧补齐历史, 重复惩罚按token去重生效, 因此结果不变
+            previous_tokens = torch.cat(
+                [
+                    F.pad(rows[i].y, (max_len - rows[i].y.shape[1], 0), value=int(rows[i].y[0, 0]))
+                    if rows[i].y.shape[1] < max_len
+                    else rows[i].y
+                    for i in indices
+                ],
+                dim=0,
+            )
+            group_samples = sample(
+                logits[indices],
+                previous_tokens,
+                top_k=top_k,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty,
+                temperature=temperature,
+            )[0]
+            for j, i in enumerate(indices):
+                samples[i] = group_samples[j : j + 1]
+
+        finished = []
+        for i, request in enumerate(rows):
+            request.y = torch.concat([request.y, samples[i]], dim=1)
+            stop = False
+            if request.early_stop_num != -1 and (request.y.shape[1] - request.prefix_len) > request.early_stop_num:
+                print("use early stop num:", request.early_stop_num)
+                stop = True
+            if greedy_tokens[i] == EOS or int(samples[i][0, 0]) == EOS:
+                request.y = request.y[:, :-1]
+                stop = True
+            if request.idx >= self.max_steps - 1:
+                stop = True
+
+            if stop:
+                if request.y.shape[1] == 0:
+                    request.y = torch.concat([request.y, torch.zeros_like(samples[i])], dim=1)
+                    print("bad zero prediction")
+                request.finish()
+            finished.append(stop)
+        return finished
@@ -3,6 +3,7 @@ import math
 import os
 import random
 import sys
+import threading
 import time
 import traceback
 from copy import deepcopy
@@ -10,7 +11,8 @@ from copy import deepcopy
 import torchaudio
 from tqdm import tqdm
 
-now_dir = os.getcwd()
+# GPT-SoVITS 根目录; 按本文件位置确定, 不依赖进程的工作目录
+now_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(now_dir)
 import os
 from typing import List, Tuple, Union
@@ -28,12 +30,19 @@ from module.mel_processing import mel_spectrogram_torch, spectrogram_torch
 from module.models import SynthesizerTrn, SynthesizerTrnV3, Generator
 from peft import LoraConfig, get_peft_model
 from process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoConfig, AutoModelForMaskedLM, AutoTokenizer
 
 from tools.audio_sr import AP_BWE
 from tools.i18n.i18n import I18nAuto, scan_language_list
+from TTS_infer_pack.BucketPlanner import BucketPlanner
+from TTS_infer_pack.Pipeline import TwoStagePipeline
+from TTS_infer_pack.Quantization import load_or_quantize_module, load_quantized, quantized_cache_path, save_quantized
+from TTS_infer_pack.RefAudioCache import RefAudioCache
+from TTS_infer_pack.SentenceAudioCache import SentenceAudioCache
+from TTS_infer_pack.StreamingPolicy import AdaptiveChunkPolicy, LatencyMetrics
+from TTS_infer_pack.T2SBatchScheduler import T2SBatchScheduler
 from TTS_infer_pack.text_segmentation_method import splits
-from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.TextPreprocessor import TextFeatureCache, TextPreprocessor
 from sv import SV
 
 resample_transform_dict = {}
@@ -47,6 +56,17 @@ def resample(audio_tensor, sr0, sr1, device):
     return resample_transform_dict[key](audio_tensor)
 
 
+hann_window_dict = {}
+
+
+def get_hann_window(length, device):
+    global hann_window_dict
+    key = "%s-%s" % (length, str(device))
+    if key not in hann_window_dict:
+        hann_window_dict[key] = torch.hann_window(length, device=device, dtype=torch.float32)
+    return hann_window_dict[key]
+
+
 language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
@@ -298,7 +318,7 @@ class TTS_Config:
 
     def __init__(self, configs: Union[dict, str] = None):
         # 设置默认配置文件路径
-        configs_base_path: str = "GPT_SoVITS/configs/"
+        configs_base_path: str = os.path.join(now_dir, "GPT_SoVITS/configs/")
         os.makedirs(configs_base_path, exist_ok=True)
         self.configs_path: str = os.path.join(configs_base_path, "tts_infer.yaml")
 
@@ -331,25 +351,52 @@ class TTS_Config:
         version = self.configs.get("version", None)
         self.version = version
         assert self.version in ["v1", "v2", "v3", "v4", "v2Pro", "v2ProPlus"], "Invalid version!"
-        self.t2s_weights_path = self.configs.get("t2s_weights_path", None)
-        self.vits_weights_path = self.configs.get("vits_weights_path", None)
-        self.bert_base_path = self.configs.get("bert_base_path", None)
-        self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        self.t2s_weights_path = self.resolve_path(self.configs.get("t2s_weights_path", None))
+        self.vits_weights_path = self.resolve_path(self.configs.get("vits_weights_path", None))
+        self.bert_base_path = self.resolve_path(self.configs.get("bert_base_path", None))
+        self.cnhuhbert_base_path = self.resolve_path(self.configs.get("cnhuhbert_base_path", None))
         self.languages = self.v1_languages if self.version == "v1" else self.v2_languages
+        self.continuous_batching: bool = self.configs.get("continuous_batching", False)
+        self.max_batch_size: int = self.configs.get("max_batch_size", 16)
+        self.static_kv_cache: bool = self.configs.get("static_kv_cache", False)
+        self.ref_cache_size: int = self.configs.get("ref_cache_size", 64)
+        self.ref_cache_dir: str = self.configs.get("ref_cache_dir", None)
+        self.text_cache_max_bytes: int = self.configs.get("text_cache_max_bytes", 128 * 1024 * 1024)
+        self.text_cache_ttl: float = self.configs.get("text_cache_ttl", 0)
+        self.text_cache_fp16: bool = self.configs.get("text_cache_fp16", False)
+        self.sentence_cache_max_bytes: int = self.configs.get("sentence_cache_max_bytes", 128 * 1024 * 1024)
+        self.onnx_backend: bool = self.configs.get("onnx_backend", False)
+        self.onnx_model_dir: str = self.configs.get("onnx_model_dir", None)
+        self.onnx_intra_op_threads: int = self.configs.get("onnx_intra_op_threads", 0)
+        self.onnx_inter_op_threads: int = self.configs.get("onnx_inter_op_threads", 1)
+        self.quantization: str = self.configs.get("quantization", None)
+        self.quantization_cache_dir: str = self.resolve_path(
+            self.configs.get("quantization_cache_dir", "GPT_SoVITS/pretrained_models/int8_cache")
+        )
+        if self.quantization == "int8" and str(self.device) != "cpu":
+            print("Warning: int8 quantization is only applied on CPU.")
+        self.t2s_decode_backend: str = self.configs.get("t2s_decode_backend", "eager")
+        self.t2s_decode_warmup_batch_sizes: list = self.configs.get("t2s_decode_warmup_batch_sizes", [1])
+        self.degeneration_detection: bool = self.configs.get("degeneration_detection", False)
+        self.degeneration_max_retries: int = self.configs.get("degeneration_max_retries", 1)
+        self.bucket_planner: bool = self.configs.get("bucket_planner", False)
+        self.bucket_max_tokens: int = self.configs.get("bucket_max_tokens", 32768)
+        self.t2s_vits_pipeline: bool = self.configs.get("t2s_vits_pipeline", False)
+        self.streaming_left_context: int = self.configs.get("streaming_left_context", 0)
 
         self.use_vocoder: bool = False
 
         if (self.t2s_weights_path in [None, ""]) or (not os.path.exists(self.t2s_weights_path)):
-            self.t2s_weights_path = self.default_configs[version]["t2s_weights_path"]
+            self.t2s_weights_path = self.resolve_path(self.default_configs[version]["t2s_weights_path"])
             print(f"fall back to default t2s_weights_path: {self.t2s_weights_path}")
         if (self.vits_weights_path in [None, ""]) or (not os.path.exists(self.vits_weights_path)):
-            self.vits_weights_path = self.default_configs[version]["vits_weights_path"]
+            self.vits_weights_path = self.resolve_path(self.default_configs[version]["vits_weights_path"])
             print(f"fall back to default vits_weights_path: {self.vits_weights_path}")
         if (self.bert_base_path in [None, ""]) or (not os.path.exists(self.bert_base_path)):
-            self.bert_base_path = self.default_configs[version]["bert_base_path"]
+            self.bert_base_path = self.resolve_path(self.default_configs[version]["bert_base_path"])
             print(f"fall back to default bert_base_path: {self.bert_base_path}")
         if (self.cnhuhbert_base_path in [None, ""]) or (not os.path.exists(self.cnhuhbert_base_path)):
-            self.cnhuhbert_base_path = self.default_configs[version]["cnhuhbert_base_path"]
+            self.cnhuhbert_base_path = self.resolve_path(self.default_configs[version]["cnhuhbert_base_path"])
             print(f"fall back to default cnhuhbert_base_path: {self.cnhuhbert_base_path}")
         self.update_configs()
 
@@ -363,6 +410,13 @@ class TTS_Config:
         self.win_length: int = 2048
         self.n_speakers: int = 300
 
+    @staticmethod
+    def resolve_path(path: str) -> str:
+        """相对路径在当前工作目录下不存在时, 按 GPT-SoVITS 根目录解析(默认配置中的路径都相对于根目录)"""
+        if path in [None, ""] or os.path.isabs(path) or os.path.exists(path):
+            return path
+        return os.path.join(now_dir, path)
+
     def _load_configs(self, configs_path: str) -> dict:
         if os.path.exists(configs_path):
             ...
@@ -393,6 +447,29 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "continuous_batching": self.continuous_batching,
+            "max_batch_size": self.max_batch_size,
+            "static_kv_cache": self.static_kv_cache,
+            "ref_cache_size": self.ref_cache_size,
+            "ref_cache_dir": self.ref_cache_dir,
+            "text_cache_max_bytes": self.text_cache_max_bytes,
+            "text_cache_ttl": self.text_cache_ttl,
+            "text_cache_fp16": self.text_cache_fp16,
+            "sentence_cache_max_bytes": self.sentence_cache_max_bytes,
+            "onnx_backend": self.onnx_backend,
+            "onnx_model_dir": self.onnx_model_dir,
+            "onnx_intra_op_threads": self.onnx_intra_op_threads,
+            "onnx_inter_op_threads": self.onnx_inter_op_threads,
+            "quantization": self.quantization,
+            "quantization_cache_dir": self.quantization_cache_dir,
+            "t2s_decode_backend": self.t2s_decode_backend,
+            "t2s_decode_warmup_batch_sizes": self.t2s_decode_warmup_batch_sizes,
+            "degeneration_detection": self.degeneration_detection,
+            "degeneration_max_retries": self.degeneration_max_retries,
+            "bucket_planner": self.bucket_planner,
+            "bucket_max_tokens": self.bucket_max_tokens,
+            "t2s_vits_pipeline": self.t2s_vits_pipeline,
+            "streaming_left_context": self.streaming_left_context,
         }
         return self.config
 
@@ -434,6 +511,20 @@ class TTS:
         self.sr_model: AP_BWE = None
         self.sv_model = None
         self.sr_model_not_exist: bool = False
+        self.t2s_scheduler: T2SBatchScheduler = None
+        self.t2s_onnx = None
+        self.vits_onnx = None
+        self.ref_cache: RefAudioCache = RefAudioCache(self.configs.ref_cache_size, self.configs.ref_cache_dir)
+        # sentence_cache_max_bytes 为 0 时关闭逐句音频缓存
+        self.sentence_audio_cache: SentenceAudioCache = None
+        if self.configs.sentence_cache_max_bytes > 0:
+            self.sentence_audio_cache = SentenceAudioCache(self.configs.sentence_cache_max_bytes)
+        # 开启后按预测解码长度分桶, 取代 batch_size/batch_threshold 的切分方式
+        self.bucket_planner: BucketPlanner = None
+        if self.configs.bucket_planner:
+            self.bucket_planner = BucketPlanner(self.configs.max_batch_size, self.configs.bucket_max_tokens)
+        # 流式模式首包延迟(秒)的统计, 供服务端查询
+        self.first_package_delay: LatencyMetrics = LatencyMetrics()
 
         self.vocoder_configs: dict = {
             "sr": None,
@@ -445,25 +536,39 @@ class TTS:
 
         self._init_models()
 
+        # text_cache_max_bytes 为 0 时关闭文本前端缓存
+        self.text_feature_cache: TextFeatureCache = None
+        if self.configs.text_cache_max_bytes > 0:
+            self.text_feature_cache = TextFeatureCache(
+                self.configs.text_cache_max_bytes, self.configs.text_cache_ttl, self.configs.text_cache_fp16
+            )
         self.text_preprocessor: TextPreprocessor = TextPreprocessor(
-            self.bert_model, self.bert_tokenizer, self.configs.device
+            self.bert_model, self.bert_tokenizer, self.configs.device, feature_cache=self.text_feature_cache
         )
 
         self.prompt_cache: dict = {
             "ref_audio_path": None,
             "prompt_semantic": None,
             "refer_spec": [],
+            "refer_features": [],
             "prompt_text": None,
             "prompt_lang": None,
             "phones": None,
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "ref_cache_tag": None,
         }
 
+        self.prompt_lock = threading.RLock()
         self.stop_flag: bool = False
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
+        if self.configs.continuous_batching:
+            self.enable_continuous_batching(True, save=False)
+        if self.configs.onnx_backend:
+            self.enable_onnx_backend(True, save=False)
+
     def _init_models(
         self,
     ):
@@ -475,6 +580,15 @@ class TTS:
 
     def init_cnhuhbert_weights(self, base_path: str):
         print(f"Loading CNHuBERT weights from {base_path}")
+        if self.use_int8:
+            self.cnhuhbert_model = load_or_quantize_module(
+                lambda: CNHubert(base_path),
+                lambda: CNHubert(base_path, load_weights=False),
+                "cnhubert",
+                base_path,
+                self.configs.quantization_cache_dir,
+            )
+            return
         self.cnhuhbert_model = CNHubert(base_path)
         self.cnhuhbert_model = self.cnhuhbert_model.eval()
         self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
@@ -484,6 +598,15 @@ class TTS:
     def init_bert_weights(self, base_path: str):
         print(f"Loading BERT weights from {base_path}")
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
+        if self.use_int8:
+            self.bert_model = load_or_quantize_module(
+                lambda: AutoModelForMaskedLM.from_pretrained(base_path),
+                lambda: AutoModelForMaskedLM.from_config(AutoConfig.from_pretrained(base_path)),
+                "bert",
+                base_path,
+                self.configs.quantization_cache_dir,
+            )
+            return
         self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
         self.bert_model = self.bert_model.eval()
         self.bert_model = self.bert_model.to(self.configs.device)
@@ -606,12 +729,37 @@ class TTS:
         self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.t2s_model = self.t2s_model.half()
+        # 仅用于推理; T2SBlock 直接持有权重张量, jit.trace 会把它们作为常量,
+        # requires_grad 为 True 时无法 trace
+        self.t2s_model.requires_grad_(False)
+        if self.use_int8:
+            # 缓存的是量化后的权重, 命中时跳过逐层量化
+            cache_path = quantized_cache_path(self.configs.quantization_cache_dir, "t2s", weights_path)
+            qweights = load_quantized(cache_path)
+            new_qweights = self.t2s_model.model.quantize_int8(qweights)
+            if qweights is None:
+                save_quantized(new_qweights, cache_path)
+        if self.configs.t2s_decode_backend not in [None, "eager"]:
+            # 编译单步解码并对常用 batch size 预热, 避免首个请求承担编译耗时
+            print(f"Compiling T2S decode step with {self.configs.t2s_decode_backend}")
+            self.t2s_model.model.enable_fast_decode(
+                self.configs.t2s_decode_backend, self.configs.t2s_decode_warmup_batch_sizes
+            )
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.set_model(self.t2s_model.model)
+        if self.t2s_onnx is not None:
+            print("Warning: the ONNX T2S graphs must be re-exported from the new GPT weights.")
+            self.t2s_onnx.set_model(self.t2s_model.model)
 
         codebook = t2s_model.model.ar_audio_embedding.weight.clone()
         mute_emb = codebook[self.configs.mute_tokens[self.configs.version]].unsqueeze(0)
         sim_matrix = F.cosine_similarity(mute_emb.float(), codebook.float(), dim=-1)
         self.configs.mute_emb_sim_matrix = sim_matrix
 
+    @property
+    def use_int8(self) -> bool:
+        return self.configs.quantization == "int8" and str(self.configs.device) == "cpu"
+
     def init_vocoder(self, version: str):
         if version == "v3":
             if self.vocoder is not None and self.vocoder.__class__.__name__ == "BigVGAN":
@@ -725,6 +873,66 @@ class TTS:
                 self.cnhuhbert_model = self.cnhuhbert_model.float()
             if self.vocoder is not None:
                 self.vocoder = self.vocoder.float()
+        if self.t2s_model is not None and self.configs.t2s_decode_backend not in [None, "eager"]:
+            # 编译结果绑定了原精度的权重, 需要重新编译
+            self.t2s_model.model.enable_fast_decode(
+                self.configs.t2s_decode_backend, self.configs.t2s_decode_warmup_batch_sizes
+            )
+
+    def enable_continuous_batching(self, enable: bool = True, max_batch_size: int = None, save: bool = True):
+        """
+        To enable continuous batching across concurrent run() calls.
+        Sentences from different requests in parallel inference mode are decoded in one shared T2S batch.
+        Args:
+            enable: bool, whether to enable continuous batching.
+            max_batch_size: int, the maximum number of sequences decoded together.
+        """
+        self.configs.continuous_batching = enable
+        if max_batch_size is not None:
+            self.configs.max_batch_size = max_batch_size
+        if save:
+            self.configs.save_configs()
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.shutdown()
+            self.t2s_scheduler = None
+        if enable:
+            self.t2s_scheduler = T2SBatchScheduler(self.t2s_model.model, max_batch_size=self.configs.max_batch_size)
+            self.t2s_scheduler.start()
+
+    def enable_onnx_backend(self, enable: bool = True, model_dir: str = None, save: bool = True):
+        """
+        To serve inference from the ONNX graphs exported by onnx_export.py with ONNX Runtime (CPU only).
+        T2S decoding runs through the exported decoder graphs for every inference mode, including streaming;
+        VITS runs through the exported graph for v1/v2 models when speed_factor is 1 and there is a single reference audio.
+        Args:
+            enable: bool, whether to enable the ONNX backend.
+            model_dir: str, the directory containing the exported graphs.
+        """
+        if enable and str(self.configs.device) != "cpu":
+            print("Warning: ONNX backend only supports CPU, keep using PyTorch.")
+            enable = False
+        if model_dir is not None:
+            self.configs.onnx_model_dir = model_dir
+        self.t2s_onnx = None
+        self.vits_onnx = None
+        if enable:
+            from TTS_infer_pack.OnnxBackend import OnnxT2SBackend, OnnxVitsBackend
+
+            self.t2s_onnx = OnnxT2SBackend(
+                self.configs.onnx_model_dir,
+                self.t2s_model.model,
+                self.configs.onnx_intra_op_threads,
+                self.configs.onnx_inter_op_threads,
+            )
+            try:
+                self.vits_onnx = OnnxVitsBackend(
+                    self.configs.onnx_model_dir, self.configs.onnx_intra_op_threads, self.configs.onnx_inter_op_threads
+                )
+            except FileNotFoundError as e:
+                print(f"Warning: {e}, VITS keeps using PyTorch.")
+        self.configs.onnx_backend = enable
+        if save:
+            self.configs.save_configs()
 
     def set_device(self, device: torch.device, save: bool = True):
         """
@@ -755,25 +963,75 @@ class TTS:
         Args:
             ref_audio_path: str, the path of the reference audio.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
-        self._set_ref_audio_path(ref_audio_path)
+        with self.prompt_lock:
+            features = self._get_ref_features(ref_audio_path)
+            self.prompt_cache["prompt_semantic"] = features["prompt_semantic"]
+            self.prompt_cache["raw_audio"] = features["raw_audio"]
+            self.prompt_cache["raw_sr"] = features["raw_sr"]
+            self._set_ref_spec(features)
+            self._set_ref_audio_path(ref_audio_path)
+            self.prompt_cache["ref_cache_tag"] = self._ref_cache_tag()
 
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
-    def _set_ref_spec(self, ref_audio_path):
-        spec_audio = self._get_ref_spec(ref_audio_path)
+    def _set_ref_spec(self, features: dict):
+        spec_audio = (features["spec"], features["audio_16k"])
         if self.prompt_cache["refer_spec"] in [[], None]:
             self.prompt_cache["refer_spec"] = [spec_audio]
+            self.prompt_cache["refer_features"] = [features]
         else:
             self.prompt_cache["refer_spec"][0] = spec_audio
+            self.prompt_cache["refer_features"][0] = features
+
+    def _ref_cache_tag(self) -> str:
+        # 参考特征依赖 SoVITS 权重(提取 semantic 与 ge)和精度, 权重文件变化后自动失效
+        weights_path = self.configs.vits_weights_path
+        mtime = os.path.getmtime(weights_path) if os.path.exists(weights_path) else 0
+        return f"{self.configs.version}|{weights_path}|{mtime}|{self.configs.is_half}|{self.configs.sampling_rate}"
+
+    def _get_ref_features(self, ref_audio_path: str, with_prompt_semantic: bool = True) -> dict:
+        """
+        Get the features of a reference audio, using the reference cache when possible.
+        Returns a dict with prompt_semantic, spec, audio_16k, raw_audio, raw_sr, sv_emb and ge.
+        """
+        key = self.ref_cache.make_key(ref_audio_path, self._ref_cache_tag())
+        features = self.ref_cache.get(key, self.configs.device)
+        updated = features is None
+        if features is None:
+            features = {field: None for field in RefAudioCache.tensor_fields}
+            features["raw_sr"] = None
+
+        if features["spec"] is None:
+            spec, audio, raw_audio, raw_sr = self._extract_ref_spec(ref_audio_path)
+            features.update(spec=spec, audio_16k=audio, raw_audio=raw_audio, raw_sr=raw_sr)
+            updated = True
+        if with_prompt_semantic and features["prompt_semantic"] is None:
+            features["prompt_semantic"] = self._extract_prompt_semantic(ref_audio_path)
+            updated = True
+        if self.is_v2pro and features["sv_emb"] is None:
+            features["sv_emb"] = self.sv_model.compute_embedding3(features["audio_16k"])
+            updated = True
+        if not self.configs.use_vocoder and features["ge"] is None:
+            spec = features["spec"].to(dtype=self.precision, device=self.configs.device)
+            features["ge"] = self.vits_model.get_ge(spec, features["sv_emb"])
+            updated = True
+
+        if updated:
+            self.ref_cache.put(key, features)
+        # 键同时包含音频内容与 SoVITS 权重, 供逐句音频缓存标识参考音频
+        features["cache_key"] = key
+        return features
 
     def _get_ref_spec(self, ref_audio_path):
+        features = self._get_ref_features(ref_audio_path, with_prompt_semantic=False)
+        self.prompt_cache["raw_audio"] = features["raw_audio"]
+        self.prompt_cache["raw_sr"] = features["raw_sr"]
+        return features["spec"], features["audio_16k"]
+
+    def _extract_ref_spec(self, ref_audio_path):
         raw_audio, raw_sr = torchaudio.load(ref_audio_path)
         raw_audio = raw_audio.to(self.configs.device).float()
-        self.prompt_cache["raw_audio"] = raw_audio
-        self.prompt_cache["raw_sr"] = raw_sr
 
         if raw_sr != self.configs.sampling_rate:
             audio = raw_audio.to(self.configs.device)
@@ -804,9 +1062,12 @@ class TTS:
                 audio = audio.half()
         else:
             audio = None
-        return spec, audio
+        return spec, audio, raw_audio, raw_sr
 
     def _set_prompt_semantic(self, ref_wav_path: str):
+        self.prompt_cache["prompt_semantic"] = self._get_ref_features(ref_wav_path)["prompt_semantic"]
+
+    def _extract_prompt_semantic(self, ref_wav_path: str):
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
@@ -830,7 +1091,7 @@ class TTS:
             codes = self.vits_model.extract_latent(hubert_feature)
 
             prompt_semantic = codes[0, 0].to(self.configs.device)
-            self.prompt_cache["prompt_semantic"] = prompt_semantic
+        return prompt_semantic
 
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length: int = None):
         seq = sequences[0]
@@ -869,8 +1130,19 @@ class TTS:
             norm_text_len = len(item["norm_text"])
             index_and_len_list.append([idx, norm_text_len])
 
+        planner = self.bucket_planner if self.bucket_planner is not None else BucketPlanner()
+        prefix_len = 0
+        if prompt_data is not None:
+            prefix_len = len(prompt_data["phones"])
+            if prompt_data.get("prompt_semantic") is not None:
+                prefix_len += prompt_data["prompt_semantic"].shape[-1]
+        phones_lens = [len(item["phones"]) for item in data]
+
         batch_index_list = []
-        if split_bucket:
+        if split_bucket and self.bucket_planner is not None:
+            batch_index_list, _ = planner.plan(phones_lens, prefix_len)
+
+        elif split_bucket:
             index_and_len_list.sort(key=lambda x: x[1])
             index_and_len_list = np.array(index_and_len_list, dtype=np.int64)
 
@@ -898,6 +1170,16 @@ class TTS:
                     batch_index_list.append([])
                 batch_index_list[-1].append(i)
 
+        if split_bucket and len(data) > 1:
+            # 按预测的解码长度统计补零效率(实际token数 / 补零后的token数)
+            lengths = [planner.predict_length(length, prefix_len) for length in phones_lens]
+            padding_stats = BucketPlanner.padding_stats(lengths, batch_index_list)
+            print(
+                f"batch plan: {padding_stats['num_batches']} batch(es), "
+                f"padding efficiency {padding_stats['padding_efficiency']:.1%} "
+                f"({padding_stats['real_tokens']}/{padding_stats['padded_tokens']} tokens)"
+            )
+
         for batch_idx, index_list in enumerate(batch_index_list):
             item_list = [data[idx] for idx in index_list]
             phones_list = []
@@ -968,6 +1250,84 @@ class TTS:
 
         return _data, batch_index_list
 
+    def _sentence_cache_context(self, prompt_cache: dict, inputs: dict) -> tuple:
+        """
+        The part of the sentence audio cache key shared by all sentences of a request:
+        reference audios, prompt text and language, model weights and the parameters that affect each fragment.
+
+        With a fixed seed the sampled tokens also depend on the RNG position and on which sentences are
+        batched together, so the batching parameters are part of the key as well. After a partial hit the
+        missed sentences are batched without the cached ones; their audio is a valid sample for the same
+        parameters but is not guaranteed to be bit-identical to a cold run of the same request.
+        """
+        t2s_weights_path = self.configs.t2s_weights_path
+        t2s_mtime = os.path.getmtime(t2s_weights_path) if os.path.exists(t2s_weights_path) else 0
+        return (
+            tuple(features.get("cache_key") for features in prompt_cache["refer_features"]),
+            prompt_cache["prompt_text"] if inputs.get("prompt_text") not in [None, ""] else None,
+            prompt_cache["prompt_lang"] if inputs.get("prompt_text") not in [None, ""] else None,
+            t2s_weights_path,
+            t2s_mtime,
+            self.configs.version,
+            inputs.get("text_lang", ""),
+            inputs.get("top_k", 5),
+            inputs.get("top_p", 1),
+            inputs.get("temperature", 1),
+            inputs.get("repetition_penalty", 1.35),
+            inputs.get("speed_factor", 1.0),
+            inputs.get("sample_steps", 32),
+            inputs.get("seed", -1),
+            inputs.get("batch_size", 1),
+            inputs.get("batch_threshold", 0.75),
+            inputs.get("split_bucket", True),
+            inputs.get("parallel_infer", True),
+        )
+
+    def _resample_degenerate(
+        self,
+        infer_panel,
+        degenerate_flags: list,
+        pred_semantic_list: list,
+        idx_list: list,
+        all_phoneme_ids: list,
+        all_phoneme_lens: torch.LongTensor,
+        phones_lens: torch.LongTensor,
+        prompt: torch.LongTensor,
+        all_bert_features: list,
+        t2s_kwargs: dict,
+    ) -> Tuple[list, list]:
+        """
+        Re-decode the sentences the T2S decoder ended early as degenerate (token budget exceeded,
+        repetition loop or overlong silence), up to configs.degeneration_max_retries times.
+        Sentences that are still degenerate keep their truncated result.
+
+        Returns:
+            Tuple[list, list]: the updated pred_semantic_list and idx_list.
+        """
+        pred_semantic_list = list(pred_semantic_list)
+        idx_list = list(idx_list)
+        for retry in range(self.configs.degeneration_max_retries):
+            indices = [i for i, flag in enumerate(degenerate_flags) if flag is not None]
+            if len(indices) == 0 or self.stop_flag:
+                break
+            print(f"T2S: resampling {len(indices)} degenerate sentence(s) {[degenerate_flags[i] for i in indices]}")
+            index = torch.LongTensor(indices)
+            flags = [None] * len(indices)
+            _pred_semantic_list, _idx_list = infer_panel(
+                [all_phoneme_ids[i] for i in indices],
+                all_phoneme_lens[index.to(all_phoneme_lens.device)],
+                prompt[index.to(prompt.device)] if prompt is not None else None,
+                [all_bert_features[i] for i in indices],
+                degenerate_flags=flags,
+                target_phones_len=phones_lens[index.to(phones_lens.device)],
+                **t2s_kwargs,
+            )
+            for j, i in enumerate(indices):
+                pred_semantic_list[i] = _pred_semantic_list[j]
+                idx_list[i] = _idx_list[j]
+                degenerate_flags[i] = flags[j]
+        return pred_semantic_list, idx_list
+
     def recovery_order(self, data: list, batch_index_list: list) -> list:
         """
         Recovery the order of the audio according to the batch_index_list.
@@ -1027,6 +1387,8 @@ class TTS:
                     "overlap_length": 2,          # int. overlap length of semantic tokens for streaming mode.
                     "min_chunk_length": 16,        # int. The minimum chunk length of semantic tokens for streaming mode. (affects audio chunk size)
                     "fixed_length_chunk": False,  # bool. When turned on, it can achieve faster streaming response, but with lower quality. (lower quality, faster response speed)
+                    "adaptive_chunk": False,      # bool. start streaming with a small first chunk and grow the chunk size as the client buffer allows. (lowest first-packet delay)
+                    "first_chunk_length": 4,      # int. semantic tokens of the first chunk when adaptive_chunk is on.
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
@@ -1060,30 +1422,43 @@ class TTS:
         overlap_length = inputs.get("overlap_length", 2)
         min_chunk_length = inputs.get("min_chunk_length", 16)
         fixed_length_chunk = inputs.get("fixed_length_chunk", False)
+        adaptive_chunk = inputs.get("adaptive_chunk", False)
+        first_chunk_length = inputs.get("first_chunk_length", 4)
         chunk_split_thershold = 0.0 # 该值代表语义token与mute token的余弦相似度阈值，若大于该阈值，则视为可切分点。
 
+        # 每次请求使用局部的 infer_panel, 避免并发请求互相覆盖模型上的方法
+        # ONNX 后端需要参考音频的 semantic token, 无参考文本模式仍使用 PyTorch
+        if self.t2s_onnx is not None and prompt_text not in [None, ""]:
+            t2s_backend = self.t2s_onnx
+        else:
+            t2s_backend = self.t2s_model.model
+        if self.t2s_scheduler is not None and t2s_backend is self.t2s_model.model:
+            batch_infer_panel = self.t2s_scheduler.infer_panel
+        else:
+            batch_infer_panel = t2s_backend.infer_panel_batch_infer
+
         if parallel_infer and not streaming_mode:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            infer_panel = batch_infer_panel
         elif not parallel_infer and streaming_mode and not self.configs.use_vocoder:
             print(i18n("流式推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
+            infer_panel = t2s_backend.infer_panel_naive
         elif streaming_mode and self.configs.use_vocoder:
             print(i18n("SoVits V3/4模型不支持流式推理模式，已自动回退到分段返回模式"))
             streaming_mode = False
             return_fragment = True
             if parallel_infer:
-                self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+                infer_panel = batch_infer_panel
             else:
-                self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+                infer_panel = t2s_backend.infer_panel_naive_batched
             # self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
         elif parallel_infer and streaming_mode:
             print(i18n("不支持同时开启并行推理和流式推理模式，已自动关闭并行推理模式"))
             parallel_infer = False
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
+            infer_panel = t2s_backend.infer_panel_naive
         else:
             print(i18n("朴素推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            infer_panel = t2s_backend.infer_panel_naive_batched
 
         if return_fragment and streaming_mode:
             print(i18n("流式推理模式不支持分段返回，已自动关闭分段返回"))
@@ -1129,61 +1504,94 @@ class TTS:
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (
-            ref_audio_path != self.prompt_cache["ref_audio_path"]
-            or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
-        ):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+        with self.prompt_lock:
+            ref_cache_tag = self._ref_cache_tag()
+            if (ref_audio_path is not None) and (
+                ref_audio_path != self.prompt_cache["ref_audio_path"]
+                or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
+                or ref_cache_tag != self.prompt_cache["ref_cache_tag"]
+            ):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                if ref_cache_tag != self.prompt_cache["ref_cache_tag"]:
+                    # SoVITS 权重已切换, 辅助参考音频的特征也需要重新获取
+                    self.prompt_cache["aux_ref_audio_paths"] = []
+                self.set_ref_audio(ref_audio_path)
+
+            aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+            paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
+            if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+                self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+                self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+                self.prompt_cache["refer_features"] = [self.prompt_cache["refer_features"][0]]
+                for path in aux_ref_audio_paths:
+                    if path in [None, ""]:
+                        continue
+                    if not os.path.exists(path):
+                        print(i18n("音频文件不存在，跳过："), path)
+                        continue
+                    features = self._get_ref_features(path, with_prompt_semantic=False)
+                    self.prompt_cache["refer_spec"].append((features["spec"], features["audio_16k"]))
+                    self.prompt_cache["refer_features"].append(features)
+
+            if not no_prompt_text:
+                prompt_text = prompt_text.strip("\n")
+                if prompt_text[-1] not in splits:
+                    prompt_text += "。" if prompt_lang != "en" else "."
+                print(i18n("实际输入的参考文本:"), prompt_text)
+                if self.prompt_cache["prompt_text"] != prompt_text or self.prompt_cache["prompt_lang"] != prompt_lang:
+                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                        prompt_text, prompt_lang, self.configs.version
+                    )
+                    self.prompt_cache["prompt_text"] = prompt_text
+                    self.prompt_cache["prompt_lang"] = prompt_lang
+                    self.prompt_cache["phones"] = phones
+                    self.prompt_cache["bert_features"] = bert_features
+                    self.prompt_cache["norm_text"] = norm_text
 
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+            # 并发请求可能在推理过程中切换参考音频, 之后只使用本次请求的快照
+            prompt_cache = dict(self.prompt_cache)
+            prompt_cache["refer_spec"] = list(self.prompt_cache["refer_spec"])
+            prompt_cache["refer_features"] = list(self.prompt_cache["refer_features"])
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
         data: list = None
+        sentence_keys: list = None
+        miss_index: list = None
+        cached_fragments: dict = {}
         if not (return_fragment or streaming_mode):
             data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
             if len(data) == 0:
                 yield 16000, np.zeros(int(16000), dtype=np.int16)
                 return
 
-            batch_index_list: list = None
-            data, batch_index_list = self.to_batch(
-                data,
-                prompt_data=self.prompt_cache if not no_prompt_text else None,
-                batch_size=batch_size,
-                threshold=batch_threshold,
-                split_bucket=split_bucket,
-                device=self.configs.device,
-                precision=self.precision,
-            )
+            # 固定 seed 时逐句查找已合成的音频, 只有未命中的句子进入推理
+            if self.sentence_audio_cache is not None and seed != -1:
+                sentence_context = self._sentence_cache_context(prompt_cache, inputs)
+                sentence_keys = [
+                    self.sentence_audio_cache.make_key(sentence_context, item["norm_text"]) for item in data
+                ]
+                for i, key in enumerate(sentence_keys):
+                    fragment = self.sentence_audio_cache.get(key, self.configs.device, self.precision)
+                    if fragment is not None:
+                        cached_fragments[i] = fragment
+                miss_index = [i for i in range(len(data)) if i not in cached_fragments]
+                data = [data[i] for i in miss_index]
+                if len(cached_fragments) > 0:
+                    print(f"sentence audio cache hit: {len(cached_fragments)}/{len(sentence_keys)}")
+
+            batch_index_list: list = []
+            if len(data) > 0:
+                data, batch_index_list = self.to_batch(
+                    data,
+                    prompt_data=prompt_cache if not no_prompt_text else None,
+                    batch_size=batch_size,
+                    threshold=batch_threshold,
+                    split_bucket=split_bucket,
+                    device=self.configs.device,
+                    precision=self.precision,
+                )
         else:
             print(f"############ {i18n('切分文本')} ############")
             texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
@@ -1196,10 +1604,9 @@ class TTS:
             def make_batch(batch_texts):
                 batch_data = []
                 print(f"############ {i18n('提取文本Bert特征')} ############")
-                for text in tqdm(batch_texts):
-                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                        text, text_lang, self.configs.version
-                    )
+                for phones, bert_features, norm_text in self.text_preprocessor.segment_and_extract_feature_for_texts(
+                    batch_texts, text_lang, self.configs.version
+                ):
                     if phones is None:
                         continue
                     res = {
@@ -1212,7 +1619,7 @@ class TTS:
                     return None
                 batch, _ = self.to_batch(
                     batch_data,
-                    prompt_data=self.prompt_cache if not no_prompt_text else None,
+                    prompt_data=prompt_cache if not no_prompt_text else None,
                     batch_size=batch_size,
                     threshold=batch_threshold,
                     split_bucket=False,
@@ -1230,18 +1637,51 @@ class TTS:
             audio = []
             is_first_package = True
             output_sr = self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
-            for item in data:
+
+            refer_audio_spec = []
+            sv_emb = [] if self.is_v2pro else None
+            for features in prompt_cache["refer_features"]:
+                spec = features["spec"].to(dtype=self.precision, device=self.configs.device)
+                refer_audio_spec.append(spec)
+                if self.is_v2pro:
+                    # sv embedding 随参考特征一起缓存, 不再每个批次重新计算
+                    sv_emb.append(features["sv_emb"])
+
+            # 每组参考音频只融合一次 ge, 之后所有句子/流式分块的 decode 直接复用
+            ge = None
+            if not self.configs.use_vocoder:
+                ges = [features["ge"] for features in prompt_cache["refer_features"]]
+                ge = torch.stack(ges, 0).mean(0)
+
+            # 导出的 VITS 图只支持 v1/v2、单条参考音频, 参考音频以目标采样率的波形输入
+            onnx_ref_audio = None
+            if (
+                self.vits_onnx is not None
+                and self.configs.version in ["v1", "v2"]
+                and speed_factor == 1.0
+                and len(prompt_cache["refer_features"]) == 1
+            ):
+                features = prompt_cache["refer_features"][0]
+                onnx_ref_audio = features["raw_audio"].float().cpu()
+                if onnx_ref_audio.shape[0] == 2:
+                    onnx_ref_audio = onnx_ref_audio.mean(0).unsqueeze(0)
+                if features["raw_sr"] != self.configs.sampling_rate:
+                    onnx_ref_audio = resample(onnx_ref_audio, features["raw_sr"], self.configs.sampling_rate, "cpu")
+                maxx = onnx_ref_audio.abs().max()
+                if maxx > 1:
+                    onnx_ref_audio /= min(2, maxx)
+
+            def predict_semantic(item):
+                """T2S 阶段: 返回 (批次, 语义 token, idx_list, 耗时), 空批次返回 None"""
                 t3 = time.perf_counter()
-                if return_fragment or streaming_mode:
+                if return_fragment:
                     item = make_batch(item)
                     if item is None:
-                        continue
+                        return None
 
-                batch_phones: List[torch.LongTensor] = item["phones"]
-                # batch_phones:torch.LongTensor = item["phones"]
-                batch_phones_len: torch.LongTensor = item["phones_len"]
                 all_phoneme_ids: torch.LongTensor = item["all_phones"]
                 all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
+                batch_phones_len: torch.LongTensor = item["phones_len"]
                 all_bert_features: torch.LongTensor = item["all_bert_features"]
                 norm_text: str = item["norm_text"]
                 max_len = item["max_len"]
@@ -1251,112 +1691,201 @@ class TTS:
                     prompt = None
                 else:
                     prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
                     )
 
-                refer_audio_spec = []
-                
-                sv_emb = [] if self.is_v2pro else None
-                for spec, audio_tensor in self.prompt_cache["refer_spec"]:
-                    spec = spec.to(dtype=self.precision, device=self.configs.device)
-                    refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-
-                if not streaming_mode:
-                    print(f"############ {i18n('预测语义Token')} ############")
-                    pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
+                print(f"############ {i18n('预测语义Token')} ############")
+                t2s_kwargs = dict(
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    early_stop_num=self.configs.hz * self.configs.max_sec,
+                    repetition_penalty=repetition_penalty,
+                    static_kv_cache=self.configs.static_kv_cache,
+                    degeneration_detection=self.configs.degeneration_detection,
+                    mute_emb_sim_matrix=self.configs.mute_emb_sim_matrix,
+                )
+                degenerate_flags = [None] * len(all_phoneme_ids)
+                pred_semantic_list, idx_list = infer_panel(
+                    all_phoneme_ids,
+                    all_phoneme_lens,
+                    prompt,
+                    all_bert_features,
+                    # prompt_phone_len=ph_offset,
+                    max_len=max_len,
+                    degenerate_flags=degenerate_flags,
+                    target_phones_len=batch_phones_len,
+                    **t2s_kwargs,
+                )
+                if self.configs.degeneration_detection:
+                    pred_semantic_list, idx_list = self._resample_degenerate(
+                        infer_panel,
+                        degenerate_flags,
+                        pred_semantic_list,
+                        idx_list,
                         all_phoneme_ids,
                         all_phoneme_lens,
+                        batch_phones_len,
                         prompt,
                         all_bert_features,
-                        # prompt_phone_len=ph_offset,
-                        top_k=top_k,
-                        top_p=top_p,
-                        temperature=temperature,
-                        early_stop_num=self.configs.hz * self.configs.max_sec,
-                        max_len=max_len,
-                        repetition_penalty=repetition_penalty,
+                        t2s_kwargs,
                     )
-                    t4 = time.perf_counter()
-                    t_34 += t4 - t3
+                return item, pred_semantic_list, idx_list, time.perf_counter() - t3
 
-
-                    batch_audio_fragment = []
-
-                    # ## vits并行推理 method 1
-                    # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                    # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                    # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                    # max_len = 0
-                    # for i in range(0, len(batch_phones)):
-                    #     max_len = max(max_len, batch_phones[i].shape[-1])
-                    # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                    # batch_phones = batch_phones.to(self.configs.device)
-                    # batch_audio_fragment = (self.vits_model.batched_decode(
-                    #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                    #     ))
-                    print(f"############ {i18n('合成音频')} ############")
-                    if not self.configs.use_vocoder:
-                        if speed_factor == 1.0:
-                            print(f"{i18n('并行合成中')}...")
-                            # ## vits并行推理 method 2
-                            pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                            upsample_rate = math.prod(self.vits_model.upsample_rates)
-                            audio_frag_idx = [
-                                pred_semantic_list[i].shape[0] * 2 * upsample_rate
-                                for i in range(0, len(pred_semantic_list))
-                            ]
-                            audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
-                            all_pred_semantic = (
-                                torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+            def synthesize(t2s_result):
+                """VITS/声码器阶段: 返回 (本批音频片段, T2S 耗时, 合成耗时)"""
+                if t2s_result is None:
+                    return None
+                item, pred_semantic_list, idx_list, t2s_time = t2s_result
+                t4 = time.perf_counter()
+                batch_phones: List[torch.LongTensor] = item["phones"]
+                batch_phones_len: torch.LongTensor = item["phones_len"]
+                batch_audio_fragment = []
+
+                print(f"############ {i18n('合成音频')} ############")
+                if not self.configs.use_vocoder:
+                    print(f"{i18n('并行合成中')}...")
+                    pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+                    if onnx_ref_audio is not None:
+                        # 导出的 VITS 图只支持 batch size 1: 拼接成一条序列解码后按长度切分
+                        upsample_rate = math.prod(self.vits_model.upsample_rates)
+                        audio_frag_idx = [
+                            pred_semantic_list[i].shape[0] * 2 * upsample_rate
+                            for i in range(0, len(pred_semantic_list))
+                        ]
+                        audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
+                        all_pred_semantic = (
+                            torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+                        )
+                        _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+                        _batch_audio_fragment = self.vits_onnx.decode(
+                            all_pred_semantic, _batch_phones, onnx_ref_audio
+                        ).to(dtype=self.precision, device=self.configs.device)
+
+                        audio_frag_end_idx.insert(0, 0)
+                        batch_audio_fragment = [
+                            _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
+                            for i in range(1, len(audio_frag_end_idx))
+                        ]
+                    else:
+                        # ## vits并行推理: 各句右侧补零成批, 由长度掩码保证互不影响, 支持任意语速
+                        pred_semantic = (
+                            torch.nn.utils.rnn.pad_sequence(pred_semantic_list, batch_first=True)
+                            .unsqueeze(0)
+                            .to(self.configs.device)
+                        )
+                        pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list])
+                        _batch_phones = torch.nn.utils.rnn.pad_sequence(batch_phones, batch_first=True).to(
+                            self.configs.device
+                        )
+                        batch_audio_fragment = [
+                            audio_fragment.detach()
+                            for audio_fragment in self.vits_model.batched_decode(
+                                pred_semantic,
+                                pred_semantic_len,
+                                _batch_phones,
+                                batch_phones_len,
+                                refer_audio_spec,
+                                speed=speed_factor,
+                                sv_emb=sv_emb,
+                                ge=ge,
+                            )
+                        ]
+                else:
+                    if parallel_infer:
+                        print(f"{i18n('并行合成中')}...")
+                        audio_fragments = self.using_vocoder_synthesis_batched_infer(
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                        )
+                        batch_audio_fragment.extend(audio_fragments)
+                    else:
+                        for i, idx in enumerate(tqdm(idx_list)):
+                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                            _pred_semantic = (
+                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                            )  # .unsqueeze(0)#mq要多unsqueeze一次
+                            audio_fragment = self.using_vocoder_synthesis(
+                                _pred_semantic,
+                                phones,
+                                speed=speed_factor,
+                                sample_steps=sample_steps,
+                                prompt_cache=prompt_cache,
                             )
-                            _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+                            batch_audio_fragment.append(audio_fragment)
+                return batch_audio_fragment, t2s_time, time.perf_counter() - t4
+
+            if not streaming_mode:
+                # T2S 与 VITS 分别在两个线程中运行: 前一批合成音频时, 后一批已经开始预测语义 token。
+                # 两个线程交替消耗全局随机数, 固定 seed 时结果不可复现, 因此只在 seed 为 -1 时启用
+                if self.configs.t2s_vits_pipeline and seed == -1 and len(data) > 1:
+                    results = TwoStagePipeline(predict_semantic, synthesize).run(data)
+                else:
+                    results = (synthesize(predict_semantic(item)) for item in data)
+                for result in results:
+                    if result is None:
+                        continue
+                    batch_audio_fragment, t2s_time, vits_time = result
+                    t_34 += t2s_time
+                    t_45 += vits_time
+                    if return_fragment:
+                        print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t2s_time, vits_time))
+                        yield self.audio_postprocess(
+                            [batch_audio_fragment],
+                            output_sr,
+                            None,
+                            speed_factor,
+                            False,
+                            fragment_interval,
+                            super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
+                        )
+                    else:
+                        audio.append(batch_audio_fragment)
 
-                            _batch_audio_fragment = self.vits_model.decode(
-                                    all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                ).detach()[0, 0, :]
+                    if self.stop_flag:
+                        yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
+                        return
+            else:
+                # 整个请求共用一个分块策略, 播放时钟与实时率跨句累计
+                chunk_policy = None
+                if adaptive_chunk:
+                    chunk_policy = AdaptiveChunkPolicy(
+                        first_chunk_length,
+                        max_chunk_length=max(min_chunk_length * 4, first_chunk_length),
+                        token_seconds=0.04 / speed_factor,
+                    )
+                for item in data:
+                    t3 = time.perf_counter()
+                    item = make_batch(item)
+                    if item is None:
+                        continue
 
-                            audio_frag_end_idx.insert(0, 0)
-                            batch_audio_fragment = [
-                                _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
-                                for i in range(1, len(audio_frag_end_idx))
-                            ]
-                        else:
-                            # ## vits串行推理
-                            for i, idx in enumerate(tqdm(idx_list)):
-                                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                                _pred_semantic = (
-                                    pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                                )  # .unsqueeze(0)#mq要多unsqueeze一次
-                                audio_fragment = self.vits_model.decode(
-                                        _pred_semantic, phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                    ).detach()[0, 0, :]
-                            batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+                    batch_phones: List[torch.LongTensor] = item["phones"]
+                    # batch_phones:torch.LongTensor = item["phones"]
+                    batch_phones_len: torch.LongTensor = item["phones_len"]
+                    all_phoneme_ids: torch.LongTensor = item["all_phones"]
+                    all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
+                    all_bert_features: torch.LongTensor = item["all_bert_features"]
+                    norm_text: str = item["norm_text"]
+                    max_len = item["max_len"]
+
+                    print(i18n("前端处理后的文本(每句):"), norm_text)
+                    if no_prompt_text:
+                        prompt = None
                     else:
-                        if parallel_infer:
-                            print(f"{i18n('并行合成中')}...")
-                            audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                                idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
-                            )
-                            batch_audio_fragment.extend(audio_fragments)
-                        else:
-                            for i, idx in enumerate(tqdm(idx_list)):
-                                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                                _pred_semantic = (
-                                    pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                                )  # .unsqueeze(0)#mq要多unsqueeze一次
-                                audio_fragment = self.using_vocoder_synthesis(
-                                    _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
-                                )
-                                batch_audio_fragment.append(audio_fragment)
+                        prompt = (
+                            prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        )
 
-                else:
                     # refer_audio_spec: torch.Tensor = [
                     #     item.to(dtype=self.precision, device=self.configs.device)
-                    #     for item in self.prompt_cache["refer_spec"]
+                    #     for item in prompt_cache["refer_spec"]
                     # ]
-                    semantic_token_generator =self.t2s_model.model.infer_panel(
+                    semantic_token_generator =infer_panel(
                         all_phoneme_ids[0].unsqueeze(0),
                         all_phoneme_lens,
                         prompt,
@@ -1371,6 +1900,8 @@ class TTS:
                         chunk_length=min_chunk_length,
                         mute_emb_sim_matrix=self.configs.mute_emb_sim_matrix if not fixed_length_chunk else None,
                         chunk_split_thershold=chunk_split_thershold,
+                        static_kv_cache=self.configs.static_kv_cache,
+                        chunk_policy=chunk_policy,
                     )
                     t4 = time.perf_counter()
                     t_34 += t4 - t3
@@ -1392,8 +1923,15 @@ class TTS:
                     # last_tokens = None
                     last_latent = None
                     previous_tokens = []
+                    # 文本编码每句只做一次(结果与逐块重新编码相同)。
+                    # streaming_left_context > 0 时声码只保留最近的这些语义 token 作为左侧上下文, 每块计算量不随句长增长,
+                    # 但编码器注意力覆盖整个输入, 输出会与保留整句时不同, 因此默认关闭(0)
+                    left_context = self.configs.streaming_left_context
+                    text_states = self.vits_model.encode_text(phones) if not self.configs.use_vocoder else None
                     overlap_len = overlap_length
                     overlap_size = math.ceil(overlap_length*upsample_rate)
+                    # 计算耗时从生成器恢复执行时开始计, 不包含调用方处理上一块的时间
+                    t_resume = time.perf_counter()
                     for semantic_tokens, is_final in semantic_token_generator:
                         if semantic_tokens is None and last_audio_chunk is not None:
                             yield self.audio_postprocess(
@@ -1412,13 +1950,16 @@ class TTS:
 
                         previous_tokens.append(semantic_tokens)
 
-                        _semantic_tokens = torch.cat(previous_tokens, dim=-1)
-
                         if not is_first_chunk and semantic_tokens.shape[-1] < 10:
                             overlap_len = overlap_length+(10-semantic_tokens.shape[-1])
                         else:
                             overlap_len = overlap_length
 
+                        _semantic_tokens = torch.cat(previous_tokens, dim=-1)
+                        if left_context > 0:
+                            _semantic_tokens = _semantic_tokens[..., -(max(left_context, overlap_len) + semantic_tokens.shape[-1]):]
+                            previous_tokens = [_semantic_tokens]
+
 
                         if not self.configs.use_vocoder:
                             token_padding_length = 0
@@ -1436,7 +1977,9 @@ class TTS:
                                                     result_length=semantic_tokens.shape[-1]+overlap_len if not is_first_chunk else None,
                                                     overlap_frames=last_latent[:,:,-overlap_len*(2 if self.vits_model.semantic_frame_rate == "25hz" else 1):] \
                                                     if last_latent is not None else None,
-                                                    padding_length=token_padding_length
+                                                    padding_length=token_padding_length,
+                                                    ge=ge,
+                                                    text_states=text_states,
                                                 )
                             audio_chunk=audio_chunk.detach()[0, 0, :]
                         else:
@@ -1460,7 +2003,7 @@ class TTS:
 
                         last_latent = latent
                         last_audio_chunk = audio_chunk
-                        yield self.audio_postprocess(
+                        chunk_sr, chunk_data = self.audio_postprocess(
                                 [[audio_chunk_]],
                                 output_sr,
                                 None,
@@ -1469,37 +2012,38 @@ class TTS:
                                 0.0,
                                 super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
                             )
-                        
-                        if is_first_package: 
-                            print(f"first_package_delay: {time.perf_counter()-t0:.3f}")
+                        now = time.perf_counter()
+                        if chunk_policy is not None:
+                            chunk_policy.on_chunk(chunk_data.shape[0] / chunk_sr, now - t_resume, now)
+                        if is_first_package:
+                            self.first_package_delay.record(now - t0)
                             is_first_package = False
+                        yield chunk_sr, chunk_data
+                        t_resume = time.perf_counter()
 
 
+                    if chunk_policy is not None:
+                        chunk_policy.add_audio(int(output_sr * fragment_interval) / output_sr)
                     yield output_sr, np.zeros(int(output_sr*fragment_interval), dtype=np.int16)
 
-                t5 = time.perf_counter()
-                t_45 += t5 - t4
-                if return_fragment:
-                    print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess(
-                        [batch_audio_fragment],
-                        output_sr,
-                        None,
-                        speed_factor,
-                        False,
-                        fragment_interval,
-                        super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
-                    )
-                elif streaming_mode:...
-                else:
-                    audio.append(batch_audio_fragment)
+                    t5 = time.perf_counter()
+                    t_45 += t5 - t4
 
-                if self.stop_flag:
-                    yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
-                    return
+                    if self.stop_flag:
+                        yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
+                        return
 
             if not (return_fragment or streaming_mode):
                 print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
+                if sentence_keys is not None:
+                    # 先按原顺序还原新合成的句子, 写入缓存后与命中的句子合并, 再统一插入间隔
+                    fragments = self.recovery_order(audio, batch_index_list) if split_bucket else sum(audio, [])
+                    for i, fragment in zip(miss_index, fragments):
+                        self.sentence_audio_cache.put(sentence_keys[i], fragment)
+                        cached_fragments[i] = fragment
+                    audio = [[cached_fragments[i] for i in range(len(sentence_keys))]]
+                    batch_index_list = None
+                    split_bucket = False
                 if len(audio) == 0:
                     yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
                     return
@@ -1548,47 +2092,46 @@ class TTS:
         fragment_interval: float = 0.3,
         super_sampling: bool = False,
     ) -> Tuple[int, np.ndarray]:
-        if fragment_interval>0:
-            zero_wav = torch.zeros(
-                int(self.configs.sampling_rate * fragment_interval), dtype=self.precision, device=self.configs.device
-            )
-
-        for i, batch in enumerate(audio):
-            for j, audio_fragment in enumerate(batch):
-                max_audio = torch.abs(audio_fragment).max()  # 简单防止16bit爆音
-                if max_audio > 1:
-                    audio_fragment /= max_audio
-                audio_fragment: torch.Tensor = torch.cat([audio_fragment, zero_wav], dim=0) if fragment_interval>0 else audio_fragment
-                audio[i][j] = audio_fragment
-
         if split_bucket:
-            audio = self.recovery_order(audio, batch_index_list)
+            fragments = self.recovery_order(audio, batch_index_list)
         else:
             # audio = [item for batch in audio for item in batch]
-            audio = sum(audio, [])
-
-        audio = torch.cat(audio, dim=0)
+            fragments = sum(audio, [])
+
+        # 一次性分配输出, 各片段归一化后直接写入对应位置, 片段间隔保持为 0
+        interval = int(self.configs.sampling_rate * fragment_interval) if fragment_interval > 0 else 0
+        total_length = sum(fragment.shape[0] + interval for fragment in fragments)
+        device = fragments[0].device if len(fragments) > 0 else self.configs.device
+        # 超采样需要浮点输入; 否则直接在设备上完成 缩放+截断+转 int16, 只把 int16 结果拷回 CPU
+        out = torch.zeros(total_length, dtype=torch.float32 if super_sampling else torch.int16, device=device)
+        pos = 0
+        for fragment in fragments:
+            fragment = fragment.float()
+            # 简单防止16bit爆音: 峰值超过 1 时归一化(不在 CPU 上判断, 避免同步)
+            scale = 1.0 / torch.abs(fragment).max().clamp(min=1.0)
+            length = fragment.shape[0]
+            if super_sampling:
+                torch.mul(fragment, scale, out=out[pos : pos + length])
+            else:
+                out[pos : pos + length] = torch.mul(fragment, scale * 32768).clamp_(-32768, 32767)
+            pos += length + interval
 
         if super_sampling:
             print(f"############ {i18n('音频超采样')} ############")
             t1 = time.perf_counter()
             self.init_sr_model()
             if not self.sr_model_not_exist:
-                audio, sr = self.sr_model(audio.unsqueeze(0), sr)
+                audio, sr = self.sr_model(out.unsqueeze(0), sr)
                 max_audio = np.abs(audio).max()
                 if max_audio > 1:
                     audio /= max_audio
-            audio = (audio * 32768).astype(np.int16)
+            else:
+                audio = out.cpu().numpy()
+            audio = np.clip(audio * 32768, -32768, 32767).astype(np.int16)
             t2 = time.perf_counter()
             print(f"超采样用时：{t2 - t1:.3f}s")
         else:
-            # audio = audio.float() * 32768
-            # audio = audio.to(dtype=torch.int16).clamp(-32768, 32767).cpu().numpy()
-
-            audio = audio.cpu().numpy()
-
-        audio = (audio * 32768).astype(np.int16)
-
+            audio = out.cpu().numpy()
 
         # try:
         #     if speed_factor != 1.0:
@@ -1599,18 +2142,24 @@ class TTS:
         return sr, audio
 
     def using_vocoder_synthesis(
-        self, semantic_tokens: torch.Tensor, phones: torch.Tensor, speed: float = 1.0, sample_steps: int = 32
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
     ):
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        prompt_semantic_tokens = prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
+        prompt_phones = torch.LongTensor(prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
+        raw_entry = prompt_cache["refer_spec"][0]
         if isinstance(raw_entry, tuple):
             raw_entry = raw_entry[0]
         refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
 
         fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
+        ref_audio: torch.Tensor = prompt_cache["raw_audio"]
+        ref_sr = prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
         if ref_audio.shape[0] == 2:
             ref_audio = ref_audio.mean(0).unsqueeze(0)
@@ -1670,17 +2219,19 @@ class TTS:
         batch_phones: List[torch.Tensor],
         speed: float = 1.0,
         sample_steps: int = 32,
+        prompt_cache: dict = None,
     ) -> List[torch.Tensor]:
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        prompt_semantic_tokens = prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
+        prompt_phones = torch.LongTensor(prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
+        raw_entry = prompt_cache["refer_spec"][0]
         if isinstance(raw_entry, tuple):
             raw_entry = raw_entry[0]
         refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
 
         fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
+        ref_audio: torch.Tensor = prompt_cache["raw_audio"]
+        ref_sr = prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
         if ref_audio.shape[0] == 2:
             ref_audio = ref_audio.mean(0).unsqueeze(0)
@@ -1784,41 +2335,84 @@ class TTS:
         overlap_len: int,
         search_len:int= 320
     ):
-        # overlap_len-=search_len
+        """
+        SOLA 拼接: 在后一段开头 overlap_len + search_len 的范围内搜索与前一段末尾最相关的偏移,
+        对齐后用 Hann 窗交叉淡化。
 
+        各边界的相关性互不依赖(前一段末尾 overlap_len 个采样不受其自身开头的对齐影响),
+        因此所有边界用一次分组卷积同时计算, 交叉淡化也一次完成, 结果直接写入预分配的输出。
+        片段过短、对齐会影响到末尾时退回逐段处理。
+        """
+        dtype = audio_fragments[0].dtype
+        n = len(audio_fragments)
+        if n == 1:
+            return audio_fragments[0]
+        if (
+            audio_fragments[0].shape[0] < overlap_len
+            or any(f.shape[0] < overlap_len + search_len for f in audio_fragments[1:])
+            or any(f.shape[0] < 2 * overlap_len + search_len for f in audio_fragments[1:-1])
+        ):
+            return self._sola_algorithm_sequential(audio_fragments, overlap_len, search_len)
+
+        device = audio_fragments[0].device
+        tails = torch.stack([f[-overlap_len:] for f in audio_fragments[:-1]]).float()
+        heads = torch.stack([f[: overlap_len + search_len] for f in audio_fragments[1:]]).float()
+
+        # [n-1, search_len+1]
+        corr_norm = F.conv1d(heads.unsqueeze(0), tails.unsqueeze(1), groups=n - 1)[0]
+        ones = torch.ones(1, 1, overlap_len, device=device, dtype=heads.dtype)
+        corr_den = F.conv1d(heads.unsqueeze(1) ** 2, ones)[:, 0] + 1e-8
+        idx = (corr_norm / corr_den.sqrt()).argmax(-1)
+
+        window = get_hann_window(overlap_len * 2, device)
+        aligned = heads.gather(1, idx.unsqueeze(1) + torch.arange(overlap_len, device=device).unsqueeze(0))
+        crossfades = (window[:overlap_len] * aligned + window[overlap_len:] * tails).to(dtype)
+
+        idx = idx.tolist()
+        lengths = [audio_fragments[0].shape[0] - overlap_len]
+        lengths += [audio_fragments[i].shape[0] - idx[i - 1] - overlap_len for i in range(1, n - 1)]
+        lengths.append(audio_fragments[-1].shape[0] - idx[-1])
+        output = torch.empty(sum(lengths), device=device, dtype=dtype)
+
+        output[: lengths[0]] = audio_fragments[0][: lengths[0]]
+        pos = lengths[0]
+        for i in range(1, n):
+            fragment = audio_fragments[i][idx[i - 1] :]
+            output[pos : pos + overlap_len] = crossfades[i - 1]
+            output[pos + overlap_len : pos + lengths[i]] = fragment[overlap_len : lengths[i]]
+            pos += lengths[i]
+
+        return output
+
+    def _sola_algorithm_sequential(
+        self,
+        audio_fragments: List[torch.Tensor],
+        overlap_len: int,
+        search_len: int = 320,
+    ):
         dtype = audio_fragments[0].dtype
-        
+        audio_fragments = list(audio_fragments)
+
         for i in range(len(audio_fragments) - 1):
             f1 = audio_fragments[i].float()
             f2 = audio_fragments[i + 1].float()
             w1 = f1[-overlap_len:]
             w2 = f2[:overlap_len+search_len]
-            # w2 = w2[-w2.shape[-1]//2:]
-            # assert w1.shape == w2.shape
             corr_norm = F.conv1d(w2.view(1, 1, -1), w1.view(1, 1, -1)).view(-1)
 
             corr_den = F.conv1d(w2.view(1, 1, -1)**2, torch.ones_like(w1).view(1, 1, -1)).view(-1)+ 1e-8
             idx = (corr_norm/corr_den.sqrt()).argmax()
 
-            print(f"seg_idx: {idx}")
-
-            # idx = corr.argmax()
             f1_ = f1[: -overlap_len]
             audio_fragments[i] = f1_
 
-            f2_ = f2[idx:]
-            window = torch.hann_window((overlap_len) * 2, device=f1.device, dtype=f1.dtype)
+            # 复制一份, 避免原地修改调用方的张量
+            f2_ = f2[idx:].clone()
+            window = get_hann_window(overlap_len * 2, f1.device)
             f2_[: overlap_len] = (
                 window[: overlap_len] * f2_[: overlap_len]
                 + window[overlap_len :] * f1[-overlap_len :]
             )
-
-            # window = torch.sin(torch.arange((overlap_len - idx), device=f1.device) * np.pi / (overlap_len - idx))
-            # f2_[: (overlap_len - idx)] = (
-            #     window * f2_[: (overlap_len - idx)]
-            #     + (1-window) * f1[-(overlap_len - idx) :]
-            # )
-
             audio_fragments[i + 1] = f2_
 
         return torch.cat(audio_fragments, 0).to(dtype)
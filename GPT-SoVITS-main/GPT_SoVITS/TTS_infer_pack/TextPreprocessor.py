@@ -2,16 +2,16 @@ import os
 import sys
 import threading
 
-from tqdm import tqdm
-
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
+import time
 import torch
+from collections import OrderedDict
 from text.LangSegmenter import LangSegmenter
 from text import chinese
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from text.cleaner import clean_text
 from text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
@@ -49,11 +49,99 @@ def merge_short_text_in_array(texts: str, threshold: int) -> list:
     return result
 
 
+class TextFeatureCache:
+    """
+    文本前端结果(phones, bert_features, norm_text)的 LRU/TTL 缓存, 按占用字节数限制大小。
+    Bert 特征存放在 CPU 上, 可选以 fp16 保存, 命中时还原为原始精度。
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024, ttl: float = 0, fp16: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.fp16 = fp16
+        self.entries: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, language: str, version: str, final: bool = False) -> tuple:
+        # 与 clean_segments 相同的空格归一化, 保证命中时结果一致
+        return (re.sub(r" {2,}", " ", text), language, version, final)
+
+    def get(self, key: tuple, device: torch.device) -> Optional[Tuple[list, torch.Tensor, str]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry["time"] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        bert = entry["bert"].to(dtype=entry["dtype"], device=device)
+        return list(entry["phones"]), bert, entry["norm_text"]
+
+    def put(self, key: tuple, phones: list, bert: torch.Tensor, norm_text: str):
+        stored = bert.detach().to("cpu", dtype=torch.float16 if self.fp16 else bert.dtype)
+        size = stored.numel() * stored.element_size() + len(phones) * 8 + len(norm_text) * 4
+        if size > self.max_bytes:
+            return
+        entry = {
+            "phones": list(phones),
+            "bert": stored,
+            "dtype": bert.dtype,
+            "norm_text": norm_text,
+            "size": size,
+            "time": time.monotonic(),
+        }
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
 class TextPreprocessor:
-    def __init__(self, bert_model: AutoModelForMaskedLM, tokenizer: AutoTokenizer, device: torch.device):
+    def __init__(
+        self,
+        bert_model: AutoModelForMaskedLM,
+        tokenizer: AutoTokenizer,
+        device: torch.device,
+        bert_batch_size: int = 16,
+        feature_cache: TextFeatureCache = None,
+    ):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
+        self.bert_batch_size = bert_batch_size
+        self.feature_cache = feature_cache
         self.bert_lock = threading.RLock()
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
@@ -62,8 +150,7 @@ class TextPreprocessor:
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        for phones, bert_features, norm_text in self.segment_and_extract_feature_for_texts(texts, lang, version):
             if phones is None or norm_text == "":
                 continue
             res = {
@@ -119,89 +206,149 @@ class TextPreprocessor:
     ) -> Tuple[list, torch.Tensor, str]:
         return self.get_phones_and_bert(text, language, version)
 
+    def segment_and_extract_feature_for_texts(
+        self, texts: List[str], language: str, version: str = "v1"
+    ) -> List[Tuple[list, torch.Tensor, str]]:
+        return self.get_phones_and_bert_batch(texts, language, version)
+
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
+        return self.get_phones_and_bert_batch([text], language, version, final)[0]
+
+    def get_phones_and_bert_batch(self, texts: List[str], language: str, version: str, final: bool = False):
+        """
+        对多句文本一起提取音素和 Bert 特征: 先逐句分语种、转音素,
+        再把所有中文片段合并成若干个 padding 后的批次做一次前向, 最后按片段拆回各句。
+        """
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        if self.feature_cache is not None:
+            # 命中缓存的句子跳过整个前端(分语种、转音素、Bert)
+            for i, text in enumerate(texts):
+                keys[i] = self.feature_cache.make_key(text, language, version, final)
+                results[i] = self.feature_cache.get(keys[i], self.device)
+        todo = [i for i in range(len(texts)) if results[i] is None]
+        if not todo:
+            return results
+
         with self.bert_lock:
-            text = re.sub(r' {2,}', ' ', text)
-            textlist = []
-            langlist = []
-            if language == "all_zh":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_yue":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ja":
-                for tmp in LangSegmenter.getTexts(text,"ja"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ko":
-                for tmp in LangSegmenter.getTexts(text,"ko"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "en":
-                langlist.append("en")
-                textlist.append(text)
-            elif language == "auto":
-                for tmp in LangSegmenter.getTexts(text):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "auto_yue":
-                for tmp in LangSegmenter.getTexts(text):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            else:
-                for tmp in LangSegmenter.getTexts(text):
-                    if langlist:
-                        if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
-                            textlist[-1] += tmp["text"]
-                            continue
-                    if tmp["lang"] == "en":
-                        langlist.append(tmp["lang"])
+            segments_list = []
+            for text in [texts[i] for i in todo]:
+                segments = self.clean_segments(text, language, version)
+                if not final and sum(len(segment[0]) for segment in segments) < 6:
+                    segments = self.clean_segments("." + text, language, version)
+                segments_list.append(segments)
+
+            zh_segments = [
+                segment for segments in segments_list for segment in segments if segment[3] == "zh"
+            ]
+            zh_features = self.get_bert_feature_batch(
+                [segment[2] for segment in zh_segments], [segment[1] for segment in zh_segments]
+            )
+            zh_feature_map = {id(segment): feature for segment, feature in zip(zh_segments, zh_features)}
+
+            for i, segments in zip(todo, segments_list):
+                bert_list = []
+                for segment in segments:
+                    if segment[3] == "zh":
+                        bert_list.append(zh_feature_map[id(segment)].to(self.device))
                     else:
-                        # 因无法区别中日韩文汉字,以用户输入为准
-                        langlist.append(language)
-                    textlist.append(tmp["text"])
-            # print(textlist)
-            # print(langlist)
-            phones_list = []
-            bert_list = []
-            norm_text_list = []
-            for i in range(len(textlist)):
-                lang = langlist[i]
-                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                phones_list.append(phones)
-                norm_text_list.append(norm_text)
-                bert_list.append(bert)
-            bert = torch.cat(bert_list, dim=1)
-            phones = sum(phones_list, [])
-            norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
+                        bert_list.append(self.get_bert_inf(segment[0], segment[1], segment[2], segment[3]))
+                bert = torch.cat(bert_list, dim=1)
+                phones = sum([segment[0] for segment in segments], [])
+                norm_text = "".join([segment[2] for segment in segments])
+                results[i] = (phones, bert, norm_text)
+                if self.feature_cache is not None:
+                    self.feature_cache.put(keys[i], phones, bert, norm_text)
+            return results
+
+    def clean_segments(self, text: str, language: str, version: str) -> List[tuple]:
+        """按语种切分并转音素, 返回 (phones, word2ph, norm_text, lang) 列表, 不提取 Bert 特征"""
+        text = re.sub(r' {2,}', ' ', text)
+        textlist, langlist = self.split_languages(text, language)
+        segments = []
+        for i in range(len(textlist)):
+            lang = langlist[i].replace("all_", "")
+            phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+            segments.append((phones, word2ph, norm_text, lang))
+        return segments
+
+    def split_languages(self, text: str, language: str) -> Tuple[list, list]:
+        textlist = []
+        langlist = []
+        if language == "all_zh":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_yue":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ja":
+            for tmp in LangSegmenter.getTexts(text,"ja"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ko":
+            for tmp in LangSegmenter.getTexts(text,"ko"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "en":
+            langlist.append("en")
+            textlist.append(text)
+        elif language == "auto":
+            for tmp in LangSegmenter.getTexts(text):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "auto_yue":
+            for tmp in LangSegmenter.getTexts(text):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        else:
+            for tmp in LangSegmenter.getTexts(text):
+                if langlist:
+                    if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
+                        textlist[-1] += tmp["text"]
+                        continue
+                if tmp["lang"] == "en":
+                    langlist.append(tmp["lang"])
+                else:
+                    # 因无法区别中日韩文汉字,以用户输入为准
+                    langlist.append(language)
+                textlist.append(tmp["text"])
+        # print(textlist)
+        # print(langlist)
+        return textlist, langlist
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+        return self.get_bert_feature_batch([text], [word2ph])[0]
+
+    def get_bert_feature_batch(self, texts: List[str], word2ph_list: List[list]) -> List[torch.Tensor]:
+        """
+        Batched BERT feature extraction.
+        Texts are sorted by length and run through the model in padded batches of bert_batch_size,
+        then each character-level feature is expanded to phone level with repeat_interleave.
+        """
+        features = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.bert_batch_size):
+            indices = order[start : start + self.bert_batch_size]
+            with torch.no_grad():
+                inputs = self.tokenizer([texts[i] for i in indices], return_tensors="pt", padding=True)
+                for key in inputs:
+                    inputs[key] = inputs[key].to(self.device)
+                res = self.bert_model(**inputs, output_hidden_states=True)
+                res = torch.cat(res["hidden_states"][-3:-2], -1)
+                token_lens = inputs["attention_mask"].sum(dim=1).tolist()
+            for j, i in enumerate(indices):
+                word2ph = word2ph_list[i]
+                assert len(word2ph) == len(texts[i])
+                char_feature = res[j, 1 : token_lens[j] - 1]
+                repeats = torch.tensor(word2ph, dtype=torch.long, device=char_feature.device)
+                features[i] = torch.repeat_interleave(char_feature, repeats, dim=0).T
+        return features
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
@@ -0,0 +1,199 @@
+"""
+fp32 与 int8 动态量化(TTS_Config.quantization = "int8")在 CPU 上的质量与吞吐对比。
+
+用法(在项目根目录执行):
+    python GPT_SoVITS/benchmark_quantization.py -c GPT_SoVITS/configs/tts_infer.yaml \\
+        --ref_audio ref.wav --prompt_text "参考音频的文本" --prompt_lang zh --text_lang zh --texts texts.txt
+
+输出:
+    - 模型权重占用(BERT / CNHubert / T2S)
+    - 质量: BERT 特征、CNHubert 特征、T2S 首步 logits 与 fp32 的余弦相似度, 以及 T2S 贪心 token 一致率
+    - 吞吐: 端到端合成耗时与 RTF, 合成结果保存在 --out_dir 下供试听
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+import yaml
+
+from TTS_infer_pack.TTS import TTS, TTS_Config
+
+default_texts = [
+    "今天天气不错，我们一起去公园散步吧。",
+    "语音合成系统需要在保证音质的同时尽量降低延迟。",
+    "The quick brown fox jumps over the lazy dog.",
+    "请在三个工作日内完成付款，感谢您的配合。",
+]
+
+
+def tensor_bytes(obj) -> int:
+    # 量化 Linear 的 state_dict 中权重以 (qweight, bias) 元组保存
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (list, tuple)):
+        return sum(tensor_bytes(item) for item in obj)
+    return 0
+
+
+def module_bytes(module) -> int:
+    if module is None:
+        return 0
+    return sum(tensor_bytes(value) for value in module.state_dict().values())
+
+
+def t2s_bytes(t2s_model) -> int:
+    # 量化后的投影层挂在 t2s_transformer 上, 不属于 nn.Module 的子模块, 需要单独统计
+    total = module_bytes(t2s_model)
+    for block in t2s_model.model.t2s_transformer.blocks:
+        for module in [getattr(block, "qkv", None), getattr(block, "out", None)]:
+            total += module_bytes(module)
+        for module in [getattr(block.mlp, "fc1", None), getattr(block.mlp, "fc2", None)]:
+            total += module_bytes(module)
+    return total
+
+
+def load_tts(config_path: str, quantization: str) -> TTS:
+    with open(config_path, "r", encoding="utf-8") as f:
+        configs = yaml.load(f, Loader=yaml.FullLoader)
+    custom = dict(configs.get("custom", {}))
+    custom["device"] = "cpu"
+    custom["is_half"] = False
+    custom["quantization"] = quantization
+    configs["custom"] = custom
+    tts_config = TTS_Config(configs)
+    # 不覆盖用户的配置文件
+    tts_config.configs_path = os.path.join(tempfile.mkdtemp(), "tts_infer.yaml")
+    return TTS(tts_config)
+
+
+def cosine(a: torch.Tensor, b: torch.Tensor) -> float:
+    return float(F.cosine_similarity(a.float().flatten(), b.float().flatten(), dim=0))
+
+
+@torch.no_grad()
+def compare_quality(fp32: TTS, int8: TTS, args, texts):
+    results = {"bert": [], "cnhubert": [], "t2s_logits": [], "t2s_top1": []}
+
+    wav16k, _ = librosa.load(args.ref_audio, sr=16000)
+    wav16k = torch.from_numpy(wav16k).unsqueeze(0)
+    ssl_fp32 = fp32.cnhuhbert_model.model(wav16k)["last_hidden_state"]
+    ssl_int8 = int8.cnhuhbert_model.model(wav16k)["last_hidden_state"]
+    results["cnhubert"].append(cosine(ssl_fp32, ssl_int8))
+
+    prompt = fp32._extract_prompt_semantic(args.ref_audio).unsqueeze(0)
+    for text in texts:
+        phones_fp32, bert_fp32, _ = fp32.text_preprocessor.segment_and_extract_feature_for_text(
+            text, args.text_lang, fp32.configs.version
+        )
+        phones_int8, bert_int8, _ = int8.text_preprocessor.segment_and_extract_feature_for_text(
+            text, args.text_lang, int8.configs.version
+        )
+        if phones_fp32 is None:
+            continue
+        results["bert"].append(cosine(bert_fp32, bert_int8))
+
+        # 相同输入下对比 T2S: 首步 logits 与贪心解码的 token 一致率
+        x = torch.LongTensor(phones_fp32).unsqueeze(0)
+        bert = bert_fp32.unsqueeze(0)
+        logits_fp32, *_ = fp32.t2s_model.model.prefill_single(x, prompt, bert)
+        logits_int8, *_ = int8.t2s_model.model.prefill_single(x, prompt, bert)
+        results["t2s_logits"].append(cosine(logits_fp32, logits_int8))
+
+        tokens = []
+        for tts in [fp32, int8]:
+            y, idx = next(
+                tts.t2s_model.model.infer_panel_naive(
+                    x, None, prompt, bert, top_k=1, early_stop_num=tts.configs.hz * tts.configs.max_sec
+                )
+            )
+            tokens.append(y[0, prompt.shape[1] :])
+        length = min(tokens[0].shape[0], tokens[1].shape[0])
+        agree = float((tokens[0][:length] == tokens[1][:length]).float().mean()) if length > 0 else 0.0
+        results["t2s_top1"].append(agree)
+
+    return {key: float(np.mean(value)) if len(value) > 0 else float("nan") for key, value in results.items()}
+
+
+def benchmark_run(tts: TTS, args, texts, tag: str):
+    inputs = {
+        "text_lang": args.text_lang,
+        "ref_audio_path": args.ref_audio,
+        "prompt_text": args.prompt_text,
+        "prompt_lang": args.prompt_lang,
+        # 贪心解码保证可复现; 不固定 seed, 避免逐句音频缓存命中影响计时
+        "top_k": 1,
+        "seed": -1,
+        "batch_size": args.batch_size,
+        "parallel_infer": True,
+    }
+    # 预热一次, 排除参考音频特征提取与首次运行的开销
+    list(tts.run({**inputs, "text": texts[0]}))
+
+    total_time = 0.0
+    total_audio = 0.0
+    for i, text in enumerate(texts):
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            sr, audio = next(tts.run({**inputs, "text": text}))
+            total_time += time.perf_counter() - t0
+            total_audio += audio.shape[0] / sr
+        sf.write(os.path.join(args.out_dir, f"{tag}_{i}.wav"), audio, sr)
+    return total_time, total_audio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS int8 quantization benchmark")
+    parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml")
+    parser.add_argument("--ref_audio", type=str, required=True)
+    parser.add_argument("--prompt_text", type=str, required=True)
+    parser.add_argument("--prompt_lang", type=str, default="zh")
+    parser.add_argument("--text_lang", type=str, default="zh")
+    parser.add_argument("--texts", type=str, default=None, help="每行一句的文本文件, 默认使用内置句子")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--out_dir", type=str, default="benchmark_quantization")
+    args = parser.parse_args()
+
+    texts = default_texts
+    if args.texts is not None:
+        with open(args.texts, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    fp32 = load_tts(args.tts_config, None)
+    int8 = load_tts(args.tts_config, "int8")
+
+    print("=" * 30 + " memory (MB) " + "=" * 30)
+    for name, fn in [
+        ("bert", lambda tts: module_bytes(tts.bert_model)),
+        ("cnhubert", lambda tts: module_bytes(tts.cnhuhbert_model)),
+        ("t2s", lambda tts: t2s_bytes(tts.t2s_model)),
+    ]:
+        size_fp32, size_int8 = fn(fp32) / 1024**2, fn(int8) / 1024**2
+        print(f"{name:<10} fp32: {size_fp32:8.1f}  int8: {size_int8:8.1f}  ratio: {size_int8 / size_fp32:.2f}")
+
+    print("=" * 30 + " quality " + "=" * 30)
+    for key, value in compare_quality(fp32, int8, args, texts).items():
+        print(f"{key:<12} {value:.4f}")
+
+    print("=" * 30 + " throughput " + "=" * 30)
+    for tag, tts in [("fp32", fp32), ("int8", int8)]:
+        total_time, total_audio = benchmark_run(tts, args, texts, tag)
+        print(f"{tag}: {total_time:.2f}s for {total_audio:.2f}s audio, RTF {total_time / total_audio:.3f}")
+    print(f"audio saved to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
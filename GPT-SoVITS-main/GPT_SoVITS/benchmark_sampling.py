@@ -0,0 +1,106 @@
+"""
+逐步采样的微基准: AR.models.utils.sample 与 T2SSampler 的单步耗时对比。
+
+用法(在项目根目录执行):
+    python GPT_SoVITS/benchmark_sampling.py --device cuda --batch_sizes 1 4 16 --history_lens 100 500 1000
+
+输出:
+    - 每组 (batch size, 历史长度, 采样参数) 下两种实现的单步耗时(微秒)与加速比
+    - 一致性检查: 关闭随机性(top_k=1)时两种实现选出的 token 是否相同
+"""
+
+import argparse
+import os
+import sys
+import time
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+import torch
+
+from AR.models.utils import T2SSampler, sample
+
+# (top_k, top_p, temperature, repetition_penalty)
+param_sets = [
+    (15, 1.0, 1.0, 1.35),  # api_v2 默认参数
+    (5, 1.0, 1.0, 1.0),
+    (15, 0.8, 0.8, 1.35),
+    (1025, 1.0, 1.0, 1.35),  # top_k 覆盖整个词表
+]
+
+
+def sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def bench(fn, steps: int, device: torch.device) -> float:
+    for _ in range(10):
+        fn()
+    sync(device)
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    sync(device)
+    return (time.perf_counter() - t0) / steps * 1e6
+
+
+@torch.no_grad()
+def check_greedy(batch_size: int, history_len: int, vocab_size: int, device: torch.device, dtype: torch.dtype) -> bool:
+    # top_k=1 时采样是确定的, 两种实现(含重复惩罚)应给出相同的 token
+    logits = torch.randn(batch_size, vocab_size, device=device, dtype=dtype)
+    history = torch.randint(0, vocab_size, (batch_size, history_len), device=device)
+    expected = sample(logits.clone(), history, top_k=1, top_p=1.0, repetition_penalty=1.35, temperature=1.0)[0]
+    sampler = T2SSampler(batch_size, vocab_size, device, top_k=1, top_p=1.0, repetition_penalty=1.35, dtype=dtype)
+    sampler.set_history(history)
+    return bool((sampler.sample(logits.clone()) == expected).all())
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser(description="T2S sampling micro-benchmark")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--half", action="store_true")
+    parser.add_argument("--vocab_size", type=int, default=1025)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--history_lens", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--steps", type=int, default=500)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = torch.float16 if args.half else torch.float32
+    vocab_size = args.vocab_size
+
+    print(f"{'bs':>4} {'hist':>6} {'top_k':>6} {'top_p':>6} {'temp':>5} {'rp':>5} {'sample(us)':>11} {'sampler(us)':>12} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        for history_len in args.history_lens:
+            logits = torch.randn(batch_size, vocab_size, device=device, dtype=dtype)
+            history = torch.randint(0, vocab_size, (batch_size, history_len), device=device, dtype=torch.int)
+            for top_k, top_p, temperature, repetition_penalty in param_sets:
+                kwargs = dict(top_k=top_k, top_p=top_p, temperature=temperature, repetition_penalty=repetition_penalty)
+
+                # 与解码循环一致: 每步都会带着完整历史调用 sample()
+                def run_sample():
+                    sample(logits.clone(), history, **kwargs)
+
+                sampler = T2SSampler(batch_size, vocab_size, device, dtype=dtype, **kwargs)
+                sampler.set_history(history)
+
+                def run_sampler():
+                    sampler.sample(logits.clone())
+
+                t_sample = bench(run_sample, args.steps, device)
+                t_sampler = bench(run_sampler, args.steps, device)
+                print(
+                    f"{batch_size:>4} {history_len:>6} {top_k:>6} {top_p:>6} {temperature:>5} {repetition_penalty:>5} "
+                    f"{t_sample:>11.1f} {t_sampler:>12.1f} {t_sample / t_sampler:>7.2f}x"
+                )
+
+    ok = all(check_greedy(batch_size, 200, vocab_size, device, dtype) for batch_size in args.batch_sizes)
+    print(f"greedy equivalence: {'OK' if ok else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
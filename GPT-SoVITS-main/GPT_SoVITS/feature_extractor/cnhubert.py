@@ -10,6 +10,7 @@ logging.getLogger("numba").setLevel(logging.WARNING)
 
 from transformers import (
     Wav2Vec2FeatureExtractor,
+    HubertConfig,
     HubertModel,
 )
 
@@ -20,7 +21,7 @@ cnhubert_base_path = None
 
 
 class CNHubert(nn.Module):
-    def __init__(self, base_path: str = None):
+    def __init__(self, base_path: str = None, load_weights: bool = True):
         super().__init__()
         if base_path is None:
             base_path = cnhubert_base_path
@@ -28,7 +29,11 @@ class CNHubert(nn.Module):
             ...
         else:
             raise FileNotFoundError(base_path)
-        self.model = HubertModel.from_pretrained(base_path, local_files_only=True)
+        if load_weights:
+            self.model = HubertModel.from_pretrained(base_path, local_files_only=True)
+        else:
+            # 只按配置构建结构, 权重随后由调用方加载(如 int8 量化缓存)
+            self.model = HubertModel(HubertConfig.from_pretrained(base_path, local_files_only=True))
         self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(base_path, local_files_only=True)
 
     def forward(self, x):
@@ -211,18 +211,25 @@ class TextEncoder(nn.Module):
 
         self.proj = nn.Conv1d(hidden_channels, out_channels * 2, 1)
 
-    def forward(self, y, y_lengths, text, text_lengths, ge, speed=1, test=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None):
+    def encode_text(self, text, text_lengths, dtype, test=None):
+        """文本侧编码只依赖音素, 流式解码时同一句的各块可复用其结果"""
+        text_mask = torch.unsqueeze(commons.sequence_mask(text_lengths, text.size(1)), 1).to(dtype)
+        if test == 1:
+            text[:, :] = 0
+        text = self.text_embedding(text).transpose(1, 2)
+        text = self.encoder_text(text * text_mask, text_mask)
+        return text, text_mask
+
+    def forward(self, y, y_lengths, text, text_lengths, ge, speed=1, test=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None, text_states=None):
         y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, y.size(2)), 1).to(y.dtype)
 
         y = self.ssl_proj(y * y_mask) * y_mask
 
         y = self.encoder_ssl(y * y_mask, y_mask)
 
-        text_mask = torch.unsqueeze(commons.sequence_mask(text_lengths, text.size(1)), 1).to(y.dtype)
-        if test == 1:
-            text[:, :] = 0
-        text = self.text_embedding(text).transpose(1, 2)
-        text = self.encoder_text(text * text_mask, text_mask)
+        if text_states is None:
+            text_states = self.encode_text(text, text_lengths, y.dtype, test)
+        text, text_mask = text_states
         y = self.mrte(y, y_mask, text, text_mask, ge)
 
         if padding_length is not None and padding_length!=0:
@@ -453,6 +460,7 @@ class Generator(torch.nn.Module):
         super(Generator, self).__init__()
         self.num_kernels = len(resblock_kernel_sizes)
         self.num_upsamples = len(upsample_rates)
+        self.upsample_rates = upsample_rates
         self.conv_pre = Conv1d(initial_channel, upsample_initial_channel, 7, 1, padding=3)
         resblock = modules.ResBlock1 if resblock == "1" else modules.ResBlock2
 
@@ -482,23 +490,28 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None):
+        # x_mask: [B, 1, T] 批量解码时右侧补零部分的掩码, 每次上采样后同步展开, 避免补零部分影响有效部分
         x = self.conv_pre(x)
         if g is not None:
             x = x + self.cond(g)
 
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, modules.LRELU_SLOPE)
+            if x_mask is not None:
+                x = x * x_mask
             x = self.ups[i](x)
+            if x_mask is not None:
+                x_mask = x_mask.repeat_interleave(self.upsample_rates[i], dim=-1)
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](x, x_mask)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
-        x = self.conv_post(x)
+        x = self.conv_post(x if x_mask is None else x * x_mask)
         x = torch.tanh(x)
 
         return x
@@ -992,30 +1005,37 @@ class SynthesizerTrn(nn.Module):
 
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None):
-        def get_ge(refer, sv_emb):
-            ge = None
-            if refer is not None:
-                refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
-                refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
-                if self.version == "v1":
-                    ge = self.ref_enc(refer * refer_mask, refer_mask)
-                else:
-                    ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
-                if self.is_v2pro:
-                    sv_emb = self.sv_emb(sv_emb)  # B*20480->B*512
-                    ge += sv_emb.unsqueeze(-1)
-                    ge = self.prelu(ge)
-            return ge
+    def get_ge(self, refer, sv_emb=None):
+        """单条参考频谱的全局音色向量 ge, 可由调用方缓存"""
+        ge = None
+        if refer is not None:
+            refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
+            refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
+            if self.version == "v1":
+                ge = self.ref_enc(refer * refer_mask, refer_mask)
+            else:
+                ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
+            if self.is_v2pro:
+                sv_emb = self.sv_emb(sv_emb)  # B*20480->B*512
+                ge += sv_emb.unsqueeze(-1)
+                ge = self.prelu(ge)
+        return ge
 
+    @torch.no_grad()
+    def get_fused_ge(self, refer, sv_emb=None):
+        """多条参考频谱时对各自的 ge 取平均; 结果可作为 decode 的 ge 参数重复使用"""
         if type(refer) == list:
             ges = []
             for idx, _refer in enumerate(refer):
-                ge = get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
+                ge = self.get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
                 ges.append(ge)
-            ge = torch.stack(ges, 0).mean(0)
-        else:
-            ge = get_ge(refer, sv_emb)
+            return torch.stack(ges, 0).mean(0)
+        return self.get_ge(refer, sv_emb)
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, ge=None):
+        if ge is None:
+            ge = self.get_fused_ge(refer, sv_emb)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1038,32 +1058,83 @@ class SynthesizerTrn(nn.Module):
         o = self.dec((z * y_mask)[:, :, :], g=ge)
         return o
 
+    @torch.no_grad()
+    def batched_decode(
+        self, codes, codes_lengths, text, text_lengths, refer, noise_scale=0.5, speed=1, sv_emb=None, ge=None
+    ):
+        """
+        多句并行解码, 补零部分通过长度掩码在 enc_p、flow 与 dec 中屏蔽, 各句互不影响。
+        codes: [1, B, T] 右侧补零的语义 token, codes_lengths: [B]
+        text: [B, N] 右侧补零的音素, text_lengths: [B]
+        返回每句音频 [samples] 的列表, 长度与逐句调用 decode 一致。
+        """
+        if ge is None:
+            ge = self.get_fused_ge(refer, sv_emb)
+        batch_size = codes.size(1)
+        ge = ge.expand(batch_size, -1, -1)
+
+        y_lengths = codes_lengths.to(codes.device) * 2
+        text_lengths = text_lengths.to(text.device)
+
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(quantized, size=int(quantized.shape[-1] * 2), mode="nearest")
+        # 变速放到逐句插值: 对补零后的整段插值会让每句的缩放比例随补零长度变化
+        x, m_p, logs_p, y_mask, _, _ = self.enc_p(
+            quantized,
+            y_lengths,
+            text,
+            text_lengths,
+            self.ge_to512(ge.transpose(2, 1)).transpose(2, 1) if self.is_v2pro else ge,
+            1,
+        )
+        if speed != 1:
+            # proj 是逐帧的 1x1 卷积, 与线性插值可交换, 因此直接对 m_p/logs_p 插值与 enc_p 内部一致
+            lengths = [int(int(length) / speed) + 1 for length in y_lengths.tolist()]
+            max_length = max(lengths)
+
+            def stretch(stats):
+                return torch.stack(
+                    [
+                        F.pad(
+                            F.interpolate(stats[i : i + 1, :, :length], size=lengths[i], mode="linear")[0],
+                            (0, max_length - lengths[i]),
+                        )
+                        for i, length in enumerate(y_lengths.tolist())
+                    ]
+                )
+
+            m_p, logs_p = stretch(m_p), stretch(logs_p)
+            y_lengths = torch.LongTensor(lengths).to(codes.device)
+            y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, max_length), 1).to(m_p.dtype)
+
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+
+        z = self.flow(z_p, y_mask, g=ge, reverse=True)
+
+        o = self.dec(z * y_mask, g=ge, x_mask=y_mask)
+        upsample_rate = math.prod(self.upsample_rates)
+        return [o[i, 0, : length * upsample_rate] for i, length in enumerate(y_lengths.tolist())]
 
     @torch.no_grad()
-    def decode_streaming(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None):
-        def get_ge(refer, sv_emb):
-            ge = None
-            if refer is not None:
-                refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
-                refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
-                if self.version == "v1":
-                    ge = self.ref_enc(refer * refer_mask, refer_mask)
-                else:
-                    ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
-                if self.is_v2pro:
-                    sv_emb = self.sv_emb(sv_emb)  # B*20480->B*512
-                    ge += sv_emb.unsqueeze(-1)
-                    ge = self.prelu(ge)
-            return ge
+    def encode_text(self, text, dtype=None):
+        """
+        预先编码一句的音素, 结果作为 decode_streaming 的 text_states 传入,
+        避免每个流式块都重新编码整句文本
+        """
+        text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
+        dtype = self.enc_p.proj.weight.dtype if dtype is None else dtype
+        return self.enc_p.encode_text(text, text_lengths, dtype)
 
-        if type(refer) == list:
-            ges = []
-            for idx, _refer in enumerate(refer):
-                ge = get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
-                ges.append(ge)
-            ge = torch.stack(ges, 0).mean(0)
-        else:
-            ge = get_ge(refer, sv_emb)
+    @torch.no_grad()
+    def decode_streaming(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None, ge=None, text_states=None):
+        """
+        result_length 指定实际输出的末尾帧数。codes 可以只包含本块及其左侧一段上下文,
+        这样每块的计算量与句子已生成的长度无关; 但编码器的自注意力覆盖整个输入序列
+        (只有相对位置编码有窗口限制), 截断左侧上下文会改变输出, 是以音质换取延迟的近似。
+        """
+        if ge is None:
+            ge = self.get_fused_ge(refer, sv_emb)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1082,7 +1153,8 @@ class SynthesizerTrn(nn.Module):
             speed,
             result_length=result_length, 
             overlap_frames=overlap_frames, 
-            padding_length=padding_length
+            padding_length=padding_length,
+            text_states=text_states,
             )
         z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
 
@@ -32,8 +32,11 @@ if is_g2pw:
 
     parent_directory = os.path.dirname(current_file_path)
     g2pw = G2PWPinyin(
-        model_dir="GPT_SoVITS/text/G2PWModel",
-        model_source=os.environ.get("bert_path", "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"),
+        model_dir=os.path.join(os.path.abspath(current_file_path), "G2PWModel"),
+        model_source=os.environ.get(
+            "bert_path",
+            os.path.join(os.path.abspath(parent_directory), "pretrained_models/chinese-roberta-wwm-ext-large"),
+        ),
         v_to_u=False,
         neutral_tone_with_five=True,
     )
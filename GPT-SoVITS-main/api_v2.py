@@ -7,6 +7,11 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `-w` - `并发推理线程数, 大于1时开启跨请求的连续批处理(需开启parallel_infer), 默认1`
+    `-q` - `推理排队的最大请求数, 超出时返回 429, 默认8`
+    `-t` - `请求最长排队时间(秒), 超时返回 503, 默认60`
+    `--cache_max_mb` - `固定 seed 请求的合成结果内存缓存上限(MB), 0 为关闭, 默认256`
+    `--cache_dir` - `合成结果磁盘缓存目录, 默认不开启`
 
 ## 调用:
 
@@ -44,12 +49,27 @@ POST:
     "streaming_mode": False,      # bool or int. return audio chunk by chunk.T he available options are: 0,1,2,3 or True/False (0/False: Disabled | 1/True: Best Quality, Slowest response speed (old version streaming_mode) | 2: Medium Quality, Slow response speed | 3: Lower Quality, Faster response speed )
     "overlap_length": 2,          # int. overlap length of semantic tokens for streaming mode.
     "min_chunk_length": 16,       # int. The minimum chunk length of semantic tokens for streaming mode. (affects audio chunk size)
+    "adaptive_chunk": False,      # bool. streaming mode only. start with a small first chunk for low first-packet latency, then grow the chunk size.
+    "first_chunk_length": 4,      # int. the semantic token length of the first chunk when adaptive_chunk is enabled.
 }
 ```
 
 RESP:
-成功: 直接返回 wav 音频流， http code 200
+成功: 直接返回 wav 音频流， http code 200, 响应头 `X-Queue-Time` 为该请求的排队时间(秒)
+固定 `seed`(非 -1) 的请求结果会被缓存, 命中时响应头 `X-Cache: HIT`, 切换模型权重后缓存失效
 失败: 返回包含错误信息的 json, http code 400
+排队已满: http code 429
+排队超时: http code 503
+
+### 推理队列状态
+
+endpoint: `/queue_status`
+
+GET:
+```
+http://127.0.0.1:9880/queue_status
+```
+RESP: 当前运行/排队中的请求数, 拒绝/超时计数, 排队时间及流式首包延迟(first_package_delay)统计
 
 ### 命令控制
 
@@ -103,8 +123,14 @@ RESP:
 
 import os
 import sys
+import time
+import hashlib
+import json
+import mmap
+import struct
+from collections import OrderedDict
 import traceback
-from typing import Generator, Union
+from typing import Callable, Generator, Union
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -114,6 +140,8 @@ import argparse
 import subprocess
 import wave
 import signal
+import asyncio
+import concurrent.futures
 import numpy as np
 import soundfile as sf
 from fastapi import FastAPI, Response
@@ -134,6 +162,11 @@ parser = argparse.ArgumentParser(description="GPT-SoVITS api")
 parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml", help="tts_infer路径")
 parser.add_argument("-a", "--bind_addr", type=str, default="127.0.0.1", help="default: 127.0.0.1")
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument("-w", "--workers", type=int, default=1, help="并发推理线程数, 大于1时开启连续批处理, default: 1")
+parser.add_argument("-q", "--max_queue_size", type=int, default=8, help="推理排队的最大请求数, default: 8")
+parser.add_argument("-t", "--queue_timeout", type=float, default=60, help="请求最长排队时间(秒), default: 60")
+parser.add_argument("--cache_max_mb", type=int, default=256, help="合成结果内存缓存上限(MB), 0为关闭, default: 256")
+parser.add_argument("--cache_dir", type=str, default=None, help="合成结果磁盘缓存目录, default: None")
 args = parser.parse_args()
 config_path = args.tts_config
 # device = args.device
@@ -147,6 +180,395 @@ if config_path in [None, ""]:
 tts_config = TTS_Config(config_path)
 print(tts_config)
 tts_pipeline = TTS(tts_config)
+if args.workers > 1 and tts_pipeline.t2s_scheduler is None:
+    # 多个推理线程的T2S解码汇入同一个批次
+    tts_pipeline.enable_continuous_batching(True)
+
+
+class QueueTimeoutError(Exception):
+    pass
+
+
+class InferenceJob:
+    """
+    一次推理请求。推理线程逐项产出结果, 事件循环侧通过有界的 asyncio.Queue 读取,
+    客户端读取变慢时推理线程会等待, 而不会阻塞事件循环。
+    """
+
+    _END = object()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_buffered: int = 4):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+        self.enqueue_time = time.perf_counter()
+        self.queue_time: float = None
+        self.cancelled = False
+        self.started = asyncio.Event()
+
+    def start(self):
+        # 在推理线程中调用, 通知事件循环侧任务已离开排队
+        self.loop.call_soon_threadsafe(self.started.set)
+
+    def put(self, item) -> bool:
+        # 在推理线程中调用
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self.cancelled:
+                    future.cancel()
+                    return False
+
+    def finish(self):
+        self.put(self._END)
+
+    async def get(self):
+        """返回下一项结果, 全部结束时返回 None"""
+        item = await self.queue.get()
+        if item is self._END:
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class InferenceWorkerPool:
+    """
+    在独立线程中执行推理, 并用有上限的准入队列控制并发。
+    多个推理任务可以同时运行(连续批处理时); 切换权重/参考音频通过 run() 独占执行:
+    等待运行中的任务全部结束, 期间不开始新的任务。
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue_size: int = 8, queue_timeout: float = 60):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts_worker")
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+        # 读写门: active 为正在推理的任务数; 有独占任务等待或执行时不开始新的推理
+        self.gate = threading.Condition()
+        self.active = 0
+        self.exclusive_waiting = 0
+        self.exclusive_running = False
+
+    def submit(self, gen_factory: Callable[[], Generator]) -> Union[InferenceJob, None]:
+        """提交一个生成器任务, 队列已满时返回 None"""
+        with self.lock:
+            if self.running + self.waiting >= self.max_workers + self.max_queue_size:
+                self.rejected += 1
+                return None
+            self.waiting += 1
+        job = InferenceJob(asyncio.get_running_loop())
+        self.executor.submit(self._run_job, job, gen_factory)
+        return job
+
+    async def run(self, fn: Callable, *args):
+        """在推理线程中独占执行一个普通函数 (如切换权重): 等待运行中的推理结束, 执行期间不开始新的推理"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run_exclusive, fn, *args)
+
+    def _run_exclusive(self, fn: Callable, *args):
+        with self.gate:
+            self.exclusive_waiting += 1
+            try:
+                while self.active > 0 or self.exclusive_running:
+                    self.gate.wait()
+            finally:
+                self.exclusive_waiting -= 1
+            self.exclusive_running = True
+        try:
+            return fn(*args)
+        finally:
+            with self.gate:
+                self.exclusive_running = False
+                self.gate.notify_all()
+
+    def _enter_inference(self):
+        with self.gate:
+            while self.exclusive_running or self.exclusive_waiting > 0:
+                self.gate.wait()
+            self.active += 1
+
+    def _exit_inference(self):
+        with self.gate:
+            self.active -= 1
+            self.gate.notify_all()
+
+    async def wait_started(self, job: InferenceJob) -> bool:
+        """等待任务被推理线程取出; 超过 queue_timeout 仍在排队时取消任务并返回 False"""
+        if self.queue_timeout <= 0:
+            return True
+        try:
+            await asyncio.wait_for(job.started.wait(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            job.cancel()
+            with self.lock:
+                self.timeouts += 1
+            return False
+
+    def _run_job(self, job: InferenceJob, gen_factory: Callable[[], Generator]):
+        # 等待进行中的权重/参考音频切换完成, 等待时间计入排队时间
+        self._enter_inference()
+        try:
+            self._run_job_inner(job, gen_factory)
+        finally:
+            self._exit_inference()
+
+    def _run_job_inner(self, job: InferenceJob, gen_factory: Callable[[], Generator]):
+        job.start()
+        job.queue_time = time.perf_counter() - job.enqueue_time
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+            self.total_queue_time += job.queue_time
+            self.max_queue_time = max(self.max_queue_time, job.queue_time)
+        try:
+            if job.cancelled:
+                return
+            if self.queue_timeout > 0 and job.queue_time > self.queue_timeout:
+                with self.lock:
+                    self.timeouts += 1
+                job.put(QueueTimeoutError(f"request waited {job.queue_time:.1f}s in queue"))
+                return
+            generator = gen_factory()
+            try:
+                for item in generator:
+                    if not job.put(item):
+                        break
+            finally:
+                generator.close()
+            job.finish()
+        except Exception as e:
+            job.put(e)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "running": self.running,
+                "waiting": self.waiting,
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "queue_timeout": self.queue_timeout,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_queue_time": self.total_queue_time / self.completed if self.completed else 0.0,
+                "max_queue_time": self.max_queue_time,
+            }
+
+
+# 未开启连续批处理时 TTS 管线同一时刻只允许一个推理线程使用
+inference_pool = InferenceWorkerPool(
+    max_workers=args.workers if tts_pipeline.t2s_scheduler is not None else 1,
+    max_queue_size=args.max_queue_size,
+    queue_timeout=args.queue_timeout,
+)
+
+
+class AudioResultCache:
+    """
+    固定 seed 请求的合成结果缓存, 保存编码后的音频字节。
+    内存层按字节数做 LRU 淘汰; 设置 cache_dir 时同时写入磁盘, 磁盘命中通过 mmap 读取。
+    计算缓存键(参考音频哈希)与磁盘读写都是阻塞操作, 通过 run_io/put_background 在独立的小线程池中执行,
+    不占用事件循环, 也不占用推理线程。
+    """
+
+    # 参与缓存键的请求参数, 任何一项不同都会得到不同的音频
+    key_fields = (
+        "text", "text_lang", "prompt_text", "prompt_lang", "top_k", "top_p", "temperature",
+        "text_split_method", "batch_size", "batch_threshold", "split_bucket", "speed_factor",
+        "fragment_interval", "seed", "parallel_infer", "repetition_penalty", "sample_steps",
+        "super_sampling", "streaming_mode", "return_fragment", "fixed_length_chunk",
+        "overlap_length", "min_chunk_length", "adaptive_chunk", "first_chunk_length", "media_type",
+    )
+
+    def __init__(self, max_bytes: int, cache_dir: str = None, max_disk_bytes: int = 4 * 1024**3, io_workers: int = 2):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="audio_cache_io")
+        self.entries: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # path -> (size, mtime_ns, sha1), 参考音频未改动时不重复计算哈希
+        self.file_hashes: dict = {}
+        # 磁盘层: key -> 文件大小, 按最近使用排序; 只在启动时扫描一次目录
+        self.disk_entries: OrderedDict = OrderedDict()
+        self.disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            files = []
+            for name in os.listdir(cache_dir):
+                if name.endswith(".bin"):
+                    stat = os.stat(os.path.join(cache_dir, name))
+                    files.append((stat.st_mtime, name[: -len(".bin")], stat.st_size))
+            for _, key, size in sorted(files):
+                self.disk_entries[key] = size
+                self.disk_bytes += size
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.cache_dir is not None
+
+    async def run_io(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, fn, *args)
+
+    def put_background(self, key: str, parts: list):
+        """在 IO 线程中拼接并写入缓存, 不等待完成"""
+        self.io_executor.submit(lambda: self.put(key, b"".join(parts)))
+
+    def _file_id(self, path: str) -> str:
+        if path in [None, ""]:
+            return ""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+        with self.lock:
+            cached = self.file_hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        with self.lock:
+            self.file_hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def make_key(self, req: dict) -> Union[str, None]:
+        """seed 未固定时结果不可复现, 返回 None 表示不缓存"""
+        if req.get("seed", -1) in [-1, None, ""]:
+            return None
+        payload = {field: req.get(field) for field in self.key_fields}
+        payload["ref_audio"] = self._file_id(req.get("ref_audio_path"))
+        payload["aux_ref_audio"] = [self._file_id(path) for path in (req.get("aux_ref_audio_paths") or [])]
+        payload["weights"] = [
+            tts_config.t2s_weights_path,
+            os.path.getmtime(tts_config.t2s_weights_path) if os.path.exists(tts_config.t2s_weights_path) else 0,
+            tts_config.vits_weights_path,
+            os.path.getmtime(tts_config.vits_weights_path) if os.path.exists(tts_config.vits_weights_path) else 0,
+        ]
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key: str) -> Union[bytes, mmap.mmap, None]:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            on_disk = key in self.disk_entries
+        if on_disk:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # 更新 mtime, 重启后扫描目录时保持最近使用顺序
+                os.utime(self._disk_path(key))
+                with self.lock:
+                    if key in self.disk_entries:
+                        self.disk_entries.move_to_end(key)
+                    self.disk_hits += 1
+                return data
+            except (OSError, ValueError):
+                with self.lock:
+                    size = self.disk_entries.pop(key, None)
+                    if size is not None:
+                        self.disk_bytes -= size
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes):
+        if len(data) <= self.max_bytes:
+            with self.lock:
+                if key in self.entries:
+                    self.total_bytes -= len(self.entries.pop(key))
+                self.entries[key] = data
+                self.total_bytes += len(data)
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_bytes -= len(evicted)
+        if self.cache_dir is not None:
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                print(f"Warning: failed to write audio cache {key}: {e}")
+                return
+            with self.lock:
+                self.disk_bytes -= self.disk_entries.pop(key, 0)
+                self.disk_entries[key] = len(data)
+                self.disk_bytes += len(data)
+            self._trim_disk()
+
+    def _trim_disk(self):
+        evicted = []
+        with self.lock:
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk_entries) > 1:
+                key, size = self.disk_entries.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            keys = list(self.disk_entries)
+            self.disk_entries.clear()
+            self.disk_bytes = 0
+        if self.cache_dir is not None:
+            for key in keys:
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self.disk_entries),
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+audio_cache = AudioResultCache(args.cache_max_mb * 1024 * 1024, args.cache_dir)
 
 APP = FastAPI()
 
@@ -176,51 +598,188 @@ class TTS_Request(BaseModel):
     super_sampling: bool = False
     overlap_length: int = 2
     min_chunk_length: int = 16
+    adaptive_chunk: bool = False
+    first_chunk_length: int = 4
 
 
-def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    # Author: AkagawaTsurunaki
-    # Issue:
-    #   Stack overflow probabilistically occurs
-    #   when the function `sf_writef_short` of `libsndfile_64bit.dll` is called
-    #   using the Python library `soundfile`
-    # Note:
-    #   This is an issue related to `libsndfile`, not this project itself.
-    #   It happens when you generate a large audio tensor (about 499804 frames in my PC)
-    #   and try to convert it to an ogg file.
-    # Related:
-    #   https://github.com/RVC-Boss/GPT-SoVITS/issues/1199
-    #   https://github.com/libsndfile/libsndfile/issues/1023
-    #   https://github.com/bastibe/python-soundfile/issues/396
-    # Suggestion:
-    #   Or split the whole audio data into smaller audio segment to avoid stack overflow?
-
-    def handle_pack_ogg():
-        with sf.SoundFile(io_buffer, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-            audio_file.write(data)
-
-
-
-    # See: https://docs.python.org/3/library/threading.html
-    # The stack size of this thread is at least 32768
-    # If stack overflow error still occurs, just modify the `stack_size`.
-    # stack_size = n * 4096, where n should be a positive integer.
-    # Here we chose n = 4096.
-    stack_size = 4096 * 4096
-    try:
-        threading.stack_size(stack_size)
-        pack_ogg_thread = threading.Thread(target=handle_pack_ogg)
-        pack_ogg_thread.start()
-        pack_ogg_thread.join()
-    except RuntimeError as e:
-        # If changing the thread stack size is unsupported, a RuntimeError is raised.
-        print("RuntimeError: {}".format(e))
-        print("Changing the thread stack size is unsupported.")
-    except ValueError as e:
-        # If the specified stack size is invalid, a ValueError is raised and the stack size is unmodified.
-        print("ValueError: {}".format(e))
-        print("The specified stack size is invalid.")
+class _ByteSink:
+    """只追加写入的文件对象: libsndfile 顺序写出的 ogg 页暂存于此, 可随时取走"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        target = offset if whence == os.SEEK_SET else self.position + offset
+        if target != self.position:
+            raise OSError("seek is not supported on a streaming sink")
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class StreamingAudioEncoder:
+    """
+    单个响应的编码器: 整个响应共用一个编码会话, 容器头只写一次, 编码器状态在分块之间保持。
+    write() 返回可以立即发送的字节(可能为空), close() 冲刷编码器并返回剩余字节,
+    abort() 用于响应被取消时释放资源。
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+
+    def write(self, data: np.ndarray) -> bytes:
+        return pcm_view(data)
+
+    def close(self) -> bytes:
+        return b""
 
+    def abort(self):
+        pass
+
+
+class WavStreamingEncoder(StreamingAudioEncoder):
+    def __init__(self, rate: int):
+        super().__init__(rate)
+        self.header_sent = False
+
+    def write(self, data: np.ndarray) -> bytes:
+        if not self.header_sent:
+            # 流式 wav 只在开头写一次头, 数据长度未知
+            self.header_sent = True
+            return wave_header_chunk(sample_rate=self.rate) + data.tobytes()
+        return pcm_view(data)
+
+
+class OggStreamingEncoder(StreamingAudioEncoder):
+    # libsndfile 一次写入大量数据时可能栈溢出(https://github.com/RVC-Boss/GPT-SoVITS/issues/1199),
+    # 因此按块写入, 不再为每次编码单独创建大栈线程
+    block_frames = 32768
+
+    def __init__(self, rate: int):
+        super().__init__(rate)
+        self.sink = _ByteSink()
+        self.file = sf.SoundFile(self.sink, mode="w", samplerate=rate, channels=1, format="ogg")
+
+    def write(self, data: np.ndarray) -> bytes:
+        for start in range(0, data.shape[0], self.block_frames):
+            self.file.write(data[start : start + self.block_frames])
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.file.close()
+        return self.sink.take()
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class FFmpegStreamingEncoder(StreamingAudioEncoder):
+    """整个响应只启动一个 ffmpeg 进程, 通过管道持续输入 PCM, 由一个读线程收集编码结果"""
+
+    def __init__(self, rate: int, codec_args: list, output_format: str):
+        super().__init__(rate)
+        self.process = subprocess.Popen(
+            ffmpeg_command(rate, codec_args, output_format),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(65536)
+            if not data:
+                break
+            with self.lock:
+                self.chunks.append(data)
+
+    def _take(self) -> bytes:
+        with self.lock:
+            data = b"".join(self.chunks)
+            self.chunks.clear()
+        return data
+
+    def write(self, data: np.ndarray) -> bytes:
+        self.process.stdin.write(pcm_view(data))
+        self.process.stdin.flush()
+        return self._take()
+
+    def close(self) -> bytes:
+        self.process.stdin.close()
+        self.reader.join()
+        self.process.wait()
+        return self._take()
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+ffmpeg_codecs = {
+    "aac": (["-c:a", "aac", "-b:a", "192k"], "adts"),  # 输出AAC数据流格式
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "192k"], "mp3"),
+}
+
+
+def ffmpeg_command(rate: int, codec_args: list, output_format: str) -> list:
+    return [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-f",
+        "s16le",  # 输入16位有符号小端整数PCM
+        "-ar",
+        str(rate),  # 设置采样率
+        "-ac",
+        "1",  # 单声道
+        "-i",
+        "pipe:0",  # 从管道读取输入
+        *codec_args,
+        "-vn",  # 不包含视频
+        "-f",
+        output_format,
+        "pipe:1",  # 将输出写入管道
+    ]
+
+
+def make_streaming_encoder(media_type: str, rate: int) -> StreamingAudioEncoder:
+    if media_type == "ogg":
+        return OggStreamingEncoder(rate)
+    elif media_type in ffmpeg_codecs:
+        return FFmpegStreamingEncoder(rate, *ffmpeg_codecs[media_type])
+    elif media_type == "wav":
+        return WavStreamingEncoder(rate)
+    return StreamingAudioEncoder(rate)
+
+
+def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
+    encoder = OggStreamingEncoder(rate)
+    io_buffer.write(encoder.write(data))
+    io_buffer.write(encoder.close())
     return io_buffer
 
 
@@ -235,41 +794,61 @@ def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int):
     return io_buffer
 
 
-def pack_aac(io_buffer: BytesIO, data: np.ndarray, rate: int):
+def pack_ffmpeg(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
     process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            "s16le",  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            "192k",  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
+        ffmpeg_command(rate, *ffmpeg_codecs[media_type]),
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
     )
-    out, _ = process.communicate(input=data.tobytes())
+    out, _ = process.communicate(input=pcm_view(data))
     io_buffer.write(out)
     return io_buffer
 
 
+def pcm_view(data: np.ndarray) -> memoryview:
+    """int16 PCM 的字节视图, 不复制数据"""
+    return memoryview(np.ascontiguousarray(data)).cast("B")
+
+
+def wav_header(num_frames: int, rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    """已知长度的 44 字节 PCM wav 头"""
+    data_size = num_frames * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        rate,
+        rate * channels * sample_width,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        data_size,
+    )
+
+
+def pack_audio_parts(data: np.ndarray, rate: int, media_type: str) -> list:
+    """
+    非流式响应的输出分段。wav/raw 直接输出 wav 头 + PCM 的 memoryview,
+    不经过 sf.write/BytesIO, 整段音频不再复制; 其它格式仍需编码。
+    """
+    if media_type == "wav":
+        return [wav_header(data.shape[0], rate), pcm_view(data)]
+    elif media_type == "raw":
+        return [pcm_view(data)]
+    return [pack_audio(BytesIO(), data, rate, media_type).getbuffer()]
+
+
 def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
     if media_type == "ogg":
         io_buffer = pack_ogg(io_buffer, data, rate)
-    elif media_type == "aac":
-        io_buffer = pack_aac(io_buffer, data, rate)
+    elif media_type in ffmpeg_codecs:
+        io_buffer = pack_ffmpeg(io_buffer, data, rate, media_type)
     elif media_type == "wav":
         io_buffer = pack_wav(io_buffer, data, rate)
     else:
@@ -329,7 +908,7 @@ def check_params(req: dict):
             status_code=400,
             content={"message": f"prompt_lang: {prompt_lang} is not supported in version {tts_config.version}"},
         )
-    if media_type not in ["wav", "raw", "ogg", "aac"]:
+    if media_type not in ["wav", "raw", "ogg", "aac", "mp3"]:
         return JSONResponse(status_code=400, content={"message": f"media_type: {media_type} is not supported"})
     # elif media_type == "ogg" and not streaming_mode:
     #     return JSONResponse(status_code=400, content={"message": "ogg format is not supported in non-streaming mode"})
@@ -372,6 +951,8 @@ async def tts_handle(req: dict):
                 "streaming_mode": False,      # bool or int. return audio chunk by chunk.T he available options are: 0,1,2,3 or True/False (0/False: Disabled | 1/True: Best Quality, Slowest response speed (old version streaming_mode) | 2: Medium Quality, Slow response speed | 3: Lower Quality, Faster response speed )
                 "overlap_length": 2,          # int. overlap length of semantic tokens for streaming mode.
                 "min_chunk_length": 16,       # int. The minimum chunk length of semantic tokens for streaming mode. (affects audio chunk size)
+                "adaptive_chunk": False,      # bool. streaming mode only. start with a small first chunk for low first-packet latency, then grow the chunk size.
+                "first_chunk_length": 4,      # int. the semantic token length of the first chunk when adaptive_chunk is enabled.
             }
     returns:
         StreamingResponse: audio stream response.
@@ -413,37 +994,111 @@ async def tts_handle(req: dict):
 
     streaming_mode = streaming_mode or return_fragment
 
-
-    try:
+    cache_key = await audio_cache.run_io(audio_cache.make_key, req) if audio_cache.enabled else None
+    if cache_key is not None:
+        cached = await audio_cache.run_io(audio_cache.get, cache_key)
+        if cached is not None:
+            headers = {"X-Cache": "HIT", "X-Queue-Time": "0.000"}
+            if isinstance(cached, mmap.mmap):
+
+                def mmap_generator(data: mmap.mmap, chunk_size: int = 65536):
+                    try:
+                        for start in range(0, len(data), chunk_size):
+                            yield data[start : start + chunk_size]
+                    finally:
+                        data.close()
+
+                return StreamingResponse(mmap_generator(cached), media_type=f"audio/{media_type}", headers=headers)
+            return Response(cached, media_type=f"audio/{media_type}", headers=headers)
+
+    def tts_bytes_generator():
+        # 在推理线程中执行, 音频编码也不占用事件循环
         tts_generator = tts_pipeline.run(req)
-
         if streaming_mode:
-
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if_frist_chunk = True
+            # 整个响应共用一个编码器, 输出为一条连续的流, 而不是每块一个独立的容器
+            encoder = None
+            try:
                 for sr, chunk in tts_generator:
-                    if if_frist_chunk and media_type == "wav":
-                        yield wave_header_chunk(sample_rate=sr)
-                        media_type = "raw"
-                        if_frist_chunk = False
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
-
-            # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
-            return StreamingResponse(
-                streaming_generator(
-                    tts_generator,
-                    media_type,
-                ),
-                media_type=f"audio/{media_type}",
-            )
-
+                    if encoder is None:
+                        encoder = make_streaming_encoder(media_type, sr)
+                    data = encoder.write(chunk)
+                    if data:
+                        yield data
+                if encoder is not None:
+                    data = encoder.close()
+                    encoder = None
+                    if data:
+                        yield data
+            finally:
+                if encoder is not None:
+                    encoder.abort()
         else:
             sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            return Response(audio_data, media_type=f"audio/{media_type}")
+            yield pack_audio_parts(audio_data, sr, media_type)
+
+    job = inference_pool.submit(tts_bytes_generator)
+    if job is None:
+        return JSONResponse(status_code=429, content={"message": "too many requests, inference queue is full"})
+
+    # 只对排队阶段计时: 到期仍未开始推理的请求立即返回 503, 而不是等到轮到它时才失败
+    if not await inference_pool.wait_started(job):
+        return JSONResponse(
+            status_code=503,
+            content={"message": "inference queue timeout", "Exception": f"request waited {inference_pool.queue_timeout:.1f}s in queue"},
+        )
+
+    try:
+        first_chunk = await job.get()
+    except QueueTimeoutError as e:
+        return JSONResponse(status_code=503, content={"message": "inference queue timeout", "Exception": str(e)})
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
 
+    headers = {"X-Queue-Time": f"{job.queue_time:.3f}"}
+    if cache_key is not None:
+        headers["X-Cache"] = "MISS"
+    if streaming_mode:
+
+        async def streaming_generator(chunk: bytes):
+            chunks = []
+            try:
+                while chunk is not None:
+                    yield chunk
+                    if cache_key is not None:
+                        chunks.append(chunk)
+                    chunk = await job.get()
+                if cache_key is not None:
+                    audio_cache.put_background(cache_key, chunks)
+            finally:
+                job.cancel()
+
+        # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
+        return StreamingResponse(
+            streaming_generator(first_chunk),
+            media_type=f"audio/{media_type}",
+            headers=headers,
+        )
+
+    else:
+        job.cancel()
+        # 非流式时 first_chunk 为输出分段列表, 以 memoryview 直接发送
+        if cache_key is not None:
+            audio_cache.put_background(cache_key, first_chunk)
+        headers["Content-Length"] = str(sum(len(part) for part in first_chunk))
+        return StreamingResponse(iter(first_chunk), media_type=f"audio/{media_type}", headers=headers)
+
+
+@APP.get("/queue_status")
+async def queue_status():
+    return JSONResponse(
+        status_code=200,
+        content={
+            **inference_pool.status(),
+            "audio_cache": audio_cache.status(),
+            "first_package_delay": tts_pipeline.first_package_delay.summary(),
+        },
+    )
+
 
 @APP.get("/control")
 async def control(command: str = None):
@@ -478,6 +1133,8 @@ async def tts_get_endpoint(
     streaming_mode: Union[bool, int] = False,
     overlap_length: int = 2,
     min_chunk_length: int = 16,
+    adaptive_chunk: bool = False,
+    first_chunk_length: int = 4,
 ):
     req = {
         "text": text,
@@ -504,6 +1161,8 @@ async def tts_get_endpoint(
         "super_sampling": super_sampling,
         "overlap_length": int(overlap_length),
         "min_chunk_length": int(min_chunk_length),
+        "adaptive_chunk": adaptive_chunk,
+        "first_chunk_length": int(first_chunk_length),
     }
     return await tts_handle(req)
 
@@ -517,7 +1176,7 @@ async def tts_post_endpoint(request: TTS_Request):
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
     try:
-        tts_pipeline.set_ref_audio(refer_audio_path)
+        await inference_pool.run(tts_pipeline.set_ref_audio, refer_audio_path)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -547,7 +1206,8 @@ async def set_gpt_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
-        tts_pipeline.init_t2s_weights(weights_path)
+        await inference_pool.run(tts_pipeline.init_t2s_weights, weights_path)
+        await audio_cache.run_io(audio_cache.clear)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -559,7 +1219,8 @@ async def set_sovits_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
-        tts_pipeline.init_vits_weights(weights_path)
+        await inference_pool.run(tts_pipeline.init_vits_weights, weights_path)
+        await audio_cache.run_io(audio_cache.clear)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -1,19 +1,25 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
 import shutil
+import asyncio
+import struct
 import uuid
 from datetime import datetime
 from pathlib import Path
 import logging
-import subprocess
-import json
 import time
 from typing import List, Dict
 import sys
 import queue
+import threading
+import wave
+from collections import deque
+from io import BytesIO
+
+from script1 import GPTSoVITSClientV2
 
 # 配置日志
 logging.basicConfig(
@@ -92,12 +98,34 @@ app.add_middleware(
 )
 
 # 配置存储路径
-BASE_DIR = Path(__file__).parent
+BASE_DIR = Path(__file__).resolve().parent
 STORAGE_DIR = BASE_DIR / "voice_and_output"
 STORAGE_DIR.mkdir(exist_ok=True)
 
-# 脚本路径 - 确保 script1.py 在同一目录下
-SCRIPT_PATH = BASE_DIR / "script1.py"
+# 合成引擎配置
+# SYNTHESIS_BACKEND: "http" 通过连接池调用 api_v2.py；"local" 在本进程内加载 TTS 模型
+SYNTHESIS_BACKEND = os.environ.get("SYNTHESIS_BACKEND", "http")
+GPT_SOVITS_API_URL = os.environ.get("GPT_SOVITS_API_URL", "http://127.0.0.1:9880")
+# 所有路径在启动时解析为绝对路径，服务进程不切换工作目录
+GPT_SOVITS_DIR = Path(os.environ.get("GPT_SOVITS_DIR", BASE_DIR / "GPT-SoVITS-main")).resolve()
+# 相对路径按 GPT-SoVITS 根目录解析
+TTS_CONFIG_PATH = str(GPT_SOVITS_DIR / os.environ.get("TTS_CONFIG_PATH", "GPT_SoVITS/configs/tts_infer.yaml"))
+
+# 句子调度配置：工作线程数、每个任务可提前生成的句子数
+SENTENCE_WORKERS = int(os.environ.get("SENTENCE_WORKERS", 2))
+SENTENCE_LOOKAHEAD = int(os.environ.get("SENTENCE_LOOKAHEAD", 3))
+
+# 流式任务调用 api_v2.py 时使用的 streaming_mode (1/2/3)
+STREAMING_MODE = int(os.environ.get("STREAMING_MODE", 2))
+
+# 合成参数，与原先调用 script1.py 时的命令行参数一致
+SYNTHESIS_PARAMS = {
+    "top_k": 5,
+    "top_p": 1.0,
+    "temperature": 1.0,
+    "speed_factor": 1.0,
+    "text_split_method": "cut5",
+}
 
 # 设置日志文件
 log_file_path = setup_file_logger()
@@ -109,45 +137,132 @@ class TextRequest(BaseModel):
     ref_audio_path: str
     language: str = "zh"
     sequential: bool = True  # 顺序生成
+    stream: bool = False  # 通过 /ws/task/{task_id} 边合成边推送音频块
 
 
 # 句子管理类
 class SentenceManager:
     def __init__(self):
         self.tasks = {}  # task_id -> task_info
-        import concurrent.futures
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # 单线程确保顺序
+        # 多个调度线程会同时更新任务状态
+        self.lock = threading.RLock()
 
-    def create_task(self, task_id: str, sentences: List[str], ref_audio_path: str):
+    def create_task(self, task_id: str, sentences: List[str], ref_audio_path: str, stream: bool = False):
         """创建新任务"""
-        self.tasks[task_id] = {
-            'task_id': task_id,
-            'sentences': sentences,
-            'ref_audio_path': ref_audio_path,
-            'total_sentences': len(sentences),
-            'completed_count': 0,
-            'current_index': 0,
-            'status': 'processing',
-            'start_time': time.time(),
-            'sentence_status': ['waiting'] * len(sentences),
-            'audio_data': [None] * len(sentences),
-            'audio_paths': [None] * len(sentences),
-            'callback_queue': queue.Queue()
-        }
-        return self.tasks[task_id]
+        with self.lock:
+            self.tasks[task_id] = {
+                'task_id': task_id,
+                'sentences': sentences,
+                'ref_audio_path': ref_audio_path,
+                'total_sentences': len(sentences),
+                'completed_count': 0,
+                'finished_count': 0,  # 已结束（成功或失败）的句子数
+                'current_index': 0,
+                'next_dispatch_index': 0,  # 下一个待调度的句子
+                'ready_index': 0,  # 重排缓冲区：[0, ready_index) 的句子已按顺序就绪
+                'delivered_index': 0,  # 客户端已取走的句子数，用于背压
+                'last_delivery_time': time.time(),
+                'status': 'processing',
+                'start_time': time.time(),
+                'sentence_status': ['waiting'] * len(sentences),
+                'audio_data': [None] * len(sentences),
+                'audio_paths': [None] * len(sentences),
+                'stream': stream,
+                'sample_rate': None,
+                'audio_chunks': [[] for _ in sentences],  # 每个句子已生成的PCM块
+                'listeners': [],  # 等待新音频块的流式连接 (loop, asyncio.Event)
+                'callback_queue': queue.Queue()
+            }
+            return self.tasks[task_id]
 
     def update_sentence_status(self, task_id: str, sentence_index: int, status: str, audio_data=None, audio_path=None):
         """更新句子状态"""
-        if task_id not in self.tasks:
-            return
-
-        task = self.tasks[task_id]
-        task['sentence_status'][sentence_index] = status
-
-        if status == 'completed':
-            task['audio_data'][sentence_index] = audio_data
-            task['audio_paths'][sentence_index] = audio_path
-            task['completed_count'] += 1
+        with self.lock:
+            if task_id not in self.tasks:
+                return
+
+            task = self.tasks[task_id]
+            task['sentence_status'][sentence_index] = status
+
+            if status == 'completed':
+                task['audio_data'][sentence_index] = audio_data
+                task['audio_paths'][sentence_index] = audio_path
+                task['completed_count'] += 1
+
+            if status in ('completed', 'error'):
+                task['finished_count'] += 1
+                # 乱序完成的句子留在缓冲区，直到前面的句子全部就绪
+                while (task['ready_index'] < task['total_sentences']
+                       and task['sentence_status'][task['ready_index']] in ('completed', 'error')):
+                    task['ready_index'] += 1
+                task['current_index'] = task['ready_index']
+
+            self._notify_listeners(task)
+
+    def append_chunk(self, task_id: str, sentence_index: int, sample_rate: int, pcm: bytes):
+        """追加句子的一个PCM音频块并唤醒流式连接"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return
+            task['sample_rate'] = sample_rate
+            task['audio_chunks'][sentence_index].append(pcm)
+            self._notify_listeners(task)
+
+    def add_listener(self, task_id: str, loop, event):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task:
+                task['listeners'].append((loop, event))
+
+    def remove_listener(self, task_id: str, loop, event):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task and (loop, event) in task['listeners']:
+                task['listeners'].remove((loop, event))
+
+    def _notify_listeners(self, task: dict):
+        for loop, event in task['listeners']:
+            loop.call_soon_threadsafe(event.set)
+
+    def mark_delivered(self, task_id: str, sentence_index: int):
+        """记录客户端已取走某个句子，推进背压窗口"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return
+            task['delivered_index'] = max(task['delivered_index'], sentence_index + 1)
+            task['last_delivery_time'] = time.time()
+
+    def release_chunks(self, task_id: str, sentence_index: int):
+        """
+        流式连接推送完一个已结束的句子后释放其PCM块（置为 None）。
+        完整音频仍保存在 audio_data 中，之后连接的客户端从中读取。
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task and task['sentence_status'][sentence_index] in ('completed', 'error'):
+                task['audio_chunks'][sentence_index] = None
+
+    def read_chunks(self, task_id: str, sentence_index: int, chunk_index: int, sent_bytes: int):
+        """
+        返回 (待发送的PCM块列表, 句子状态, 采样率)。
+        块已被释放时，从 audio_data 中取出该句完整PCM，跳过本连接已发送的 sent_bytes 字节后作为一个块返回。
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return [], 'error', None
+            status = task['sentence_status'][sentence_index]
+            chunks = task['audio_chunks'][sentence_index]
+            audio_data = task['audio_data'][sentence_index]
+            sample_rate = task['sample_rate']
+            if chunks is not None:
+                return chunks[chunk_index:], status, sample_rate
+        if not audio_data:
+            return [], status, sample_rate
+        sample_rate, pcm = wav_to_pcm(audio_data)
+        return ([pcm[sent_bytes:]] if len(pcm) > sent_bytes else []), status, sample_rate
 
     def get_task(self, task_id: str):
         """获取任务信息"""
@@ -155,8 +270,10 @@ class SentenceManager:
 
     def mark_task_completed(self, task_id: str):
         """标记任务完成"""
-        if task_id in self.tasks:
-            self.tasks[task_id]['status'] = 'completed'
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks[task_id]['status'] = 'completed'
+                self._notify_listeners(self.tasks[task_id])
 
     def get_task_status(self, task_id: str):
         """获取任务状态"""
@@ -164,30 +281,36 @@ class SentenceManager:
         if not task:
             return None
 
-        return {
-            'task_id': task_id,
-            'status': task['status'],
-            'total_sentences': task['total_sentences'],
-            'completed_count': task['completed_count'],
-            'current_index': task['current_index'],
-            'elapsed_time': time.time() - task['start_time'],
-            'sentence_statuses': task['sentence_status'],
-            'audio_files': [
-                {
-                    'sentence_index': i,
-                    'filename': Path(path).name if path else None,
-                    'file_path': path,
-                    'status': task['sentence_status'][i]
-                }
-                for i, path in enumerate(task['audio_paths'])
-                if path
-            ]
-        }
+        with self.lock:
+            ready_index = task['ready_index']
+            return {
+                'task_id': task_id,
+                'status': task['status'],
+                'total_sentences': task['total_sentences'],
+                'completed_count': task['completed_count'],
+                'current_index': task['current_index'],
+                'ready_index': ready_index,
+                'delivered_index': task['delivered_index'],
+                'elapsed_time': time.time() - task['start_time'],
+                'sentence_statuses': task['sentence_status'],
+                # 只返回按顺序就绪的音频，保证客户端按句子顺序播放
+                'audio_files': [
+                    {
+                        'sentence_index': i,
+                        'filename': Path(path).name if path else None,
+                        'file_path': path,
+                        'status': task['sentence_status'][i]
+                    }
+                    for i, path in enumerate(task['audio_paths'][:ready_index])
+                    if path
+                ]
+            }
 
     def cleanup(self, task_id: str):
         """清理任务资源"""
-        if task_id in self.tasks:
-            del self.tasks[task_id]
+        with self.lock:
+            if task_id in self.tasks:
+                del self.tasks[task_id]
 
 
 # 全局句子管理器
@@ -319,8 +442,158 @@ def split_text_by_sentences(text: str) -> List[str]:
     return final_sentences
 
 
-def generate_sentence_with_script(sentence: str, ref_audio_path: str, task_id: str, sentence_index: int):
-    """使用script1.py直接生成单个句子的音频"""
+class SynthesisEngine:
+    """语音合成引擎基类，在服务进程内常驻，避免每个句子启动一次子进程"""
+
+    name = "base"
+
+    def start(self):
+        """启动引擎（建立连接/加载模型）"""
+
+    def shutdown(self):
+        """释放引擎资源"""
+
+    def synthesize(self, sentence: str, ref_audio_path: str, text_lang: str = "zh") -> bytes:
+        """合成单个句子，返回WAV字节数据"""
+        raise NotImplementedError
+
+    def synthesize_stream(self, sentence: str, ref_audio_path: str, text_lang: str = "zh"):
+        """流式合成单个句子，逐块产出 (采样率, PCM字节)"""
+        yield wav_to_pcm(self.synthesize(sentence, ref_audio_path, text_lang))
+
+
+class HTTPSynthesisEngine(SynthesisEngine):
+    """通过常驻的keep-alive连接池调用api_v2.py"""
+
+    name = "http"
+
+    def __init__(self, base_url: str, pool_size: int = 4):
+        self.client = GPTSoVITSClientV2(base_url=base_url, output_dir=STORAGE_DIR, pool_size=pool_size)
+        self._connected = False
+
+    def start(self):
+        # 只在启动时检查一次连接，而不是每个句子都检查
+        self._connected = self.client.check_connection()
+        if not self._connected:
+            logger.warning(f"无法连接到GPT-SoVITS API服务: {self.client.base_url}，将在首次合成时重试")
+
+    def shutdown(self):
+        self.client.close()
+
+    def synthesize(self, sentence: str, ref_audio_path: str, text_lang: str = "zh") -> bytes:
+        if not self._connected:
+            self._connected = self.client.check_connection()
+            if not self._connected:
+                raise Exception("无法连接到GPT-SoVITS API服务，请确保api_v2.py正在运行")
+        return self.client.text_to_speech(
+            text=sentence,
+            text_lang=text_lang,
+            ref_audio_path=ref_audio_path,
+            **SYNTHESIS_PARAMS
+        )
+
+    def synthesize_stream(self, sentence: str, ref_audio_path: str, text_lang: str = "zh"):
+        if not self._connected:
+            self._connected = self.client.check_connection()
+            if not self._connected:
+                raise Exception("无法连接到GPT-SoVITS API服务，请确保api_v2.py正在运行")
+        yield from self.client.text_to_speech_stream(
+            text=sentence,
+            text_lang=text_lang,
+            ref_audio_path=ref_audio_path,
+            streaming_mode=STREAMING_MODE,
+            **SYNTHESIS_PARAMS
+        )
+
+
+class LocalSynthesisEngine(SynthesisEngine):
+    """在服务进程内直接加载TTS_infer_pack.TTS进行推理"""
+
+    name = "local"
+
+    def __init__(self, gpt_sovits_dir: Path, config_path: str):
+        self.gpt_sovits_dir = Path(gpt_sovits_dir)
+        self.config_path = config_path
+        self.pipeline = None
+        # TTS管线持有参考音频缓存等状态，不能并发调用
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.pipeline is not None:
+            return
+        # 不切换进程工作目录：配置文件使用绝对路径，配置中的相对模型路径由 TTS_Config 按 GPT-SoVITS 根目录解析
+        for path in (str(self.gpt_sovits_dir), str(self.gpt_sovits_dir / "GPT_SoVITS")):
+            if path not in sys.path:
+                sys.path.append(path)
+        from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+        logger.info(f"加载本地TTS模型，配置文件: {self.config_path}")
+        self.pipeline = TTS(TTS_Config(self.config_path))
+
+    def _build_request(self, sentence: str, ref_audio_path: str, text_lang: str) -> dict:
+        if self.pipeline is None:
+            self.start()
+        return {
+            "text": sentence,
+            "text_lang": text_lang,
+            "ref_audio_path": ref_audio_path,
+            "prompt_text": "",
+            "prompt_lang": text_lang,
+            **SYNTHESIS_PARAMS,
+        }
+
+    def synthesize(self, sentence: str, ref_audio_path: str, text_lang: str = "zh") -> bytes:
+        req = self._build_request(sentence, ref_audio_path, text_lang)
+        with self._lock:
+            sr, audio = next(self.pipeline.run(req))
+        return pcm_to_wav(audio.tobytes(), sr)
+
+    def synthesize_stream(self, sentence: str, ref_audio_path: str, text_lang: str = "zh"):
+        req = self._build_request(sentence, ref_audio_path, text_lang)
+        # 与 api_v2.py 中 streaming_mode 的取值含义一致
+        req.update({
+            "streaming_mode": STREAMING_MODE in (2, 3),
+            "return_fragment": STREAMING_MODE == 1,
+            "fixed_length_chunk": STREAMING_MODE == 3,
+            "parallel_infer": False,
+            "split_bucket": False,
+        })
+        with self._lock:
+            for sr, chunk in self.pipeline.run(req):
+                yield sr, chunk.tobytes()
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """将16位单声道PCM封装为WAV"""
+    wav_buffer = BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return wav_buffer.getvalue()
+
+
+def wav_to_pcm(wav_data: bytes):
+    """从WAV中取出采样率和PCM数据"""
+    with wave.open(BytesIO(wav_data), "rb") as wav_file:
+        return wav_file.getframerate(), wav_file.readframes(wav_file.getnframes())
+
+
+def create_synthesis_engine(backend: str) -> SynthesisEngine:
+    """根据配置创建合成引擎"""
+    if backend == "local":
+        return LocalSynthesisEngine(GPT_SOVITS_DIR, TTS_CONFIG_PATH)
+    if backend == "http":
+        return HTTPSynthesisEngine(GPT_SOVITS_API_URL, pool_size=max(4, SENTENCE_WORKERS))
+    raise ValueError(f"不支持的合成后端: {backend}")
+
+
+synthesis_engine = create_synthesis_engine(SYNTHESIS_BACKEND)
+
+
+def generate_sentence_audio(sentence: str, ref_audio_path: str, task_id: str, sentence_index: int):
+    """使用常驻的合成引擎生成单个句子的音频"""
     try:
         # 记录开始生成句子
         send_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
@@ -330,139 +603,40 @@ def generate_sentence_with_script(sentence: str, ref_audio_path: str, task_id: s
             task_id
         )
 
-        log_with_timestamp(f"句子 {sentence_index} 发送到script1.py时间: {send_time}", "INFO", task_id)
+        log_with_timestamp(f"句子 {sentence_index} 发送到合成引擎({synthesis_engine.name})时间: {send_time}", "INFO", task_id)
         log_with_timestamp(f"句子 {sentence_index} 完整内容: {sentence}", "DEBUG", task_id)
 
-        # 生成唯一的任务ID用于这个句子
-        sub_task_id = f"{task_id}_s{sentence_index}"
-
-        # 构建命令 - 直接调用script1.py
-        cmd = [
-            sys.executable,  # 使用当前的Python解释器
-            str(SCRIPT_PATH),
-            "--text", sentence,
-            "--text-lang", "zh",
-            "--ref-audio", ref_audio_path,
-            "--task-id", sub_task_id,
-            "--top-k", "5",
-            "--top-p", "1.0",
-            "--temperature", "1.0",
-            "--speed", "1.0",
-            "--clean-old"  # 清理旧的output.wav文件
-        ]
-
-        log_with_timestamp(f"执行命令: {' '.join(cmd[:10])}...", "INFO", task_id)
-
-        # 执行命令并计时
-        cmd_start_time = time.time()
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            timeout=180  # 增加到180秒超时
-        )
+        # 执行合成并计时
+        synth_start_time = time.time()
+        task = sentence_manager.get_task(task_id)
+        if task and task['stream']:
+            # 流式任务：每个音频块产生后立即推送给客户端
+            pcm_chunks = []
+            sample_rate = None
+            for sample_rate, pcm in synthesis_engine.synthesize_stream(sentence, ref_audio_path, text_lang="zh"):
+                if not pcm_chunks:
+                    log_with_timestamp(
+                        f"句子 {sentence_index} 首个音频块耗时: {time.time() - synth_start_time:.2f}秒", "INFO", task_id
+                    )
+                pcm_chunks.append(pcm)
+                sentence_manager.append_chunk(task_id, sentence_index, sample_rate, pcm)
+            if sample_rate is None:
+                raise Exception("合成引擎未返回音频数据")
+            audio_data = pcm_to_wav(b"".join(pcm_chunks), sample_rate)
+        else:
+            audio_data = synthesis_engine.synthesize(sentence, ref_audio_path, text_lang="zh")
+            sentence_manager.append_chunk(task_id, sentence_index, *wav_to_pcm(audio_data))
+        synth_time = time.time() - synth_start_time
+        log_with_timestamp(f"合成引擎耗时: {synth_time:.2f}秒", "INFO", task_id)
 
-        # 记录命令执行时间
-        cmd_time = time.time() - cmd_start_time
-        log_with_timestamp(f"script1.py执行耗时: {cmd_time:.2f}秒", "INFO", task_id)
-
-        if result.returncode != 0:
-            error_msg = f"script1.py执行失败: {result.stderr}"
-            log_with_timestamp(f"句子 {sentence_index} 生成失败: {error_msg}", "ERROR", task_id)
-            raise Exception(f"生成失败: {result.stderr}")
-
-        # 解析输出（JSON格式）
-        audio_file = None
-        try:
-            # 获取最后一行JSON输出
-            output_lines = result.stdout.strip().split('\n')
-            json_line = None
-
-            # 从最后一行开始找JSON
-            for line in reversed(output_lines):
-                line = line.strip()
-                if line and (line.startswith('{') and line.endswith('}')):
-                    json_line = line
-                    break
-
-            if json_line:
-                output_json = json.loads(json_line)
-                log_with_timestamp(f"script1.py返回JSON状态: {output_json.get('status')}", "DEBUG", task_id)
-
-                # 检查返回状态
-                if output_json.get("status") == "success":
-                    # 从返回中获取文件路径
-                    unique_output = output_json.get("unique_output")
-                    default_output = output_json.get("default_output")
-                    output_path = output_json.get("output_path")
-
-                    # 优先使用unique_output，如果没有则使用default_output或output_path
-                    if unique_output and Path(unique_output).exists():
-                        audio_file = Path(unique_output)
-                    elif default_output and Path(default_output).exists():
-                        audio_file = Path(default_output)
-                    elif output_path and Path(output_path).exists():
-                        audio_file = Path(output_path)
-                    else:
-                        log_with_timestamp(f"JSON中未找到有效文件路径", "WARNING", task_id)
-                else:
-                    error_msg = output_json.get('message', '未知错误')
-                    raise Exception(f"script1.py返回错误: {error_msg}")
-            else:
-                log_with_timestamp("script1.py未返回有效的JSON输出", "WARNING", task_id)
-
-        except json.JSONDecodeError as e:
-            log_with_timestamp(f"无法解析script1.py输出为JSON: {e}", "WARNING", task_id)
-            log_with_timestamp(f"原始输出最后100字符: {result.stdout[-100:]}", "DEBUG", task_id)
-        except Exception as e:
-            log_with_timestamp(f"解析script1.py输出失败: {e}", "ERROR", task_id)
-
-        # 如果通过JSON没找到文件，尝试查找生成的音频文件
-        if audio_file is None or not audio_file.exists():
-            output_dir = Path("C:\\Users\\24021\\Desktop\\GPT-SoVITS-main")
-
-            # 尝试多个可能的文件名
-            possible_files = [
-                output_dir / f"output_{sub_task_id}.wav",
-                output_dir / "output.wav",
-                STORAGE_DIR / f"output_{sub_task_id}.wav",
-                STORAGE_DIR / "output.wav"
-            ]
-
-            for file_path in possible_files:
-                if file_path.exists():
-                    audio_file = file_path
-                    log_with_timestamp(f"找到音频文件: {audio_file}", "INFO", task_id)
-                    break
-
-        # 检查音频文件是否存在
-        if audio_file is None or not audio_file.exists():
-            error_msg = f"未找到生成的音频文件"
-            log_with_timestamp(error_msg, "ERROR", task_id)
-
-            # 列出目录内容以帮助调试
-            try:
-                output_dir = Path("C:\\Users\\24021\\Desktop\\GPT-SoVITS-main")
-                if output_dir.exists():
-                    files = list(output_dir.glob("*.wav"))
-                    log_with_timestamp(f"GPT-SoVITS目录中的wav文件: {[f.name for f in files[:10]]}", "DEBUG", task_id)
-
-                if STORAGE_DIR.exists():
-                    files = list(STORAGE_DIR.glob("*.wav"))
-                    log_with_timestamp(f"存储目录中的wav文件: {[f.name for f in files[:10]]}", "DEBUG", task_id)
-            except Exception as e:
-                log_with_timestamp(f"无法列出目录内容: {e}", "ERROR", task_id)
-
-            raise Exception(error_msg)
-
-        # 读取音频数据
-        with open(audio_file, 'rb') as f:
-            audio_data = f.read()
+        # 保存音频文件，文件名带上任务ID和句子序号
+        audio_file = STORAGE_DIR / f"output_{task_id}_s{sentence_index}.wav"
+        with open(audio_file, 'wb') as f:
+            f.write(audio_data)
 
         # 记录生成成功
         success_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        total_time = time.time() - cmd_start_time
+        total_time = time.time() - synth_start_time
         log_with_timestamp(
             f"✓ 句子 {sentence_index} 生成成功，文件大小: {len(audio_data)} bytes",
             "INFO",
@@ -483,57 +657,137 @@ def generate_sentence_with_script(sentence: str, ref_audio_path: str, task_id: s
 
         return audio_data, str(audio_file)
 
-    except subprocess.TimeoutExpired:
-        log_with_timestamp(f"句子 {sentence_index} 生成超时（超过180秒）", "ERROR", task_id)
-        sentence_manager.update_sentence_status(task_id, sentence_index, 'error')
-        return None, None
     except Exception as e:
         log_with_timestamp(f"句子 {sentence_index} 生成失败: {e}", "ERROR", task_id)
         sentence_manager.update_sentence_status(task_id, sentence_index, 'error')
         return None, None
 
 
-def process_sentences_sequential(text: str, ref_audio_path: str, task_id: str):
-    """顺序处理所有句子 - 逐个生成"""
-    try:
-        # 切分句子
-        sentences = split_text_by_sentences(text)
-        log_with_timestamp(f"任务 {task_id} 开始处理 {len(sentences)} 个句子", "INFO", task_id)
+class SentenceScheduler:
+    """
+    多工作线程句子调度器
 
-        # 创建任务
-        task_info = sentence_manager.create_task(task_id, sentences, ref_audio_path)
+    - 每个任务最多提前生成 lookahead 个客户端尚未取走的句子（背压）
+    - 多个任务之间轮询调度，长文章不会阻塞后来的短请求
+    - 句子可以乱序完成，由 SentenceManager 的重排缓冲区保证按顺序交付
+    """
 
-        # 顺序生成每个句子
-        for i, sentence in enumerate(sentences):
-            # 更新为处理中状态
-            sentence_manager.update_sentence_status(task_id, i, 'processing')
+    def __init__(self, manager: SentenceManager, num_workers: int = 2, lookahead: int = 3,
+                 idle_timeout: float = 30.0):
+        self.manager = manager
+        self.num_workers = max(1, num_workers)
+        self.lookahead = max(1, lookahead)
+        # 客户端超过该时间未取音频时视为离线，不再限制提前生成
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._task_queue = deque()  # 轮询顺序
+        self._workers = []
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"sentence-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def submit(self, task_id: str):
+        """将任务加入调度"""
+        with self._cond:
+            self._task_queue.append(task_id)
+            self._cond.notify_all()
+
+    def notify(self):
+        """客户端取走音频后唤醒调度线程"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _dispatch_limit(self, task: dict) -> int:
+        if time.time() - task['last_delivery_time'] > self.idle_timeout:
+            return task['total_sentences']
+        return min(task['total_sentences'], task['delivered_index'] + self.lookahead)
+
+    def _next_job(self):
+        """按轮询顺序取出下一个可调度的句子，需持有 self._cond"""
+        for _ in range(len(self._task_queue)):
+            task_id = self._task_queue.popleft()
+            task = self.manager.get_task(task_id)
+            if task is None:
+                continue
+            with self.manager.lock:
+                index = task['next_dispatch_index']
+                if index >= task['total_sentences']:
+                    # 所有句子都已调度，任务移出队列
+                    continue
+                self._task_queue.append(task_id)
+                if index >= self._dispatch_limit(task):
+                    continue
+                task['next_dispatch_index'] = index + 1
+                task['sentence_status'][index] = 'processing'
+                return task_id, index, task['sentences'][index], task['ref_audio_path']
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while self._running:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    # 空闲超时也需要重新检查，因此定期唤醒
+                    self._cond.wait(timeout=1.0)
+                if job is None:
+                    return
+
+            task_id, index, sentence, ref_audio_path = job
+            task = self.manager.get_task(task_id)
+            if task is None:
+                continue
+            progress = (index / task['total_sentences']) * 100
+            log_with_timestamp(f"开始处理句子 {index + 1}/{task['total_sentences']} (进度: {progress:.1f}%)", "INFO", task_id)
 
-            # 记录进度
-            progress = (i / len(sentences)) * 100 if len(sentences) > 0 else 0
-            log_with_timestamp(f"开始处理句子 {i + 1}/{len(sentences)} (进度: {progress:.1f}%)", "INFO", task_id)
+            audio_data, _ = generate_sentence_audio(sentence, ref_audio_path, task_id, index)
+            if audio_data:
+                log_with_timestamp(f"✓ 句子 {index} 完成", "INFO", task_id)
 
-            # 生成当前句子
-            audio_data, audio_path = generate_sentence_with_script(
-                sentence, ref_audio_path, task_id, i
-            )
+            self._finish_if_done(task_id)
+            self.notify()
 
-            if audio_data:
-                # 计算当前进度
-                current_progress = ((i + 1) / len(sentences)) * 100
-                log_with_timestamp(f"✓ 句子 {i} 完成，进度: {current_progress:.1f}%", "INFO", task_id)
+    def _finish_if_done(self, task_id: str):
+        task = self.manager.get_task(task_id)
+        if task is None:
+            return
+        with self.manager.lock:
+            if task['finished_count'] < task['total_sentences'] or task['status'] == 'completed':
+                return
+            self.manager.mark_task_completed(task_id)
 
-        # 标记任务完成
-        sentence_manager.mark_task_completed(task_id)
         log_with_timestamp(f"✓ 任务 {task_id} 所有句子处理完成", "INFO", task_id)
-
-        # 记录总耗时
-        total_time = time.time() - task_info['start_time']
+        total_time = time.time() - task['start_time']
         log_with_timestamp(f"任务总耗时: {total_time:.2f}秒", "INFO", task_id)
-        log_with_timestamp(f"平均每句子耗时: {total_time / len(sentences):.2f}秒", "INFO", task_id)
+        log_with_timestamp(f"平均每句子耗时: {total_time / task['total_sentences']:.2f}秒", "INFO", task_id)
+
+
+# 全局句子调度器
+sentence_scheduler = SentenceScheduler(sentence_manager, num_workers=SENTENCE_WORKERS, lookahead=SENTENCE_LOOKAHEAD)
 
-    except Exception as e:
-        log_with_timestamp(f"任务 {task_id} 处理失败: {e}", "ERROR", task_id)
-        sentence_manager.cleanup(task_id)
+
+def schedule_sentences(sentences: List[str], ref_audio_path: str, task_id: str, stream: bool = False):
+    """创建任务并交给调度器处理"""
+    log_with_timestamp(f"任务 {task_id} 开始处理 {len(sentences)} 个句子", "INFO", task_id)
+    sentence_manager.create_task(task_id, sentences, ref_audio_path, stream=stream)
+    if not sentences:
+        sentence_manager.mark_task_completed(task_id)
+        return
+    sentence_scheduler.submit(task_id)
 
 
 @app.get("/")
@@ -543,14 +797,15 @@ async def root():
     return {
         "message": "GPT-SoVITS顺序语音API",
         "version": "3.2.0",
-        "features": ["顺序语音生成", "智能文本分割", "无缝播放衔接", "script1.py集成"],
+        "features": ["顺序语音生成", "智能文本分割", "无缝播放衔接", "常驻合成引擎"],
+        "synthesis_backend": synthesis_engine.name,
         "status": "ready",
         "log_file": str(log_file_path)
     }
 
 
 @app.post("/process")
-async def process_text(request: TextRequest, background_tasks: BackgroundTasks):
+async def process_text(request: TextRequest):
     """
     处理文本并开始语音生成
     """
@@ -559,7 +814,7 @@ async def process_text(request: TextRequest, background_tasks: BackgroundTasks):
             raise HTTPException(status_code=400, detail="文本内容不能为空")
 
         # 检查参考音频文件
-        ref_audio_path = Path(request.ref_audio_path)
+        ref_audio_path = Path(request.ref_audio_path).resolve()
         if not ref_audio_path.exists():
             stored_path = STORAGE_DIR / ref_audio_path.name
             if stored_path.exists():
@@ -567,13 +822,6 @@ async def process_text(request: TextRequest, background_tasks: BackgroundTasks):
             else:
                 raise HTTPException(status_code=404, detail="参考音频文件不存在")
 
-        # 检查script1.py是否存在
-        if not SCRIPT_PATH.exists():
-            raise HTTPException(
-                status_code=500,
-                detail="script1.py不存在，请确保它在后端目录中"
-            )
-
         # 生成任务ID
         task_id = f"task_{uuid.uuid4().hex[:8]}"
 
@@ -594,13 +842,8 @@ async def process_text(request: TextRequest, background_tasks: BackgroundTasks):
         sentences = split_text_by_sentences(request.text)
         log_with_timestamp(f"文本切分为 {len(sentences)} 个句子", "INFO", task_id)
 
-        # 在后台开始顺序处理
-        background_tasks.add_task(
-            process_sentences_sequential,
-            text=request.text,
-            ref_audio_path=str(ref_audio_path),
-            task_id=task_id
-        )
+        # 交给调度器后台处理，句子按顺序交付
+        schedule_sentences(sentences, str(ref_audio_path), task_id, stream=request.stream)
 
         log_with_timestamp(f"任务已开始后台处理，总句子数: {len(sentences)}", "INFO", task_id)
 
@@ -610,7 +853,8 @@ async def process_text(request: TextRequest, background_tasks: BackgroundTasks):
             "message": "顺序语音生成已开始",
             "sentences_count": len(sentences),
             "sentences": sentences,
-            "mode": "sequential",
+            "mode": "pipelined",
+            "stream_url": f"/ws/task/{task_id}",
             "created_at": datetime.now().isoformat(),
             "log_file": str(log_file_path)
         }
@@ -645,7 +889,8 @@ async def get_task_audios(task_id: str):
 
     audio_files = []
 
-    for i in range(task['total_sentences']):
+    # 只列出重排缓冲区中已按顺序就绪的句子
+    for i in range(task['ready_index']):
         if task['audio_paths'][i] and Path(task['audio_paths'][i]).exists():
             audio_path = task['audio_paths'][i]
             filename = Path(audio_path).name
@@ -668,6 +913,7 @@ async def get_task_audios(task_id: str):
         "task_id": task_id,
         "total_sentences": task['total_sentences'],
         "completed_count": task['completed_count'],
+        "ready_index": task['ready_index'],
         "status": task['status'],
         "audio_files": audio_files
     }
@@ -699,6 +945,16 @@ async def serve_audio_file(task_id: str, filename: str):
 
         if file_path.exists() and file_path.is_file():
             log_with_timestamp(f"提供音频文件: {file_path}", "INFO")
+
+            # 客户端取走音频后推进背压窗口，让调度器继续生成后续句子
+            task = sentence_manager.get_task(task_id)
+            if task:
+                for i, audio_path in enumerate(task['audio_paths']):
+                    if audio_path and Path(audio_path).name == filename:
+                        sentence_manager.mark_delivered(task_id, i)
+                        sentence_scheduler.notify()
+                        break
+
             return FileResponse(
                 file_path,
                 media_type="audio/wav",
@@ -713,6 +969,79 @@ async def serve_audio_file(task_id: str, filename: str):
         raise HTTPException(status_code=500, detail=f"文件服务错误: {str(e)}")
 
 
+# 流式音频帧头：句子序号、块序号、采样率（小端uint32），其后为16位单声道PCM
+STREAM_FRAME_HEADER = struct.Struct("<III")
+
+
+@app.websocket("/ws/task/{task_id}")
+async def stream_task_audio(websocket: WebSocket, task_id: str):
+    """
+    按句子顺序推送任务的音频块
+
+    文本消息为JSON事件 (task_start / sentence_end / task_end)，
+    二进制消息为 STREAM_FRAME_HEADER + PCM 数据。
+    """
+    await websocket.accept()
+    task = sentence_manager.get_task(task_id)
+    if not task:
+        await websocket.send_json({"type": "error", "message": "任务不存在或已结束"})
+        await websocket.close()
+        return
+
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    sentence_manager.add_listener(task_id, loop, event)
+    log_with_timestamp("流式连接已建立", "INFO", task_id)
+
+    try:
+        await websocket.send_json({
+            "type": "task_start",
+            "task_id": task_id,
+            "total_sentences": task['total_sentences'],
+            "sentences": task['sentences'],
+            "format": "pcm_s16le",
+            "channels": 1
+        })
+
+        sentence_index = 0
+        chunk_index = 0
+        sent_bytes = 0
+        while sentence_index < task['total_sentences']:
+            event.clear()
+            chunks, status, sample_rate = sentence_manager.read_chunks(task_id, sentence_index, chunk_index, sent_bytes)
+
+            for pcm in chunks:
+                await websocket.send_bytes(STREAM_FRAME_HEADER.pack(sentence_index, chunk_index, sample_rate) + pcm)
+                chunk_index += 1
+                sent_bytes += len(pcm)
+
+            # 句子状态在最后一个音频块之后才更新，因此此时已发送完整个句子
+            if status in ('completed', 'error'):
+                await websocket.send_json({
+                    "type": "sentence_end",
+                    "sentence_index": sentence_index,
+                    "status": status,
+                    "chunk_count": chunk_index
+                })
+                sentence_manager.mark_delivered(task_id, sentence_index)
+                sentence_manager.release_chunks(task_id, sentence_index)
+                sentence_scheduler.notify()
+                sentence_index += 1
+                chunk_index = 0
+                sent_bytes = 0
+            elif not chunks:
+                await event.wait()
+
+        await websocket.send_json({"type": "task_end", "task_id": task_id, "status": "completed"})
+        await websocket.close()
+        log_with_timestamp("流式推送完成", "INFO", task_id)
+
+    except WebSocketDisconnect:
+        log_with_timestamp("流式连接已断开", "WARNING", task_id)
+    finally:
+        sentence_manager.remove_listener(task_id, loop, event)
+
+
 # 文件上传端点
 @app.post("/upload")
 async def upload_audio(file: UploadFile = File(...)):
@@ -754,9 +1083,17 @@ async def upload_audio(file: UploadFile = File(...)):
 async def startup_event():
     logger.info("启动GPT-SoVITS顺序语音API v3.2...")
     logger.info(f"存储目录: {STORAGE_DIR}")
-    logger.info(f"脚本路径: {SCRIPT_PATH}")
     logger.info(f"日志文件: {log_file_path}")
-    logger.info("模式: 直接调用script1.py生成音频")
+    logger.info(f"模式: 常驻合成引擎({synthesis_engine.name})生成音频")
+    logger.info(f"调度: {SENTENCE_WORKERS} 个工作线程, 每个任务预生成 {SENTENCE_LOOKAHEAD} 个句子")
+    synthesis_engine.start()
+    sentence_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    sentence_scheduler.shutdown()
+    synthesis_engine.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,12 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import argparse
 import os
 import sys
 from pathlib import Path
 import shutil
+import struct
 import uuid
 from io import BytesIO
 import traceback
@@ -12,6 +14,9 @@ import traceback
 # 设置固定的输出目录
 FIXED_OUTPUT_DIR = Path(r"C:\Users\24021\Desktop\backend\voice_and_output")
 
+# 标准PCM WAV文件头长度
+WAV_HEADER_SIZE = 44
+
 
 # 如果选择利用script1.py直接生成的话，修改路径如下
 # ROOT_DIR = Path(__file__).parent  获取当前脚本所在目录的父目录（根目录）
@@ -20,13 +25,14 @@ FIXED_OUTPUT_DIR = Path(r"C:\Users\24021\Desktop\backend\voice_and_output")
 class GPTSoVITSClientV2:
     """GPT-SoVITS API客户端类 (v2版本)"""
 
-    def __init__(self, base_url="http://127.0.0.1:9880", output_dir=None):
+    def __init__(self, base_url="http://127.0.0.1:9880", output_dir=None, pool_size=4):
         """
         初始化客户端
 
         Args:
             base_url: API服务地址，默认 http://127.0.0.1:9880
             output_dir: 输出目录，如果为None则使用固定目录
+            pool_size: 连接池大小，长驻进程中复用keep-alive连接
         """
         self.base_url = base_url.rstrip('/')
         self.tts_endpoint = "/tts"
@@ -44,10 +50,20 @@ class GPTSoVITSClientV2:
         # 确保输出目录存在
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        # 共享的HTTP会话，连接在多次请求之间保持复用
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
     def check_connection(self, timeout=5):
         """检查API服务是否可用"""
         try:
-            response = requests.get(f"{self.base_url}{self.tts_endpoint}", timeout=timeout)
+            response = self.session.get(f"{self.base_url}{self.tts_endpoint}", timeout=timeout)
             return True
         except requests.exceptions.ConnectionError:
             return False
@@ -100,7 +116,7 @@ class GPTSoVITSClientV2:
                 params[key] = value
 
         try:
-            response = requests.get(f"{self.base_url}{self.tts_endpoint}", params=params, timeout=300)
+            response = self.session.get(f"{self.base_url}{self.tts_endpoint}", params=params, timeout=300)
 
             if response.status_code == 200:
                 return response.content
@@ -119,6 +135,67 @@ class GPTSoVITSClientV2:
         except requests.exceptions.RequestException as e:
             raise Exception(f"请求失败: {e}")
 
+    def text_to_speech_stream(self, text, text_lang, ref_audio_path, streaming_mode=2, chunk_size=4096, **kwargs):
+        """
+        流式文本转语音，边合成边返回PCM数据
+
+        Args:
+            text: 要合成的文本
+            text_lang: 文本语言
+            ref_audio_path: 参考音频路径
+            streaming_mode: api_v2.py 的流式模式 (1/2/3)
+            chunk_size: 每次读取的字节数
+            **kwargs: 其他可选参数，同 text_to_speech
+
+        Yields:
+            (sample_rate, pcm_bytes): 采样率和16位单声道PCM数据
+        """
+        params = {
+            "text": text,
+            "text_lang": text_lang.lower() if text_lang else "zh",
+            "ref_audio_path": ref_audio_path,
+            "prompt_text": kwargs.pop("prompt_text", ""),
+            "prompt_lang": kwargs.pop("prompt_lang", text_lang.lower() if text_lang else "zh"),
+            "streaming_mode": streaming_mode,
+            "media_type": "wav",
+            "parallel_infer": False,
+            "split_bucket": False,
+        }
+        params.update({key: value for key, value in kwargs.items() if value is not None})
+
+        try:
+            response = self.session.get(f"{self.base_url}{self.tts_endpoint}", params=params, timeout=300, stream=True)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"请求失败: {e}")
+
+        with response:
+            if response.status_code != 200:
+                try:
+                    error_msg = f"语音合成失败: {response.json().get('message', '未知错误')}"
+                except:
+                    error_msg = f"语音合成失败，HTTP状态码: {response.status_code}"
+                raise Exception(error_msg)
+
+            # 流式wav以一个不含数据的44字节头开始，之后是裸PCM
+            header = b""
+            sample_rate = None
+            remainder = b""
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                if sample_rate is None:
+                    header += chunk
+                    if len(header) < WAV_HEADER_SIZE:
+                        continue
+                    sample_rate = struct.unpack("<I", header[24:28])[0]
+                    chunk = header[WAV_HEADER_SIZE:]
+                # 保证每次输出的都是完整的16位采样
+                chunk = remainder + chunk
+                cut = len(chunk) - len(chunk) % 2
+                chunk, remainder = chunk[:cut], chunk[cut:]
+                if chunk:
+                    yield sample_rate, chunk
+
     def save_audio(self, audio_data, output_filename=None):
         """
         保存音频数据到指定目录